@@ -1,56 +1,100 @@
-import json
-from typing import Final
+import asyncio
+import math
+from datetime import datetime
+from typing import Final, Literal, Optional
 
 import fastapi
 import structlog
+from fastapi.responses import StreamingResponse
 from redis.asyncio import Redis
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.core.db import get_db
-from app.core.kafka_config import get_kafka_producer
+from app.core.db import get_async_db
 from app.core.limiter import limiter
 from app.core.redis import get_redis_pool
-from app.schemas.price import PollRequest, PollResponse, PriceLatest, RateLimitError
-from app.services import crud, market_provider
+from app.schemas.price import (
+    PollRequest,
+    PollResponse,
+    PriceLatest,
+    PriceLatestBatch,
+    RateLimitError,
+)
+from app.services import crud, history, market_provider, price_service
+from app.services.price_service import price_cache_key
+from app.services.price_stream import (
+    STREAM_DISCONNECT_CHECK_SECONDS,
+    STREAM_HEARTBEAT_SECONDS,
+    Subscription,
+    get_price_stream_hub,
+)
+from app.services.scheduler import (
+    MIN_INTERVAL_SECONDS,
+    PollingJob,
+    PollingScheduler,
+    get_scheduler,
+)
 
 router = fastapi.APIRouter(prefix="/prices", tags=["Prices"])
 
-TOPIC: Final[str] = "price-events"
 logger = structlog.get_logger(__name__)
 
+MAX_BATCH_SYMBOLS: Final[int] = 500
+MAX_STREAM_SYMBOLS: Final[int] = 500
+
+RATE_LIMIT_RESPONSES: Final[dict] = {
+    429: {
+        "model": RateLimitError,
+        "description": "Rate limit exceeded. The client has sent too many requests in a given amount of time.",
+        "headers": {
+            "Retry-After": {
+                "description": "The number of seconds to wait before making a new request.",
+                "schema": {"type": "integer"},
+            }
+        },
+    }
+}
+
+
+def parse_symbols(symbols: list[str]) -> list[str]:
+    """Splits repeated or comma separated symbols, deduplicated in the order given."""
+    return list(
+        dict.fromkeys(
+            s.strip() for value in symbols for s in value.split(",") if s.strip()
+        )
+    )
+
 
 @router.get(
     "/latest",
     response_model=PriceLatest,
-    responses={
-        429: {
-            "model": RateLimitError,
-            "description": "Rate limit exceeded. The client has sent too many requests in a given amount of time.",
-            "headers": {
-                "Retry-After": {
-                    "description": "The number of seconds to wait before making a new request.",
-                    "schema": {"type": "integer"},
-                }
-            },
-        }
-    },
+    responses=RATE_LIMIT_RESPONSES,
 )
-@limiter.limit("5/minute")
+@limiter.limit("5/minute", scope="latest")
 async def get_latest_price(
     request: fastapi.Request,
     symbol: str,
     provider_name: str = "yfinance",
-    db: Session = fastapi.Depends(get_db),
     redis: Redis = fastapi.Depends(get_redis_pool),
 ):
-    cache_key = f"price:{symbol}:{provider_name}"
-    cached_price = await redis.get(cache_key)
+    cache_key = price_cache_key(symbol, provider_name)
+    price_service.track_request(symbol, provider_name)
+    cached_price = await price_service.get_cached_price(redis, cache_key)
 
     if cached_price:
-        logger.info(
-            "CACHE HIT: Returning cached data", symbol=symbol, provider=provider_name
-        )
-        return json.loads(cached_price)
+        if price_service.is_stale(cached_price):
+            logger.info(
+                "CACHE STALE: Returning cached data and refreshing",
+                symbol=symbol,
+                provider=provider_name,
+            )
+            price_service.schedule_refresh(symbol, provider_name, redis)
+        else:
+            logger.info(
+                "CACHE HIT: Returning cached data",
+                symbol=symbol,
+                provider=provider_name,
+            )
+        return cached_price["price"]
 
     logger.info(
         "CACHE MISS: Fetching latest data", symbol=symbol, provider=provider_name
@@ -67,8 +111,24 @@ async def get_latest_price(
         )
         raise fastapi.HTTPException(status_code=400, detail=str(e))
 
-    price_data = provider_service.get_latest_price(symbol)
-    if not price_data:
+    try:
+        response_data = await price_service.load_latest_price(
+            symbol, provider_name, provider_service, redis
+        )
+    except market_provider.ProviderUnavailableError as e:
+        logger.error(
+            "Market provider unavailable", provider=provider_name, symbol=symbol
+        )
+        raise fastapi.HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers=(
+                {"Retry-After": str(math.ceil(e.retry_after))}
+                if e.retry_after is not None
+                else None
+            ),
+        )
+    if not response_data:
         logger.error(
             "Price data not found", symbol=symbol, provider=provider_name, exc_info=True
         )
@@ -78,56 +138,313 @@ async def get_latest_price(
             from provider '{provider_name}'.""",
         )
 
-    raw_response = crud.create_raw_response(
-        db=db, symbol=symbol, provider=provider_name, response_data=price_data
+    return response_data
+
+
+async def _lookup_cached_prices(
+    symbols: list[str], provider_name: str, redis: Redis
+) -> tuple[dict[str, PriceLatest], list[str], list[str]]:
+    """
+    Looks the symbols up in the cache, locally or with a single MGET round
+    trip. Returns the cached prices, the stale symbols among them and the
+    symbols that were not cached.
+    """
+    cache_keys = [price_cache_key(symbol, provider_name) for symbol in symbols]
+    cached_prices = await price_service.get_cached_prices(redis, cache_keys)
+
+    results: dict[str, PriceLatest] = {}
+    stale = []
+    misses = []
+    for symbol, cached_price in zip(symbols, cached_prices):
+        if cached_price:
+            results[symbol] = PriceLatest.model_validate(cached_price["price"])
+            if price_service.is_stale(cached_price):
+                stale.append(symbol)
+        else:
+            misses.append(symbol)
+    return results, stale, misses
+
+
+async def _fetch_missing_prices(
+    misses: list[str],
+    provider_name: str,
+    provider_service: market_provider.MarketProvider,
+    redis: Redis,
+) -> dict[str, PriceLatest]:
+    """
+    Fetches cache misses with one multi-symbol provider call. If the
+    provider is unavailable they are reported as missing.
+    """
+    try:
+        return await price_service.refresh_latest_prices(
+            misses, provider_name, provider_service, redis
+        )
+    except market_provider.ProviderUnavailableError:
+        logger.error(
+            "Market provider unavailable", provider=provider_name, misses=len(misses)
+        )
+        return {}
+
+
+@router.get(
+    "/latest/batch",
+    response_model=PriceLatestBatch,
+    responses=RATE_LIMIT_RESPONSES,
+)
+@limiter.limit("5/minute", scope="latest_batch")
+async def get_latest_prices(
+    request: fastapi.Request,
+    symbols: list[str] = fastapi.Query(
+        ..., description="Symbols to fetch, repeated or comma separated."
+    ),
+    provider_name: str = "yfinance",
+    redis: Redis = fastapi.Depends(get_redis_pool),
+):
+    requested = parse_symbols(symbols)
+    if not requested:
+        raise fastapi.HTTPException(status_code=400, detail="No symbols given.")
+    if len(requested) > MAX_BATCH_SYMBOLS:
+        raise fastapi.HTTPException(
+            status_code=400,
+            detail=f"At most {MAX_BATCH_SYMBOLS} symbols can be requested at once.",
+        )
+
+    results, stale, misses = await _lookup_cached_prices(
+        requested, provider_name, redis
     )
-    processed_price = crud.create_processed_price(
-        db=db, raw_response=raw_response, price=price_data["price"]
+    logger.info(
+        "Batch price lookup",
+        provider=provider_name,
+        hits=len(results) - len(stale),
+        stale=len(stale),
+        misses=len(misses),
     )
-    db.commit()
-
-    producer = get_kafka_producer()
-    message = {
-        "symbol": processed_price.symbol,
-        "price": processed_price.price,
-        "timestamp": processed_price.timestamp.strftime("%Y-%m-%dT%H:%M:%SZ"),
-        "source": provider_name,
-        "raw_response_id": str(raw_response.id),
-    }
-    producer.produce(
-        TOPIC, key=message["symbol"], value=json.dumps(message).encode("utf-8")
+
+    try:
+        provider_service = market_provider.get_provider(provider_name)
+    except ValueError as e:
+        logger.error(
+            "Failed to get market provider",
+            provider=provider_name,
+            error=str(e),
+            exc_info=True,
+        )
+        raise fastapi.HTTPException(status_code=400, detail=str(e))
+
+    if stale:
+        price_service.schedule_batch_refresh(stale, provider_name, redis)
+    if misses:
+        results.update(
+            await _fetch_missing_prices(misses, provider_name, provider_service, redis)
+        )
+
+    return PriceLatestBatch(
+        prices=[results[symbol] for symbol in requested if symbol in results],
+        missing=[symbol for symbol in requested if symbol not in results],
     )
-    producer.flush()
 
-    response_data = PriceLatest(
-        symbol=processed_price.symbol,
-        price=processed_price.price,
-        timestamp=processed_price.timestamp,
-        provider=processed_price.provider,
+
+@router.get(
+    "/history",
+    responses={
+        200: {
+            "description": "OHLC/mean buckets, one per line.",
+            "content": {"application/x-ndjson": {}, "text/csv": {}},
+        },
+        **RATE_LIMIT_RESPONSES,
+    },
+)
+@limiter.limit("10/minute", scope="history")
+async def get_price_history(
+    request: fastapi.Request,
+    symbol: str,
+    start: datetime,
+    end: Optional[datetime] = None,
+    interval: str = fastapi.Query(
+        "1m", description=f"Bucket size, one of {', '.join(history.INTERVALS)}."
+    ),
+    format: Literal["ndjson", "csv"] = "ndjson",
+):
+    if interval not in history.INTERVALS:
+        raise fastapi.HTTPException(
+            status_code=400,
+            detail=f"Unsupported interval '{interval}'. "
+            f"Use one of {', '.join(history.INTERVALS)}.",
+        )
+
+    # Prices are stored as naive local timestamps.
+    start = start.astimezone().replace(tzinfo=None) if start.tzinfo else start
+    end = end or datetime.now()
+    end = end.astimezone().replace(tzinfo=None) if end.tzinfo else end
+    if start >= end:
+        raise fastapi.HTTPException(
+            status_code=400, detail="'start' must be before 'end'."
+        )
+
+    logger.info(
+        "Streaming price history",
+        symbol=symbol,
+        start=start.isoformat(),
+        end=end.isoformat(),
+        interval=interval,
+        format=format,
+    )
+    return StreamingResponse(
+        history.stream_price_history(symbol, start, end, interval, format),
+        media_type="text/csv" if format == "csv" else "application/x-ndjson",
     )
 
-    await redis.set(cache_key, response_data.model_dump_json(), ex=60)
 
-    return response_data
+@router.websocket("/stream")
+async def stream_prices_websocket(
+    websocket: fastapi.WebSocket,
+    symbols: list[str] = fastapi.Query(...),
+    mode: Literal["conflate", "drop"] = "conflate",
+):
+    hub = get_price_stream_hub()
+    requested = parse_symbols(symbols)
+    if hub is None or not requested or len(requested) > MAX_STREAM_SYMBOLS:
+        await websocket.close(code=fastapi.status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept()
+    subscription = hub.subscribe(requested, mode)
+
+    async def receive():
+        # Client messages are ignored; this only notices the disconnect.
+        while True:
+            await websocket.receive_text()
+
+    receiver = asyncio.create_task(receive())
+    getter = None
+    try:
+        while True:
+            # Waits on the receiver too, so a disconnect ends the stream at
+            # once rather than on the next update or heartbeat.
+            getter = asyncio.create_task(
+                subscription.get(timeout=STREAM_HEARTBEAT_SECONDS)
+            )
+            await asyncio.wait({receiver, getter}, return_when=asyncio.FIRST_COMPLETED)
+            if receiver.done():
+                receiver.result()  # Raises the WebSocketDisconnect
+                break
+            payload = getter.result()
+            if payload is not None:
+                await websocket.send_text(payload)
+    except fastapi.WebSocketDisconnect:
+        pass
+    finally:
+        hub.unsubscribe(subscription)
+        receiver.cancel()
+        if getter is not None:
+            getter.cancel()
+        logger.info(
+            "Price stream closed",
+            transport="websocket",
+            symbols=len(requested),
+            dropped=subscription.dropped,
+        )
+
+
+@router.get(
+    "/stream",
+    responses={
+        200: {
+            "description": "Server-sent price events for the requested symbols.",
+            "content": {"text/event-stream": {}},
+        },
+        **RATE_LIMIT_RESPONSES,
+    },
+)
+@limiter.limit("10/minute", scope="stream")
+async def stream_prices_sse(
+    request: fastapi.Request,
+    symbols: list[str] = fastapi.Query(
+        ..., description="Symbols to follow, repeated or comma separated."
+    ),
+    mode: Literal["conflate", "drop"] = fastapi.Query(
+        "conflate",
+        description="For slow clients: keep only the latest update per symbol, "
+        "or queue every update and drop the oldest.",
+    ),
+):
+    hub = get_price_stream_hub()
+    if hub is None:
+        raise fastapi.HTTPException(
+            status_code=503, detail="Price streaming is disabled."
+        )
+    requested = parse_symbols(symbols)
+    if not requested:
+        raise fastapi.HTTPException(status_code=400, detail="No symbols given.")
+    if len(requested) > MAX_STREAM_SYMBOLS:
+        raise fastapi.HTTPException(
+            status_code=400,
+            detail=f"At most {MAX_STREAM_SYMBOLS} symbols can be streamed at once.",
+        )
+
+    async def events():
+        subscription: Subscription = hub.subscribe(requested, mode)
+        loop = asyncio.get_running_loop()
+        last_sent = loop.time()
+        try:
+            # Short waits, so a disconnect frees the subscription within a
+            # second rather than on the next heartbeat write.
+            while not await request.is_disconnected():
+                payload = await subscription.get(
+                    timeout=STREAM_DISCONNECT_CHECK_SECONDS
+                )
+                if payload is None:
+                    if loop.time() - last_sent < STREAM_HEARTBEAT_SECONDS:
+                        continue
+                    yield ": keep-alive\n\n"
+                else:
+                    yield f"data: {payload}\n\n"
+                last_sent = loop.time()
+        finally:
+            hub.unsubscribe(subscription)
+            logger.info(
+                "Price stream closed",
+                transport="sse",
+                symbols=len(requested),
+                dropped=subscription.dropped,
+            )
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @router.post(
     "/poll", status_code=fastapi.status.HTTP_202_ACCEPTED, response_model=PollResponse
 )
-@limiter.limit("10/minute")
+@limiter.limit("10/minute", scope="poll")
 async def poll_prices(
     request: fastapi.Request,
     poll_req: PollRequest,
     background_tasks: fastapi.BackgroundTasks,
-    db: Session = fastapi.Depends(get_db),
+    db: AsyncSession = fastapi.Depends(get_async_db),
+    scheduler: PollingScheduler = fastapi.Depends(get_scheduler),
 ):
-    price_poll_config_id = crud.create_price_poll(
-        db,
+    price_poll_config_id = await db.run_sync(
+        crud.create_price_poll,
         symbols=poll_req.symbols,
         interval=poll_req.interval,
         provider=poll_req.provider,
     )
-    db.commit()
+    await db.commit()
+
+    # Start polling right away instead of waiting for the next config reload.
+    if scheduler:
+        scheduler.add_job(
+            PollingJob(
+                id=price_poll_config_id,
+                symbols=tuple(poll_req.symbols),
+                interval=max(poll_req.interval, MIN_INTERVAL_SECONDS),
+                provider=poll_req.provider,
+            )
+        )
 
     return {
         "job_id": f"poll_{price_poll_config_id}",
@@ -0,0 +1,68 @@
+import time
+from typing import Final
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit is open."""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuit for '{name}' is open")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Fails fast once an upstream keeps failing. After `failure_threshold`
+    consecutive failures the circuit opens and calls are rejected for
+    `reset_timeout` seconds. Then one trial call is let through (half-open):
+    success closes the circuit, failure opens it again. A trial that is
+    abandoned, or has not finished within `reset_timeout`, is replaced by
+    the next call, so the circuit never stays half-open for good.
+    """
+
+    CLOSED: Final[str] = "closed"
+    OPEN: Final[str] = "open"
+    HALF_OPEN: Final[str] = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_started_at = 0.0
+
+    def before_call(self):
+        """Raises CircuitOpenError if the call must not be made."""
+        if self.state == self.CLOSED:
+            return
+        now = time.monotonic()
+        # Open since _opened_at, or half-open with a trial running since
+        # _trial_started_at; either way a new trial waits for reset_timeout.
+        since = self._opened_at if self.state == self.OPEN else self._trial_started_at
+        elapsed = now - since
+        if elapsed >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self._trial_started_at = now
+            return
+        raise CircuitOpenError(self.name, self.reset_timeout - elapsed)
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self._failures = 0
+
+    def record_abandoned(self):
+        """
+        A call ended without an outcome, e.g. it was cancelled. If it was the
+        half-open trial, the next call becomes the trial.
+        """
+        if self.state == self.HALF_OPEN:
+            self._trial_started_at = time.monotonic() - self.reset_timeout
+
+    def record_failure(self):
+        self._failures += 1
+        if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
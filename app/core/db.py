@@ -3,6 +3,8 @@ import os
 import structlog
 from dotenv import load_dotenv
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -15,12 +17,24 @@ if not DATABASE_URL:
     logger.error("DATABASE_URL environment variable not set", exc_info=True)
     raise ValueError("DATABASE_URL environment variable not set")
 
+# The async engine uses asyncpg unless a dedicated URL is given.
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or make_url(DATABASE_URL).set(
+    drivername="postgresql+asyncpg"
+)
+
 # The engine is the entry point to the database.
 engine = create_engine(DATABASE_URL)
+async_engine = create_async_engine(ASYNC_DATABASE_URL)
 
 # A SessionLocal class is a factory for new Session objects.
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Objects stay usable after commit, since lazy refreshes cannot run
+# implicitly on an AsyncSession.
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, autoflush=False, expire_on_commit=False
+)
+
 # Base will be used by our ORM models to inherit from.
 Base = declarative_base()
 
@@ -33,3 +47,9 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+# Async counterpart of get_db, for endpoints that must not block the event loop.
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,42 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, TypeVar
+
+T = TypeVar("T")
+
+# Upper bound on threads doing blocking provider/broker work, so a slow
+# upstream cannot pile up an unbounded number of threads.
+BLOCKING_MAX_WORKERS = int(os.getenv("BLOCKING_MAX_WORKERS", "16"))
+
+blocking_executor: ThreadPoolExecutor = None
+
+
+def setup_executor():
+    """
+    Creates the bounded executor for blocking calls. To be called at application startup.
+    """
+    global blocking_executor
+    blocking_executor = ThreadPoolExecutor(
+        max_workers=BLOCKING_MAX_WORKERS, thread_name_prefix="blocking"
+    )
+
+
+def close_executor():
+    """
+    Shuts the executor down. To be called at application shutdown.
+    """
+    if blocking_executor:
+        blocking_executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def run_blocking(fn: Callable[..., T], *args, **kwargs) -> T:
+    """
+    Runs a blocking function on the bounded executor without stalling the
+    event loop. Falls back to the loop's default executor before startup.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        blocking_executor, functools.partial(fn, *args, **kwargs)
+    )
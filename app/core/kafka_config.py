@@ -1,7 +1,119 @@
+import asyncio
+import os
+from typing import Optional
+
+import structlog
 from confluent_kafka import Producer
 
+from app.core.executor import run_blocking
+from app.core.metrics import KAFKA_DELIVERY_SECONDS, KAFKA_MESSAGES
+
+logger = structlog.get_logger(__name__)
+
+KAFKA_BOOTSTRAP_SERVERS = os.getenv("KAFKA_BOOTSTRAP_SERVERS", "kafka:29092")
+# How often the background task serves delivery reports.
+KAFKA_POLL_INTERVAL_SECONDS = 0.1
+KAFKA_SHUTDOWN_FLUSH_SECONDS = 10
+
+delivery_stats = {"delivered": 0, "failed": 0}
+
+
+def _on_delivery(err, msg):
+    """Delivery report callback, served by the background poll task."""
+    if err is not None:
+        delivery_stats["failed"] += 1
+        KAFKA_MESSAGES.labels(msg.topic(), "failed").inc()
+        logger.error(
+            "Kafka delivery failed",
+            topic=msg.topic(),
+            key=msg.key(),
+            error=str(err),
+            failed_total=delivery_stats["failed"],
+        )
+        return
+    delivery_stats["delivered"] += 1
+    KAFKA_MESSAGES.labels(msg.topic(), "delivered").inc()
+    latency = msg.latency()
+    if latency is not None:
+        KAFKA_DELIVERY_SECONDS.labels(msg.topic()).observe(latency)
+
+
+def build_producer_conf() -> dict:
+    """Producer settings tuned for small, frequent price events."""
+    return {
+        "bootstrap.servers": KAFKA_BOOTSTRAP_SERVERS,
+        "linger.ms": int(os.getenv("KAFKA_LINGER_MS", "20")),
+        "batch.num.messages": int(os.getenv("KAFKA_BATCH_NUM_MESSAGES", "10000")),
+        "compression.type": os.getenv("KAFKA_COMPRESSION_TYPE", "lz4"),
+        "queue.buffering.max.messages": 100000,
+        # Keeps per-symbol ordering intact when the client retries.
+        "enable.idempotence": True,
+        "on_delivery": _on_delivery,
+    }
+
+
+kafka_producer: Producer = None
+_poll_task: Optional[asyncio.Task] = None
+
+
+def get_kafka_producer() -> Producer:
+    """
+    Returns the process-wide producer. Outside the app lifespan (scripts,
+    tests) it is created on first use.
+    """
+    global kafka_producer
+    if kafka_producer is None:
+        kafka_producer = Producer(build_producer_conf())
+    return kafka_producer
+
+
+def produce(producer: Producer, topic: str, key: str, value: bytes):
+    """
+    Queues a message without waiting on the broker. If the local queue is
+    full, delivery reports are served once and the produce is retried.
+    """
+    try:
+        producer.produce(topic, key=key, value=value)
+    except BufferError:
+        producer.poll(0)
+        try:
+            producer.produce(topic, key=key, value=value)
+        except BufferError:
+            delivery_stats["failed"] += 1
+            KAFKA_MESSAGES.labels(topic, "dropped").inc()
+            logger.error("Kafka producer queue full, dropping event", topic=topic)
+
+
+async def _poll_loop(producer: Producer):
+    while True:
+        producer.poll(0)
+        await asyncio.sleep(KAFKA_POLL_INTERVAL_SECONDS)
+
+
+async def setup_kafka_producer():
+    """
+    Creates the shared producer and its delivery report task. To be called at application startup.
+    """
+    global _poll_task
+    producer = get_kafka_producer()
+    _poll_task = asyncio.create_task(_poll_loop(producer))
+    print("Kafka producer initialized.")
+
 
-def get_kafka_producer():
-    producer_conf = {"bootstrap.servers": "kafka:29092"}
-    # producer_conf = {'bootstrap.servers': 'localhost:9092'}
-    return Producer(producer_conf)
+async def close_kafka_producer():
+    """
+    Stops the delivery report task and flushes queued events. To be called at application shutdown.
+    """
+    global kafka_producer, _poll_task
+    if _poll_task:
+        _poll_task.cancel()
+        await asyncio.gather(_poll_task, return_exceptions=True)
+        _poll_task = None
+    if kafka_producer:
+        remaining = await run_blocking(
+            kafka_producer.flush, KAFKA_SHUTDOWN_FLUSH_SECONDS
+        )
+        if remaining:
+            logger.error("Kafka events not delivered at shutdown", count=remaining)
+        kafka_producer = None
+        print("Kafka producer closed.")
@@ -1,33 +1,269 @@
+import asyncio
+import functools
+import math
 import os
+import re
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional
 
+import structlog
 from dotenv import load_dotenv
-from slowapi import Limiter
-from slowapi.errors import RateLimitExceeded
+from redis.asyncio import Redis
 from starlette.requests import Request
 from starlette.responses import JSONResponse
 
+from app.core.local_cache import LocalCache
+from app.core.metrics import (
+    LOCAL_CACHES,
+    RATE_LIMIT_LOCAL_ALLOWED,
+    RATE_LIMIT_LOCAL_REJECTED,
+    RATE_LIMIT_REDIS_ALLOWED,
+    RATE_LIMIT_REDIS_REJECTED,
+    REDIS_RATE_LIMIT_SECONDS,
+)
+from app.core.redis import get_redis_pool
+
 load_dotenv()
 
-REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379")
+logger = structlog.get_logger(__name__)
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+# Clients far enough under their limit lease this fraction of it at once and
+# spend it locally for up to RATE_LIMIT_LEASE_SECONDS, without Redis. Leases
+# are whole tokens, so limits below 2 / RATE_LIMIT_LEASE_FRACTION per period
+# (20 by default, which covers every route's default) never lease. Tokens
+# still unspent when a lease expires are given back.
+RATE_LIMIT_LEASE_FRACTION = float(os.getenv("RATE_LIMIT_LEASE_FRACTION", "0.1"))
+RATE_LIMIT_LEASE_SECONDS = float(os.getenv("RATE_LIMIT_LEASE_SECONDS", "1"))
+RATE_LIMIT_LOCAL_MAX_ENTRIES = int(os.getenv("RATE_LIMIT_LOCAL_MAX_ENTRIES", "10000"))
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+_LIMIT_PATTERN = re.compile(
+    r"^\s*(\d+)\s*(?:/|per)\s*(\d*)\s*(second|minute|hour|day)s?\s*$"
+)
+
+# GCRA: the key holds the theoretical arrival time (TAT) of the next request,
+# which each granted request pushes `interval` seconds further. Requests are
+# allowed while the TAT stays within one period of now. Up to ARGV[3] tokens
+# are granted at once, but only while at least twice that many are free, so
+# clients near their limit are always counted one request at a time. Returns
+# the tokens granted, or 0 and the seconds until one is free.
+_GCRA_SCRIPT = """
+local clock = redis.call("TIME")
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local interval = tonumber(ARGV[1])
+local period = tonumber(ARGV[2])
+local lease = tonumber(ARGV[3])
+local tat = math.max(tonumber(redis.call("GET", KEYS[1]) or 0), now)
+local available = math.floor((now + period - tat) / interval + 1e-9)
+if available < 1 then
+    return {0, tostring(tat + interval - period - now)}
+end
+local granted = 1
+if available >= 2 * lease then
+    granted = lease
+end
+local new_tat = tat + granted * interval
+redis.call("SET", KEYS[1], tostring(new_tat), "PX", math.ceil((new_tat - now) * 1000))
+return {granted, "0"}
+"""
+
+# Gives back ARGV[1] unspent tokens by moving the TAT that far back, but not
+# before now, since tokens that would already have been free again are gone.
+_REFUND_SCRIPT = """
+local clock = redis.call("TIME")
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local tat = tonumber(redis.call("GET", KEYS[1]) or 0)
+local new_tat = tat - tonumber(ARGV[1]) * tonumber(ARGV[2])
+if new_tat <= now then
+    redis.call("DEL", KEYS[1])
+    return 0
+end
+redis.call("SET", KEYS[1], tostring(new_tat), "PX", math.ceil((new_tat - now) * 1000))
+return 1
+"""
+
+
+class RateLimitExceeded(Exception):
+    """A client went over a route's limit; retry_after is in seconds."""
+
+    def __init__(self, limit: "RateLimit", retry_after: float):
+        super().__init__(f"Rate limit exceeded: {limit}")
+        self.limit = limit
+        self.retry_after = retry_after
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    amount: int
+    period: float
+
+    @classmethod
+    def parse(cls, value: str) -> "RateLimit":
+        """Parses limits such as "5/minute", "100 per second" or "10/5minutes"."""
+        match = _LIMIT_PATTERN.match(value.lower())
+        if not match or int(match.group(1)) < 1:
+            raise ValueError(f"Invalid rate limit '{value}'")
+        amount, multiple, unit = match.groups()
+        return cls(int(amount), int(multiple or 1) * PERIODS[unit])
+
+    @property
+    def interval(self) -> float:
+        return self.period / self.amount
+
+    @property
+    def lease(self) -> int:
+        return max(1, int(self.amount * RATE_LIMIT_LEASE_FRACTION))
+
+    def __str__(self) -> str:
+        return f"{self.amount} per {self.period:g} seconds"
+
+
+class _LocalBudget:
+    """Leased tokens of one client and route, or the time it is blocked until."""
+
+    __slots__ = ("tokens", "blocked_until", "expires_at")
+
+    def __init__(
+        self, tokens: int = 0, blocked_until: float = 0.0, expires_at: float = 0.0
+    ):
+        self.tokens = tokens
+        self.blocked_until = blocked_until
+        self.expires_at = expires_at
 
 
 def get_remote_address_key(request: Request) -> str:
     """
     A key function to identify the client by their remote address.
-    Includes a debug print statement to verify it's being called.
     """
-    client_host = "unknown"
     if request.client and request.client.host:
-        client_host = request.client.host
+        return request.client.host
+    return "unknown"
+
+
+class Limiter:
+    """
+    Per-route, per-client rate limits shared by all replicas through Redis.
+    Each check that reaches Redis is one atomic GCRA script call. Clients
+    well under their limit lease a few tokens and spend them locally, and
+    clients over it are rejected locally until their retry time, so most
+    requests never wait on Redis. Tokens left in an expired lease are given
+    back, so a client spread over several replicas is not rejected under its
+    limit because of leases it no longer spends.
+    """
+
+    def __init__(self, key_func=get_remote_address_key, enabled: bool = True):
+        self.key_func = key_func
+        self.enabled = enabled
+        self._local = LocalCache(RATE_LIMIT_LOCAL_MAX_ENTRIES, RATE_LIMIT_LEASE_SECONDS)
+        # Granted leases in expiry order, with their key and limit.
+        self._leases: deque[tuple[_LocalBudget, str, RateLimit]] = deque()
+        self._refunds: set[asyncio.Task] = set()
+        LOCAL_CACHES.register("rate_limit", self._local)
+        self._scripts: dict[tuple[int, str], object] = {}
+
+    def limit(self, default: str, scope: Optional[str] = None):
+        """
+        Decorates a route that takes a `request` argument. The limit can be
+        overridden with RATE_LIMIT_<SCOPE>, the scope being the function
+        name unless given.
+        """
+
+        def decorator(func):
+            name = scope or func.__name__
+            rate_limit = RateLimit.parse(
+                os.getenv(f"RATE_LIMIT_{name.upper()}", default)
+            )
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                request = kwargs.get("request")
+                if self.enabled and request is not None:
+                    await self.check(name, self.key_func(request), rate_limit)
+                return await func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    async def check(self, scope: str, client: str, rate_limit: RateLimit):
+        """Spends one request of a client's budget, or raises RateLimitExceeded."""
+        self._return_expired_leases()
+        key = f"ratelimit:{scope}:{client}"
+        budget = self._local.get(key)
+        if budget is not None:
+            if budget.tokens > 0:
+                budget.tokens -= 1
+                RATE_LIMIT_LOCAL_ALLOWED.inc()
+                return
+            remaining = budget.blocked_until - time.monotonic()
+            if remaining > 0:
+                RATE_LIMIT_LOCAL_REJECTED.inc()
+                raise RateLimitExceeded(rate_limit, remaining)
+
+        try:
+            with REDIS_RATE_LIMIT_SECONDS.time():
+                script = self._script(get_redis_pool(), _GCRA_SCRIPT)
+                granted, retry_after = await script(
+                    keys=[key],
+                    args=[rate_limit.interval, rate_limit.period, rate_limit.lease],
+                )
+        except Exception:
+            # Fail open: losing Redis should not take the API down with it.
+            logger.error("Rate limit check failed", key=key, exc_info=True)
+            return
+
+        granted = int(granted)
+        if granted:
+            RATE_LIMIT_REDIS_ALLOWED.inc()
+            if granted > 1:
+                budget = _LocalBudget(
+                    tokens=granted - 1,
+                    expires_at=time.monotonic() + RATE_LIMIT_LEASE_SECONDS,
+                )
+                self._local.set(key, budget)
+                self._leases.append((budget, key, rate_limit))
+            return
+
+        retry_after = float(retry_after)
+        self._local.set(
+            key,
+            _LocalBudget(blocked_until=time.monotonic() + retry_after),
+            ttl_seconds=retry_after,
+        )
+        RATE_LIMIT_REDIS_REJECTED.inc()
+        raise RateLimitExceeded(rate_limit, retry_after)
+
+    def _return_expired_leases(self):
+        """Gives the unspent tokens of expired leases back, in the background."""
+        now = time.monotonic()
+        while self._leases and self._leases[0][0].expires_at <= now:
+            budget, key, rate_limit = self._leases.popleft()
+            if budget.tokens > 0:
+                task = asyncio.create_task(self._refund(key, rate_limit, budget.tokens))
+                self._refunds.add(task)
+                task.add_done_callback(self._refunds.discard)
+                budget.tokens = 0
 
-    # This print statement is our proof that the middleware is running.
-    print(f"--- RATE LIMITER KEY FUNC CALLED --- > Client IP: {client_host}")
+    async def _refund(self, key: str, rate_limit: RateLimit, tokens: int):
+        try:
+            script = self._script(get_redis_pool(), _REFUND_SCRIPT)
+            await script(keys=[key], args=[tokens, rate_limit.interval])
+        except Exception:
+            logger.error("Returning leased tokens failed", key=key, exc_info=True)
 
-    return client_host
+    def _script(self, redis: Redis, source: str):
+        # Registered per client; calls use EVALSHA and load the script once.
+        script = self._scripts.get((id(redis), source))
+        if script is None:
+            script = redis.register_script(source)
+            self._scripts[(id(redis), source)] = script
+        return script
 
 
-# Initialize the limiter with the correct key function and Redis storage
-limiter = Limiter(key_func=get_remote_address_key, storage_uri=REDIS_URL)
+limiter = Limiter(enabled=RATE_LIMIT_ENABLED)
 
 
 async def rate_limit_exceeded_handler(
@@ -36,10 +272,13 @@ async def rate_limit_exceeded_handler(
     """
     Custom handler for 429 Too Many Requests errors.
     """
+    retry_after = max(1, math.ceil(exc.retry_after))
     return JSONResponse(
         status_code=429,
         content={
-            "detail": f"Rate limit exceeded: {exc.detail}",
-            "retry_after_seconds": exc.retry_after,
+            "detail": str(exc),
+            "error_message": "Too many requests. Please try again later.",
+            "retry_after_seconds": retry_after,
         },
+        headers={"Retry-After": str(retry_after)},
     )
@@ -1,18 +1,150 @@
 import logging
+import logging.handlers
+import os
+import queue
+import random
 import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Optional
 
+import orjson
 import structlog
 
+from app.core.metrics import LOG_EVENTS_DROPPED
+
+# Queue mode: request code only enqueues records, and a background thread
+# formats and writes them. When the queue is full, records are dropped.
+LOG_QUEUE_ENABLED = os.getenv("LOG_QUEUE_ENABLED", "true").lower() == "true"
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# High-volume events, by event message. Sampled events are kept with the
+# given probability; capped events are kept up to N per second, and the
+# next kept one reports how many were suppressed.
+DEFAULT_SAMPLE_RATES: dict[str, float] = {}
+DEFAULT_RATE_CAPS: dict[str, float] = {
+    "CACHE HIT: Returning cached data": 10,
+    "CACHE STALE: Returning cached data and refreshing": 10,
+}
+
+_SAMPLED = LOG_EVENTS_DROPPED.labels(reason="sampled")
+_RATE_CAPPED = LOG_EVENTS_DROPPED.labels(reason="rate_capped")
+_QUEUE_FULL = LOG_EVENTS_DROPPED.labels(reason="queue_full")
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_handler: Optional[logging.Handler] = None
+
+
+def parse_event_settings(value: str) -> dict[str, float]:
+    """Parses "event=value;event=value" settings, as in LOG_SAMPLE_RATES."""
+    settings = {}
+    for item in value.split(";"):
+        event, sep, setting = item.rpartition("=")
+        if sep and event.strip():
+            settings[event.strip()] = float(setting)
+    return settings
+
+
+class EventSampler:
+    """
+    structlog processor that drops part of the high-volume events before
+    they are queued or rendered, so they cost a dict lookup and little else.
+    """
+
+    def __init__(self, sample_rates: dict[str, float], rate_caps: dict[str, float]):
+        self.sample_rates = sample_rates
+        self.rate_caps = rate_caps
+        self._lock = threading.Lock()
+        # Per capped event: [current second, kept in it, suppressed since last kept]
+        self._windows: dict[str, list] = {}
+
+    def __call__(self, logger, method_name: str, event_dict: dict) -> dict:
+        event = event_dict.get("event")
+        rate = self.sample_rates.get(event)
+        if rate is not None:
+            if random.random() >= rate:
+                _SAMPLED.inc()
+                raise structlog.DropEvent
+            event_dict["sample_rate"] = rate
+
+        cap = self.rate_caps.get(event)
+        if cap is not None:
+            second = int(time.monotonic())
+            with self._lock:
+                window = self._windows.setdefault(event, [second, 0, 0])
+                if window[0] != second:
+                    window[0], window[1] = second, 0
+                if window[1] >= cap:
+                    window[2] += 1
+                    _RATE_CAPPED.inc()
+                    raise structlog.DropEvent
+                window[1] += 1
+                suppressed, window[2] = window[2], 0
+            if suppressed:
+                event_dict["suppressed"] = suppressed
+        return event_dict
+
+
+def capture_exc_info(logger, method_name: str, event_dict: dict) -> dict:
+    """
+    Resolves exc_info=True to the exception being handled while still in the
+    logging thread, since the record may be rendered on another one.
+    """
+    exc_info = event_dict.get("exc_info")
+    if exc_info is True or (exc_info is None and method_name == "exception"):
+        event_dict["exc_info"] = sys.exc_info()
+    return event_dict
+
+
+def add_record_timestamp(logger, method_name: str, event_dict: dict) -> dict:
+    """ISO timestamp of when the record was created, not when it is rendered."""
+    record = event_dict.get("_record")
+    created = record.created if record is not None else time.time()
+    event_dict["timestamp"] = datetime.fromtimestamp(created, timezone.utc).strftime(
+        "%Y-%m-%dT%H:%M:%S.%fZ"
+    )
+    return event_dict
+
+
+def _dumps(event_dict: dict, **kwargs) -> str:
+    return orjson.dumps(event_dict, default=repr).decode("utf-8")
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Enqueues records as they are, leaving all formatting to the listener
+    thread, and drops records instead of waiting when the queue is full.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _QUEUE_FULL.inc()
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # Waits for room, so stopping never loses the sentinel to a full queue.
+        self.queue.put(self._sentinel)
+
 
 def setup_logging():
     """
     Configures structured logging for the application.
     """
+    global _listener, _handler
+    close_logging()
+
     # A list of processors that will be applied to all log records.
     shared_processors = [
         structlog.stdlib.add_log_level,
         structlog.stdlib.add_logger_name,
-        structlog.processors.TimeStamper(fmt="iso"),
+        add_record_timestamp,
         structlog.processors.StackInfoRenderer(),
         structlog.dev.set_exc_info,
     ]
@@ -21,6 +153,18 @@ def setup_logging():
         processors=[
             # This processor is first to filter logs based on level.
             structlog.stdlib.filter_by_level,
+            # Drop most of the high-volume events before any other work.
+            EventSampler(
+                {
+                    **DEFAULT_SAMPLE_RATES,
+                    **parse_event_settings(os.getenv("LOG_SAMPLE_RATES", "")),
+                },
+                {
+                    **DEFAULT_RATE_CAPS,
+                    **parse_event_settings(os.getenv("LOG_RATE_CAPS", "")),
+                },
+            ),
+            capture_exc_info,
             # Add context variables to the log record.
             structlog.stdlib.ProcessorFormatter.wrap_for_formatter,
         ],
@@ -35,19 +179,45 @@ def setup_logging():
 
     # Configure the 'stdlib' formatter which will render the logs.
     formatter = structlog.stdlib.ProcessorFormatter(
-        # The final processor renders the log record as a JSON string.
-        processor=structlog.processors.JSONRenderer(),
+        processors=[
+            structlog.stdlib.ProcessorFormatter.remove_processors_meta,
+            structlog.processors.format_exc_info,
+            # The final processor renders the log record as a JSON string, with
+            # orjson instead of the much slower json module.
+            structlog.processors.JSONRenderer(serializer=_dumps),
+        ],
         # These processors are applied before rendering.
         foreign_pre_chain=shared_processors,
     )
 
     # Use a standard library handler to output logs to the console.
-    handler = logging.StreamHandler(sys.stdout)
-    handler.setFormatter(formatter)
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(formatter)
+
+    if LOG_QUEUE_ENABLED:
+        log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        _handler = _NonBlockingQueueHandler(log_queue)
+        _listener = _QueueListener(log_queue, stream_handler)
+        _listener.start()
+    else:
+        _handler = stream_handler
 
     # Get the root logger and add our configured handler.
     root_logger = logging.getLogger()
-    root_logger.addHandler(handler)
+    root_logger.addHandler(_handler)
     root_logger.setLevel(logging.INFO)
 
     print("Structured logging configured.")
+
+
+def close_logging():
+    """
+    Writes out queued records and stops the logging thread. To be called at application shutdown.
+    """
+    global _listener, _handler
+    if _handler:
+        logging.getLogger().removeHandler(_handler)
+        _handler = None
+    if _listener:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,124 @@
+from prometheus_client import REGISTRY, Counter, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# Latency buckets from sub-millisecond cache hits to provider timeouts.
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+REDIS_OPERATION_SECONDS = Histogram(
+    "redis_operation_seconds",
+    "Latency of Redis round trips on the price path",
+    ["operation"],
+    buckets=LATENCY_BUCKETS,
+)
+PRICE_CACHE_LOOKUPS = Counter(
+    "price_cache_lookups_total",
+    "Price cache lookups by the tier that answered; a miss is a miss in both tiers",
+    ["result"],
+)
+PROVIDER_FETCH_SECONDS = Histogram(
+    "provider_fetch_seconds",
+    "Latency of provider calls, including retries and backoff",
+    ["provider", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+PROVIDER_RETRIES = Counter(
+    "provider_retries_total", "Provider call attempts that were retried", ["provider"]
+)
+DB_OPERATION_SECONDS = Histogram(
+    "db_operation_seconds",
+    "Latency of price writes and their commits",
+    ["operation"],
+    buckets=LATENCY_BUCKETS,
+)
+KAFKA_DELIVERY_SECONDS = Histogram(
+    "kafka_delivery_seconds",
+    "Time from produce() to the broker's acknowledgement",
+    ["topic"],
+    buckets=LATENCY_BUCKETS,
+)
+RATE_LIMIT_DECISIONS = Counter(
+    "rate_limit_decisions_total",
+    "Rate limit checks by where they were decided and their result",
+    ["source", "result"],
+)
+LOG_EVENTS_DROPPED = Counter(
+    "log_events_dropped_total",
+    "Log events not written, because of sampling, rate caps or a full queue",
+    ["reason"],
+)
+KAFKA_MESSAGES = Counter(
+    "kafka_messages_total", "Produced messages by delivery result", ["topic", "result"]
+)
+
+# Label children resolved once, so the hot path only observes.
+REDIS_GET_SECONDS = REDIS_OPERATION_SECONDS.labels(operation="get")
+REDIS_MGET_SECONDS = REDIS_OPERATION_SECONDS.labels(operation="mget")
+REDIS_SET_SECONDS = REDIS_OPERATION_SECONDS.labels(operation="set")
+REDIS_RATE_LIMIT_SECONDS = REDIS_OPERATION_SECONDS.labels(operation="rate_limit")
+CACHE_LOCAL_HITS = PRICE_CACHE_LOOKUPS.labels(result="local_hit")
+CACHE_REDIS_HITS = PRICE_CACHE_LOOKUPS.labels(result="redis_hit")
+CACHE_MISSES = PRICE_CACHE_LOOKUPS.labels(result="miss")
+DB_INSERT_SECONDS = DB_OPERATION_SECONDS.labels(operation="insert")
+DB_COPY_SECONDS = DB_OPERATION_SECONDS.labels(operation="copy")
+DB_COMMIT_SECONDS = DB_OPERATION_SECONDS.labels(operation="commit")
+RATE_LIMIT_LOCAL_ALLOWED = RATE_LIMIT_DECISIONS.labels("local", "allowed")
+RATE_LIMIT_LOCAL_REJECTED = RATE_LIMIT_DECISIONS.labels("local", "rejected")
+RATE_LIMIT_REDIS_ALLOWED = RATE_LIMIT_DECISIONS.labels("redis", "allowed")
+RATE_LIMIT_REDIS_REJECTED = RATE_LIMIT_DECISIONS.labels("redis", "rejected")
+
+
+class LocalCacheCollector:
+    """
+    Exports the counters of the registered in-process caches, read from
+    their stats() at scrape time, so the caches keep plain integer counters.
+    """
+
+    COUNTERS = {
+        "hits": "Lookups answered by the in-process cache",
+        "misses": "Lookups not answered by the in-process cache",
+        "evictions": "Entries evicted to stay within the size bound",
+        "expirations": "Entries found expired on lookup",
+    }
+
+    def __init__(self):
+        self._caches = {}
+
+    def register(self, name: str, cache):
+        self._caches[name] = cache
+
+    def collect(self):
+        entries = GaugeMetricFamily(
+            "local_cache_entries",
+            "Entries held by the in-process cache",
+            labels=["cache"],
+        )
+        counters = {
+            stat: CounterMetricFamily(f"local_cache_{stat}", doc, labels=["cache"])
+            for stat, doc in self.COUNTERS.items()
+        }
+        for name, cache in list(self._caches.items()):
+            stats = cache.stats()
+            entries.add_metric([name], stats["entries"])
+            for stat, family in counters.items():
+                family.add_metric([name], stats[stat])
+        yield entries
+        yield from counters.values()
+
+
+LOCAL_CACHES = LocalCacheCollector()
+REGISTRY.register(LOCAL_CACHES)
@@ -0,0 +1,61 @@
+import asyncio
+import uuid
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from redis.asyncio import Redis
+
+T = TypeVar("T")
+
+# Deletes the lock only if we still own it, so an expired lock that another
+# replica has since taken is never released by mistake.
+_RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key into one in-flight call.
+    Every caller gets the same result (or exception). The shared call runs
+    as its own task, so a cancelled caller does not cancel it for the rest.
+    """
+
+    def __init__(self):
+        self._calls: dict[str, asyncio.Task] = {}
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._calls
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Mark the exception as retrieved in case every caller was cancelled.
+        if not task.cancelled():
+            task.exception()
+
+
+async def acquire_lock(redis: Redis, key: str, ttl_ms: int) -> Optional[str]:
+    """
+    Tries to take a short-lived Redis lock. Returns the owner token on
+    success, or None if another holder has it.
+    """
+    token = uuid.uuid4().hex
+    if await redis.set(key, token, nx=True, px=ttl_ms):
+        return token
+    return None
+
+
+async def release_lock(redis: Redis, key: str, token: str):
+    """Releases a lock taken with acquire_lock, if it is still ours."""
+    await redis.eval(_RELEASE_LOCK_SCRIPT, 1, key, token)
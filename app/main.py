@@ -1,23 +1,43 @@
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI
-from slowapi.errors import RateLimitExceeded
-from slowapi.middleware import SlowAPIMiddleware, _rate_limit_exceeded_handler
+from fastapi import FastAPI, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
 from app.api.prices import router
-from app.core.limiter import limiter
-from app.core.logging_config import setup_logging
-from app.core.redis import close_redis, setup_redis
+from app.core.db import async_engine
+from app.core.executor import close_executor, setup_executor
+from app.core.kafka_config import close_kafka_producer, setup_kafka_producer
+from app.core.limiter import RateLimitExceeded, rate_limit_exceeded_handler
+from app.core.logging_config import close_logging, setup_logging
+from app.core.redis import close_redis, get_redis_pool, setup_redis
+from app.services.ingest import close_ingest, setup_ingest
+from app.services.price_service import start_cache_sync, stop_cache_sync
+from app.services.price_stream import close_price_stream, setup_price_stream
+from app.services.scheduler import start_scheduler, stop_scheduler
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # This function runs when the application starts.
-    # It connects to Redis and initializes the cache.
+    # It connects to Redis, initializes the cache and starts the polling jobs.
     setup_logging()
+    setup_executor()
     await setup_redis()
+    await start_cache_sync(get_redis_pool())
+    await setup_kafka_producer()
+    await setup_ingest()
+    await setup_price_stream()
+    await start_scheduler()
     yield
+    await stop_scheduler()
+    await close_price_stream()
+    await close_ingest()
+    await close_kafka_producer()
+    await stop_cache_sync()
     await close_redis()
+    await async_engine.dispose()
+    close_executor()
+    close_logging()
 
 
 app = FastAPI(
@@ -27,12 +47,15 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
-app.state.limiter = limiter
-app.add_middleware(SlowAPIMiddleware)
 app.include_router(router)
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+app.add_exception_handler(RateLimitExceeded, rate_limit_exceeded_handler)
 
 
 @app.get("/")
 def read_root():
     return {"status": "ok", "message": "Welcome to the Market Data API"}
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -1,20 +1,34 @@
 from datetime import datetime
 
-from sqlalchemy import Column, DateTime, Float, Index, Integer, String
+from sqlalchemy import Column, DateTime, Float, Index, Integer, LargeBinary, String
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
 
 
+# raw_responses and processed_prices are partitioned by day on timestamp
+# (see scripts/create_tables.sql), so their database primary key is
+# (id, timestamp). Ids still come from one sequence and stay unique.
 class RawResponse(Base):
     __tablename__ = "raw_responses"
     id = Column(Integer, primary_key=True, index=True)
     symbol = Column(String, index=True)
     provider = Column(String)
     data = Column(String)  # Store the raw JSON response
+    payload_hash = Column(LargeBinary)  # Set instead of data for deduplicated bodies
     timestamp = Column(DateTime, default=datetime.now)
 
 
+class RawPayload(Base):
+    """A distinct raw response body, zlib-compressed and keyed by its SHA-256."""
+
+    __tablename__ = "raw_payloads"
+    hash = Column(LargeBinary, primary_key=True)  # The 32-byte digest
+    data = Column(LargeBinary)
+    created_at = Column(DateTime, default=datetime.now)
+    last_seen_at = Column(DateTime, default=datetime.now)  # Refreshed on reuse
+
+
 class ProcessedPrice(Base):
     __tablename__ = "processed_prices"
     id = Column(Integer, primary_key=True, index=True)
@@ -33,6 +47,16 @@ class SymbolAverage(Base):
     updated_at = Column(DateTime, default=datetime.now)
 
 
+class SymbolIndicator(Base):
+    """Latest value of each configured indicator (e.g. sma_5, ema_12) per symbol."""
+
+    __tablename__ = "symbol_indicators"
+    symbol = Column(String, primary_key=True)
+    indicator = Column(String, primary_key=True)
+    value = Column(Float)
+    updated_at = Column(DateTime, default=datetime.now)
+
+
 class PollingJobConfigs(Base):
     __tablename__ = "polling_job_configs"
     id = Column(Integer, primary_key=True, index=True)
@@ -10,6 +10,11 @@ class PriceLatest(BaseModel):
     provider: str
 
 
+class PriceLatestBatch(BaseModel):
+    prices: list[PriceLatest]
+    missing: list[str] = []
+
+
 class PollRequest(BaseModel):
     symbols: list[str]
     interval: int
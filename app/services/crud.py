@@ -1,18 +1,82 @@
+import hashlib
+import io
 import json
+import os
+import zlib
+from dataclasses import dataclass, field
+from datetime import datetime
+from decimal import Decimal
 from typing import Optional
 
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session
 
-from app.models.price import PollingJobConfigs, ProcessedPrice, RawResponse
+from app.models.price import PollingJobConfigs, ProcessedPrice, RawPayload, RawResponse
+
+# These functions take a sync Session. Async callers run them on an
+# AsyncSession with `await db.run_sync(crud.<function>, ...)`.
+
+# When enabled, raw responses of at least RAW_PAYLOAD_DEDUP_MIN_BYTES
+# reference a deduplicated, compressed body in raw_payloads by hash instead
+# of storing their JSON inline. Smaller bodies stay inline: a 32-byte hash
+# and its index entry cost about as much, and zlib does not shrink them.
+RAW_PAYLOAD_DEDUP = os.getenv("RAW_PAYLOAD_DEDUP", "false").lower() == "true"
+RAW_PAYLOAD_DEDUP_MIN_BYTES = int(os.getenv("RAW_PAYLOAD_DEDUP_MIN_BYTES", "512"))
+
+# Reused bodies refresh their last_seen_at at most once per day, which is
+# enough for expiry by day and saves an update per write.
+_PAYLOAD_REFRESH_AFTER = "INTERVAL '1 day'"
+
+
+def dedup_payload(data: str) -> bool:
+    """Whether a raw response body is stored in raw_payloads, not inline."""
+    return RAW_PAYLOAD_DEDUP and len(data) >= RAW_PAYLOAD_DEDUP_MIN_BYTES
+
+
+def encode_payload(data: str) -> tuple[bytes, bytes]:
+    """Returns the SHA-256 digest and the zlib-compressed bytes of a raw response."""
+    raw = data.encode()
+    return hashlib.sha256(raw).digest(), zlib.compress(raw)
+
+
+def store_payloads(db: Session, payloads: list[str]) -> list[bytes]:
+    """
+    Stores each distinct raw response body once and returns the hash of every
+    payload, in order. Bodies already stored are kept, and their last_seen_at
+    is refreshed so partition_maintenance.py does not expire them while they
+    are being referenced again.
+    """
+    hashes = []
+    blobs = {}
+    for data in payloads:
+        payload_hash, blob = encode_payload(data)
+        blobs.setdefault(payload_hash, blob)
+        hashes.append(payload_hash)
+
+    # Sorted, so concurrent writers take the row locks in the same order.
+    statement = insert(RawPayload).values(
+        [{"hash": h, "data": blobs[h]} for h in sorted(blobs)]
+    )
+    db.execute(
+        statement.on_conflict_do_update(
+            index_elements=["hash"],
+            set_={"last_seen_at": text("NOW()")},
+            where=RawPayload.last_seen_at < text(f"NOW() - {_PAYLOAD_REFRESH_AFTER}"),
+        )
+    )
+    return hashes
 
 
 def create_raw_response(db: Session, symbol: str, provider: str, response_data: dict) -> RawResponse:
     """Stores the raw JSON response from the market data provider."""
-    db_raw_response = RawResponse(
-        symbol=symbol,
-        provider=provider,
-        data=json.dumps(response_data),  # Store data as a JSON string
-    )
+    data = json.dumps(response_data)  # Store data as a JSON string
+    if dedup_payload(data):
+        db_raw_response = RawResponse(
+            symbol=symbol, provider=provider, payload_hash=store_payloads(db, [data])[0]
+        )
+    else:
+        db_raw_response = RawResponse(symbol=symbol, provider=provider, data=data)
     db.add(db_raw_response)
     db.flush()
     db.refresh(db_raw_response)
@@ -33,6 +97,249 @@ def create_processed_price(db: Session, raw_response: RawResponse, price: float)
     return db_processed_price
 
 
+def create_prices(db: Session, provider: str, prices: dict[str, dict]) -> list:
+    """
+    Stores the raw responses and linked processed prices for one or more
+    symbols in a single statement. A CTE inserts the raw responses and feeds
+    their ids into the processed_prices insert. Returns one row per symbol
+    with symbol, price, timestamp and raw_response_id, as stored. The caller
+    commits. Deduplicated payload bodies are stored in the same statement.
+    """
+    values = []
+    params = {"provider": provider}
+    deduped = False
+    for i, (symbol, price_data) in enumerate(prices.items()):
+        values.append(
+            f"(CAST(:symbol_{i} AS VARCHAR), CAST(:price_{i} AS NUMERIC),"
+            f" CAST(:data_{i} AS TEXT), CAST(:hash_{i} AS BYTEA),"
+            f" CAST(:blob_{i} AS BYTEA), CAST(:timestamp_{i} AS TIMESTAMP))"
+        )
+        params[f"symbol_{i}"] = symbol
+        params[f"price_{i}"] = Decimal(str(float(price_data["price"])))
+        params[f"data_{i}"] = data = json.dumps(price_data)
+        params[f"hash_{i}"] = params[f"blob_{i}"] = None
+        params[f"timestamp_{i}"] = datetime.now()
+        if dedup_payload(data):
+            params[f"hash_{i}"], params[f"blob_{i}"] = encode_payload(data)
+            params[f"data_{i}"] = None
+            deduped = True
+
+    payloads = ""
+    if deduped:
+        payloads = f"""
+            payloads AS (
+                INSERT INTO raw_payloads (hash, data)
+                SELECT DISTINCT ON (hash) hash, blob FROM input
+                WHERE hash IS NOT NULL ORDER BY hash
+                ON CONFLICT (hash) DO UPDATE SET last_seen_at = NOW()
+                WHERE raw_payloads.last_seen_at < NOW() - {_PAYLOAD_REFRESH_AFTER}
+            ),"""
+
+    return db.execute(
+        text(
+            f"""
+            WITH input (symbol, price, data, hash, blob, timestamp) AS (
+                VALUES {", ".join(values)}
+            ),{payloads}
+            raw AS (
+                INSERT INTO raw_responses (symbol, provider, data, payload_hash, timestamp)
+                SELECT symbol, CAST(:provider AS VARCHAR), data, hash, timestamp FROM input
+                RETURNING id, symbol, timestamp
+            )
+            INSERT INTO processed_prices
+                (symbol, price, timestamp, provider, raw_response_id)
+            SELECT raw.symbol, input.price, raw.timestamp, CAST(:provider AS VARCHAR), raw.id
+            FROM raw JOIN input ON input.symbol = raw.symbol
+            RETURNING symbol, price, timestamp, raw_response_id
+        """
+        ),
+        params,
+    ).all()
+
+
+@dataclass
+class PriceRecord:
+    """A price point waiting to be written by copy_price_records."""
+
+    symbol: str
+    provider: str
+    price: float
+    data: str  # The raw JSON response
+    timestamp: datetime = field(default_factory=datetime.now)
+
+
+def _copy_field(value) -> str:
+    """Escapes a value for PostgreSQL's COPY text format."""
+    if value is None:
+        return "\\N"
+    if isinstance(value, bytes):
+        value = "\\x" + value.hex()  # bytea hex format
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def _copy_rows(rows) -> io.StringIO:
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(_copy_field(value) for value in row))
+        buffer.write("\n")
+    buffer.seek(0)
+    return buffer
+
+
+def copy_price_records(db: Session, records: list[PriceRecord]) -> list[int]:
+    """
+    Writes raw responses and processed prices for many records with COPY.
+    Raw response ids are reserved from their sequence first, so both tables
+    load in one pass each. The distinct deduplicated payload bodies are
+    stored first. Returns the raw response ids; the caller commits.
+    """
+    if not records:
+        return []
+
+    payload_hashes = [None] * len(records)
+    inline_data = [r.data for r in records]
+    deduped = [i for i, r in enumerate(records) if dedup_payload(r.data)]
+    if deduped:
+        hashes = store_payloads(db, [records[i].data for i in deduped])
+        for i, payload_hash in zip(deduped, hashes):
+            payload_hashes[i] = payload_hash
+            inline_data[i] = None
+
+    raw_ids = list(
+        db.execute(
+            text("SELECT nextval('raw_responses_id_seq') FROM generate_series(1, :n)"),
+            {"n": len(records)},
+        ).scalars()
+    )
+
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            "COPY raw_responses"
+            " (id, symbol, provider, data, payload_hash, timestamp) FROM STDIN",
+            _copy_rows(
+                (
+                    raw_id,
+                    r.symbol,
+                    r.provider,
+                    data,
+                    payload_hash,
+                    r.timestamp.isoformat(),
+                )
+                for raw_id, r, data, payload_hash in zip(
+                    raw_ids, records, inline_data, payload_hashes
+                )
+            ),
+        )
+        cursor.copy_expert(
+            "COPY processed_prices"
+            " (symbol, price, timestamp, provider, raw_response_id) FROM STDIN",
+            _copy_rows(
+                (r.symbol, float(r.price), r.timestamp.isoformat(), r.provider, raw_id)
+                for raw_id, r in zip(raw_ids, records)
+            ),
+        )
+    finally:
+        cursor.close()
+    return raw_ids
+
+
+class LazyPayload:
+    """A raw response body, decompressed on first access."""
+
+    __slots__ = ("_blob", "_text")
+
+    def __init__(self, blob: Optional[bytes] = None, text: Optional[str] = None):
+        self._blob = blob
+        self._text = text
+
+    @property
+    def text(self) -> Optional[str]:
+        if self._text is None and self._blob is not None:
+            self._text = zlib.decompress(self._blob).decode()
+            self._blob = None
+        return self._text
+
+    def json(self) -> Optional[dict]:
+        return None if self.text is None else json.loads(self.text)
+
+
+@dataclass
+class RawResponseRecord:
+    """A stored raw response, as returned by the bulk read helpers."""
+
+    id: int
+    symbol: str
+    provider: str
+    timestamp: datetime
+    payload: LazyPayload
+
+
+def _load_raw_responses(db: Session, query) -> list[RawResponseRecord]:
+    rows = query.with_entities(
+        RawResponse.id,
+        RawResponse.symbol,
+        RawResponse.provider,
+        RawResponse.timestamp,
+        RawResponse.data,
+        RawResponse.payload_hash,
+    ).all()
+
+    # Each distinct body is fetched once and shared by every row using it.
+    hashes = {row.payload_hash for row in rows if row.payload_hash}
+    payloads = {}
+    if hashes:
+        payloads = {
+            payload.hash: LazyPayload(blob=payload.data)
+            for payload in db.query(RawPayload).filter(RawPayload.hash.in_(hashes))
+        }
+
+    return [
+        RawResponseRecord(
+            id=row.id,
+            symbol=row.symbol,
+            provider=row.provider,
+            timestamp=row.timestamp,
+            payload=payloads.get(row.payload_hash) or LazyPayload(text=row.data),
+        )
+        for row in rows
+    ]
+
+
+def get_raw_responses(db: Session, ids: list[int]) -> list[RawResponseRecord]:
+    """Retrieves raw responses by id, e.g. the raw_response_id of processed prices."""
+    if not ids:
+        return []
+    return _load_raw_responses(
+        db,
+        db.query(RawResponse).filter(RawResponse.id.in_(ids)).order_by(RawResponse.id),
+    )
+
+
+def get_raw_responses_by_symbol(
+    db: Session,
+    symbol: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: int = 1000,
+) -> list[RawResponseRecord]:
+    """Retrieves the newest raw responses for a symbol, optionally within [start, end)."""
+    query = db.query(RawResponse).filter(RawResponse.symbol == symbol)
+    if start is not None:
+        query = query.filter(RawResponse.timestamp >= start)
+    if end is not None:
+        query = query.filter(RawResponse.timestamp < end)
+    return _load_raw_responses(
+        db, query.order_by(RawResponse.timestamp.desc()).limit(limit)
+    )
+
+
 def get_latest_price_by_symbol(db: Session, symbol: str) -> Optional[ProcessedPrice]:
     """Retrieves the most recent processed price for a given symbol."""
     return (
@@ -53,3 +360,8 @@ def create_price_poll(db: Session, symbols: list[str], interval: int, provider:
     db.flush()
     db.refresh(db_polling_job_config)
     return db_polling_job_config.id
+
+
+def get_polling_job_configs(db: Session) -> list[PollingJobConfigs]:
+    """Retrieves every stored polling job configuration."""
+    return db.query(PollingJobConfigs).order_by(PollingJobConfigs.id).all()
@@ -0,0 +1,153 @@
+import json
+import os
+from datetime import datetime, timezone
+from typing import AsyncIterator, Final, Optional
+
+import numpy as np
+from sqlalchemy import text
+
+from app.core.db import async_engine
+
+HISTORY_CHUNK_SIZE = int(os.getenv("HISTORY_CHUNK_SIZE", "50000"))
+
+# Supported bucket sizes, in seconds.
+INTERVALS: Final[dict[str, int]] = {
+    "1m": 60,
+    "5m": 300,
+    "15m": 900,
+    "1h": 3600,
+    "1d": 86400,
+}
+
+COLUMNS: Final[tuple] = ("timestamp", "open", "high", "low", "close", "mean", "count")
+
+
+class BucketAggregator:
+    """
+    Folds time-ordered chunks of (epoch seconds, price) into OHLC/mean
+    buckets with NumPy. The last bucket of a chunk may continue in the next
+    one, so it is held back and merged until a later bucket starts.
+    """
+
+    def __init__(self, interval: int):
+        self._interval = interval
+        self._pending: Optional[np.ndarray] = None
+
+    def add(self, timestamps: np.ndarray, prices: np.ndarray) -> np.ndarray:
+        """Returns the buckets completed by this chunk, one row per bucket."""
+        if len(prices) == 0:
+            return np.empty((0, len(COLUMNS)))
+
+        buckets = np.floor(timestamps / self._interval) * self._interval
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        counts = np.diff(np.r_[starts, len(prices)])
+        rows = np.column_stack(
+            (
+                buckets[starts],
+                prices[starts],
+                np.maximum.reduceat(prices, starts),
+                np.minimum.reduceat(prices, starts),
+                prices[starts + counts - 1],
+                np.add.reduceat(prices, starts),  # Sum until the bucket is complete
+                counts,
+            )
+        )
+
+        if self._pending is not None:
+            if self._pending[0] == rows[0, 0]:
+                rows[0] = self._merge(self._pending, rows[0])
+            else:
+                rows = np.vstack((self._pending, rows))
+        self._pending = rows[-1].copy()
+        return self._finalize(rows[:-1])
+
+    def finish(self) -> np.ndarray:
+        """Returns the bucket still held back, if any."""
+        if self._pending is None:
+            return np.empty((0, len(COLUMNS)))
+        rows, self._pending = self._pending[np.newaxis], None
+        return self._finalize(rows)
+
+    @staticmethod
+    def _merge(first: np.ndarray, second: np.ndarray) -> np.ndarray:
+        return np.array(
+            (
+                first[0],
+                first[1],
+                max(first[2], second[2]),
+                min(first[3], second[3]),
+                second[4],
+                first[5] + second[5],
+                first[6] + second[6],
+            )
+        )
+
+    @staticmethod
+    def _finalize(rows: np.ndarray) -> np.ndarray:
+        rows = rows.copy()
+        rows[:, 5] /= rows[:, 6]
+        return rows
+
+
+async def read_price_chunks(
+    symbol: str, start: datetime, end: datetime, chunk_size: int = HISTORY_CHUNK_SIZE
+) -> AsyncIterator[tuple[np.ndarray, np.ndarray]]:
+    """
+    Yields time-ordered (epoch seconds, price) arrays for a symbol in
+    [start, end), read through a server-side cursor `chunk_size` rows at a time.
+    """
+    async with async_engine.connect() as conn:
+        result = await conn.stream(
+            text(
+                """
+                SELECT EXTRACT(EPOCH FROM timestamp)::DOUBLE PRECISION,
+                       price::DOUBLE PRECISION
+                FROM processed_prices
+                WHERE symbol = :symbol AND timestamp >= :start AND timestamp < :end
+                ORDER BY timestamp
+            """
+            ).execution_options(yield_per=chunk_size),
+            {"symbol": symbol, "start": start, "end": end},
+        )
+        async for rows in result.partitions(chunk_size):
+            chunk = np.array(rows, dtype=np.float64)
+            yield chunk[:, 0], chunk[:, 1]
+
+
+def _format_rows(rows: np.ndarray, fmt: str) -> str:
+    lines = []
+    for row in rows.tolist():
+        record = dict(zip(COLUMNS, row))
+        record["timestamp"] = (
+            datetime.fromtimestamp(record["timestamp"], tz=timezone.utc)
+            .replace(tzinfo=None)
+            .isoformat()
+        )
+        record["mean"] = round(record["mean"], 6)
+        record["count"] = int(record["count"])
+        if fmt == "csv":
+            lines.append(",".join(str(record[column]) for column in COLUMNS))
+        else:
+            lines.append(json.dumps(record))
+    return "".join(line + "\n" for line in lines)
+
+
+async def stream_price_history(
+    symbol: str, start: datetime, end: datetime, interval: str, fmt: str = "ndjson"
+) -> AsyncIterator[str]:
+    """
+    Streams the OHLC/mean buckets of a symbol's prices as NDJSON or CSV.
+    Only one chunk of rows is held in memory at a time.
+    """
+    if fmt == "csv":
+        yield ",".join(COLUMNS) + "\n"
+
+    aggregator = BucketAggregator(INTERVALS[interval])
+    async for timestamps, prices in read_price_chunks(symbol, start, end):
+        rows = aggregator.add(timestamps, prices)
+        if len(rows):
+            yield _format_rows(rows, fmt)
+
+    rows = aggregator.finish()
+    if len(rows):
+        yield _format_rows(rows, fmt)
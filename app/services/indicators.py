@@ -0,0 +1,357 @@
+import math
+import os
+from collections import deque
+from dataclasses import dataclass
+from typing import Final, Optional
+
+import numpy as np
+
+# Indicators are declared as comma separated "kind:parameter" pairs:
+#   sma:<samples>   simple moving average over the last N prices
+#   ema:<span>      exponential moving average, alpha = 2 / (span + 1)
+#   twa:<seconds>   average of the prices seen in the last N seconds
+#   vwap:<seconds>  volume weighted average price over the last N seconds,
+#                   computed only from events that carry a volume
+# The first indicator is also written to symbol_averages.moving_average.
+INDICATORS_CONFIG = os.getenv("MA_INDICATORS", "sma:5")
+
+KINDS: Final[tuple] = ("sma", "ema", "twa", "vwap")
+
+# Seeding an EMA from this many spans of history gets it within 0.01% of
+# the value it would have with the full history.
+EMA_SEED_SPANS = 5
+
+
+@dataclass(frozen=True)
+class IndicatorSpec:
+    kind: str
+    param: int
+
+    @property
+    def name(self) -> str:
+        """Stable name used as the indicator column, e.g. sma_5 or twa_300s."""
+        suffix = "s" if self.kind in ("twa", "vwap") else ""
+        return f"{self.kind}_{self.param}{suffix}"
+
+    @classmethod
+    def parse(cls, spec: str) -> "IndicatorSpec":
+        kind, _, param = spec.strip().partition(":")
+        kind = kind.lower()
+        if kind not in KINDS or not param.isdigit() or int(param) < 1:
+            raise ValueError(
+                f"Invalid indicator '{spec}'. Use kind:N with kind one of {KINDS}."
+            )
+        return cls(kind=kind, param=int(param))
+
+
+def parse_indicators(config: str = INDICATORS_CONFIG) -> tuple[IndicatorSpec, ...]:
+    specs = tuple(
+        dict.fromkeys(
+            IndicatorSpec.parse(spec) for spec in config.split(",") if spec.strip()
+        )
+    )
+    if not specs:
+        raise ValueError("At least one indicator must be configured")
+    return specs
+
+
+def seed_requirements(specs: tuple[IndicatorSpec, ...]) -> tuple[int, int]:
+    """
+    Returns how many recent prices and how many seconds of history are needed
+    to warm up the indicators, as (samples, seconds).
+    """
+    samples = 0
+    seconds = 0
+    for spec in specs:
+        if spec.kind == "sma":
+            samples = max(samples, spec.param - 1)
+        elif spec.kind == "ema":
+            samples = max(samples, spec.param * EMA_SEED_SPANS)
+        else:
+            seconds = max(seconds, spec.param)
+    return samples, seconds
+
+
+# --- Incremental indicators, updated one price at a time ---
+
+
+class RollingWindow:
+    """Fixed-size ring buffer of prices with a running sum, so the mean is O(1)."""
+
+    __slots__ = ("size", "_values", "_index", "_count", "_sum")
+
+    def __init__(self, size: int):
+        self.size = size
+        self._values = [0.0] * size
+        self._index = 0
+        self._count = 0
+        self._sum = 0.0
+
+    def push(self, value: float):
+        if self._count == self.size:
+            self._sum -= self._values[self._index]
+        else:
+            self._count += 1
+        self._values[self._index] = value
+        self._sum += value
+        self._index = (self._index + 1) % self.size
+        if self._index == 0:
+            # Re-sum once per lap so floating point drift cannot build up.
+            self._sum = sum(self._values[: self._count])
+
+    def mean(self) -> float:
+        if not self._count:
+            return 0.0
+        return self._sum / self._count
+
+
+class SimpleMovingAverage:
+    __slots__ = ("_window",)
+
+    def __init__(self, samples: int):
+        self._window = RollingWindow(samples)
+
+    def update(self, timestamp: float, price: float, volume: Optional[float]):
+        self._window.push(price)
+        return self._window.mean()
+
+
+class ExponentialMovingAverage:
+    __slots__ = ("_alpha", "_value")
+
+    def __init__(self, span: int):
+        self._alpha = 2 / (span + 1)
+        self._value = None
+
+    def update(self, timestamp: float, price: float, volume: Optional[float]):
+        if self._value is None:
+            self._value = price
+        else:
+            self._value += self._alpha * (price - self._value)
+        return self._value
+
+
+class TimeWindowAverage:
+    """Average of the prices with a timestamp in (now - seconds, now]."""
+
+    __slots__ = ("_seconds", "_samples", "_sum")
+
+    def __init__(self, seconds: int):
+        self._seconds = seconds
+        self._samples = deque()
+        self._sum = 0.0
+
+    def update(self, timestamp: float, price: float, volume: Optional[float]):
+        self._samples.append((timestamp, price))
+        self._sum += price
+        while self._samples[0][0] <= timestamp - self._seconds:
+            self._sum -= self._samples.popleft()[1]
+        return self._sum / len(self._samples)
+
+
+class VolumeWeightedAveragePrice:
+    """VWAP over (now - seconds, now]. Prices without a volume are ignored."""
+
+    __slots__ = ("_seconds", "_samples", "_notional", "_volume")
+
+    def __init__(self, seconds: int):
+        self._seconds = seconds
+        self._samples = deque()
+        self._notional = 0.0
+        self._volume = 0.0
+
+    def update(self, timestamp: float, price: float, volume: Optional[float]):
+        # Missing, NaN and zero volumes carry no weight.
+        if volume is not None and not math.isnan(volume) and volume != 0:
+            self._samples.append((timestamp, price * volume, volume))
+            self._notional += price * volume
+            self._volume += volume
+        while self._samples and self._samples[0][0] <= timestamp - self._seconds:
+            _, notional, old_volume = self._samples.popleft()
+            self._notional -= notional
+            self._volume -= old_volume
+        if not self._samples:
+            return None
+        return self._notional / self._volume
+
+
+_INCREMENTAL = {
+    "sma": SimpleMovingAverage,
+    "ema": ExponentialMovingAverage,
+    "twa": TimeWindowAverage,
+    "vwap": VolumeWeightedAveragePrice,
+}
+
+
+class IndicatorSet:
+    """The configured indicators of one symbol, updated incrementally."""
+
+    __slots__ = ("_indicators",)
+
+    def __init__(self, specs: tuple[IndicatorSpec, ...]):
+        self._indicators = [
+            (spec.name, _INCREMENTAL[spec.kind](spec.param)) for spec in specs
+        ]
+
+    def update(
+        self, timestamp: float, price: float, volume: Optional[float] = None
+    ) -> dict[str, float]:
+        """Adds one price and returns every indicator that has a value."""
+        values = {}
+        for name, indicator in self._indicators:
+            value = indicator.update(timestamp, price, volume)
+            if value is not None:
+                values[name] = value
+        return values
+
+
+# --- Vectorized indicators over a whole history, for backfills ---
+
+
+def _sma(prices: np.ndarray, samples: int) -> np.ndarray:
+    sums = np.concatenate(([0.0], np.cumsum(prices)))
+    end = np.arange(1, len(prices) + 1)
+    start = np.maximum(end - samples, 0)
+    return (sums[end] - sums[start]) / (end - start)
+
+
+def _ema(prices: np.ndarray, span: int, previous: Optional[float] = None) -> np.ndarray:
+    """
+    EMA as a scaled cumulative sum, block by block. Within a block,
+    ema[t] = d^(t+1) * ema[-1] + alpha * d^t * sum(x[j] / d^j), and blocks
+    are short enough that d^-j cannot overflow. `previous` continues an EMA
+    computed over earlier prices.
+    """
+    alpha = 2 / (span + 1)
+    decay = 1 - alpha
+    block = max(1, int(100 / -math.log10(decay))) if decay > 0 else 1
+    out = np.empty_like(prices)
+    if previous is None:
+        previous = prices[0] if len(prices) else 0.0
+    for start in range(0, len(prices), block):
+        end = min(start + block, len(prices))
+        chunk = prices[start:end]
+        powers = decay ** np.arange(len(chunk))
+        out[start:end] = powers * (decay * previous + alpha * np.cumsum(chunk / powers))
+        previous = out[end - 1]
+    return out
+
+
+def _window_bounds(timestamps: np.ndarray, seconds: int) -> np.ndarray:
+    return np.searchsorted(timestamps, timestamps - seconds, side="right")
+
+
+def _twa(timestamps: np.ndarray, prices: np.ndarray, seconds: int) -> np.ndarray:
+    sums = np.concatenate(([0.0], np.cumsum(prices)))
+    end = np.arange(1, len(prices) + 1)
+    start = _window_bounds(timestamps, seconds)
+    return (sums[end] - sums[start]) / (end - start)
+
+
+def _vwap(
+    timestamps: np.ndarray, prices: np.ndarray, volumes: np.ndarray, seconds: int
+) -> np.ndarray:
+    volumes = np.nan_to_num(volumes)
+    notional = np.concatenate(([0.0], np.cumsum(prices * volumes)))
+    volume = np.concatenate(([0.0], np.cumsum(volumes)))
+    end = np.arange(1, len(prices) + 1)
+    start = _window_bounds(timestamps, seconds)
+    window_volume = volume[end] - volume[start]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(
+            window_volume > 0, (notional[end] - notional[start]) / window_volume, np.nan
+        )
+
+
+def compute_indicators(
+    specs: tuple[IndicatorSpec, ...],
+    timestamps: np.ndarray,
+    prices: np.ndarray,
+    volumes: Optional[np.ndarray] = None,
+    ema_previous: Optional[dict[str, float]] = None,
+) -> dict[str, np.ndarray]:
+    """
+    Computes every indicator at every point of a time-ordered history, giving
+    the same values as feeding the prices through an IndicatorSet one by one.
+    Points where an indicator has no value are NaN. `ema_previous` holds the
+    last EMA values, by name, of the history preceding these prices.
+    """
+    ema_previous = ema_previous or {}
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    prices = np.asarray(prices, dtype=np.float64)
+    results = {}
+    for spec in specs:
+        if spec.kind == "sma":
+            results[spec.name] = _sma(prices, spec.param)
+        elif spec.kind == "ema":
+            results[spec.name] = _ema(prices, spec.param, ema_previous.get(spec.name))
+        elif spec.kind == "twa":
+            results[spec.name] = _twa(timestamps, prices, spec.param)
+        elif volumes is not None:
+            results[spec.name] = _vwap(
+                timestamps, prices, np.asarray(volumes, dtype=np.float64), spec.param
+            )
+        else:
+            results[spec.name] = np.full(len(prices), np.nan)
+    return results
+
+
+class ChunkedIndicators:
+    """
+    Runs compute_indicators over a history that arrives in time-ordered
+    chunks, with the same results as over the whole history at once. The
+    rows still inside a window are carried into the next chunk, and EMAs
+    continue from their last value.
+    """
+
+    def __init__(self, specs: tuple[IndicatorSpec, ...]):
+        self._windowed = tuple(spec for spec in specs if spec.kind != "ema")
+        self._ema = tuple(spec for spec in specs if spec.kind == "ema")
+        self._samples = max(
+            (spec.param - 1 for spec in specs if spec.kind == "sma"), default=0
+        )
+        self._seconds = max(
+            (spec.param for spec in specs if spec.kind in ("twa", "vwap")), default=0
+        )
+        self._ema_last: dict[str, float] = {}
+        self._tail = (np.empty(0), np.empty(0), np.empty(0))
+
+    def add(
+        self,
+        timestamps: np.ndarray,
+        prices: np.ndarray,
+        volumes: Optional[np.ndarray] = None,
+    ) -> dict[str, np.ndarray]:
+        """Returns every indicator at every point of this chunk."""
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        prices = np.asarray(prices, dtype=np.float64)
+        volumes = (
+            np.full(len(prices), np.nan)
+            if volumes is None
+            else np.asarray(volumes, dtype=np.float64)
+        )
+        if len(prices) == 0:
+            return {}
+
+        carried = len(self._tail[0])
+        all_timestamps, all_prices, all_volumes = (
+            np.concatenate((tail, chunk))
+            for tail, chunk in zip(self._tail, (timestamps, prices, volumes))
+        )
+        results = {
+            name: values[carried:]
+            for name, values in compute_indicators(
+                self._windowed, all_timestamps, all_prices, all_volumes
+            ).items()
+        }
+        for name, values in compute_indicators(
+            self._ema, timestamps, prices, ema_previous=self._ema_last
+        ).items():
+            results[name] = values
+            self._ema_last[name] = float(values[-1])
+
+        keep = np.arange(len(all_prices)) >= len(all_prices) - self._samples
+        if self._seconds:
+            keep |= all_timestamps > all_timestamps[-1] - self._seconds
+        self._tail = (all_timestamps[keep], all_prices[keep], all_volumes[keep])
+        return results
@@ -0,0 +1,319 @@
+import asyncio
+import fcntl
+import json
+import os
+import socket
+from datetime import datetime
+from decimal import ROUND_HALF_UP, Decimal
+from typing import IO, Optional
+
+import structlog
+
+from app.core.db import SessionLocal
+from app.core.executor import run_blocking
+from app.core.kafka_config import get_kafka_producer
+from app.core.metrics import DB_COMMIT_SECONDS, DB_COPY_SECONDS
+from app.services import crud
+from app.services.crud import PriceRecord
+from app.services.price_events import build_price_event, publish_price_event
+
+logger = structlog.get_logger(__name__)
+
+INGEST_ENABLED = os.getenv("INGEST_WRITE_BEHIND_ENABLED", "true").lower() == "true"
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "100000"))
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "5000"))
+INGEST_FLUSH_INTERVAL_SECONDS = float(os.getenv("INGEST_FLUSH_INTERVAL_SECONDS", "0.5"))
+INGEST_MAX_RETRIES = 3
+# Batches that still fail after the retries are appended as JSON lines to a
+# file of this process in INGEST_SPILL_DIR, named after INGEST_INSTANCE_ID
+# and the pid, and written again when an instance with the same id starts.
+# A running process keeps its file locked, so it is never taken from it.
+# Empty disables spilling.
+INGEST_SPILL_DIR = os.getenv(
+    "INGEST_SPILL_DIR",
+    os.path.abspath(
+        os.path.join(os.path.dirname(__file__), "..", "..", "ingest_spill")
+    ),
+)
+INGEST_INSTANCE_ID = os.getenv("INGEST_INSTANCE_ID", socket.gethostname())
+# Pause before restarting a flusher that failed unexpectedly.
+INGEST_RESTART_SECONDS = 1
+
+_STOP = object()
+
+
+def write_price_records(records: list[PriceRecord]) -> list[int]:
+    """Writes one batch with COPY in a single transaction."""
+    db = SessionLocal()
+    try:
+        with DB_COPY_SECONDS.time():
+            raw_ids = crud.copy_price_records(db, records)
+        with DB_COMMIT_SECONDS.time():
+            db.commit()
+        return raw_ids
+    finally:
+        db.close()
+
+
+def stored_price(price) -> float:
+    """A price rounded as processed_prices' NUMERIC(20,2) column stores it."""
+    return float(Decimal(str(float(price))).quantize(Decimal("0.01"), ROUND_HALF_UP))
+
+
+def open_spill_file(directory: str, instance_id: str) -> IO[str]:
+    """Creates this process's spill file and locks it for as long as it is open."""
+    os.makedirs(directory, exist_ok=True)
+    spill = open(
+        os.path.join(directory, f"{instance_id}-{os.getpid()}.jsonl"),
+        "a",
+        encoding="utf-8",
+    )
+    fcntl.flock(spill, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    return spill
+
+
+def close_spill_file(spill: IO[str]):
+    """Closes a spill file, removing it if nothing was spilled."""
+    if spill.tell() == 0:
+        os.remove(spill.name)
+    spill.close()
+
+
+def spill_price_records(spill: IO[str], records: list[PriceRecord]):
+    """Appends records that could not be written to the spill file."""
+    for record in records:
+        spill.write(
+            json.dumps(
+                {
+                    "symbol": record.symbol,
+                    "provider": record.provider,
+                    "price": record.price,
+                    "data": record.data,
+                    "timestamp": record.timestamp.isoformat(),
+                }
+            )
+            + "\n"
+        )
+    spill.flush()
+    os.fsync(spill.fileno())
+
+
+def take_spilled_records(directory: str, instance_id: str) -> list[PriceRecord]:
+    """
+    Reads and removes the spill files that earlier processes of this instance
+    left behind, returning the records they held. Files still locked by a
+    running process are skipped.
+    """
+    if not os.path.isdir(directory):
+        return []
+    records = []
+    for name in sorted(os.listdir(directory)):
+        if not (name.startswith(f"{instance_id}-") and name.endswith(".jsonl")):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            with open(path, encoding="utf-8") as spill:
+                fcntl.flock(spill, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                lines = spill.readlines()
+                os.remove(path)
+        except (BlockingIOError, FileNotFoundError):
+            # In use by a running process, or just taken by another one.
+            continue
+        for line in lines:
+            fields = json.loads(line)
+            fields["timestamp"] = datetime.fromisoformat(fields["timestamp"])
+            records.append(PriceRecord(**fields))
+    return records
+
+
+class IngestPipeline:
+    """
+    Write-behind stage for price points. Producers enqueue records and a
+    single flusher writes them in batches, when a batch is full or the
+    flush interval has passed. Price events are published only after their
+    batch is committed. When the queue is full, submit() waits. Batches that
+    keep failing are spilled to a file and written again on the next start.
+    A flusher that fails unexpectedly is restarted, and submit() raises once
+    the pipeline is stopped instead of waiting on a queue nobody drains.
+    """
+
+    def __init__(
+        self,
+        max_queue: int = INGEST_QUEUE_SIZE,
+        batch_size: int = INGEST_BATCH_SIZE,
+        flush_interval: float = INGEST_FLUSH_INTERVAL_SECONDS,
+    ):
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._task: Optional[asyncio.Task] = None
+        self._spill_file: Optional[IO[str]] = None
+        self.written = 0
+        self.dropped = 0
+        self.spilled = 0
+
+    async def submit(self, provider_name: str, prices: dict[str, dict]):
+        """Queues fetched prices for writing, waiting while the queue is full."""
+        if self._task is None or self._task.done():
+            raise RuntimeError("Ingest pipeline is not running")
+        for symbol, price_data in prices.items():
+            await self._queue.put(
+                PriceRecord(
+                    symbol=symbol,
+                    provider=provider_name,
+                    # Events carry the price as stored, not as fetched.
+                    price=stored_price(price_data["price"]),
+                    data=json.dumps(price_data),
+                )
+            )
+
+    def start(self):
+        self._task = asyncio.create_task(self._supervise())
+
+    async def stop(self):
+        """Flushes everything still queued, then stops the flusher."""
+        if self._task:
+            if not self._task.done():
+                await self._queue.put(_STOP)
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._spill_file:
+            await run_blocking(close_spill_file, self._spill_file)
+            self._spill_file = None
+
+    async def _supervise(self):
+        # Earlier files are taken before this process opens its own, which
+        # may have the same name after an in-process restart.
+        spilled = await self._take_spilled()
+        if INGEST_SPILL_DIR:
+            try:
+                self._spill_file = await run_blocking(
+                    open_spill_file, INGEST_SPILL_DIR, INGEST_INSTANCE_ID
+                )
+            except Exception:
+                logger.error("Opening the ingest spill file failed", exc_info=True)
+        for start in range(0, len(spilled), self._batch_size):
+            end = start + self._batch_size
+            await self._flush(spilled[start:end])
+
+        while True:
+            try:
+                await self._run()
+                return
+            except Exception:
+                logger.error("Ingest flusher failed, restarting", exc_info=True)
+                await asyncio.sleep(INGEST_RESTART_SECONDS)
+
+    async def _take_spilled(self) -> list[PriceRecord]:
+        """The records spilled by earlier processes of this instance."""
+        if not INGEST_SPILL_DIR:
+            return []
+        try:
+            records = await run_blocking(
+                take_spilled_records, INGEST_SPILL_DIR, INGEST_INSTANCE_ID
+            )
+        except Exception:
+            logger.error("Reading spilled ingest records failed", exc_info=True)
+            return []
+        if records:
+            logger.info("Writing spilled ingest records", records=len(records))
+        return records
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            deadline = loop.time() + self._flush_interval
+            while len(batch) < self._batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+    async def _flush(self, batch: list[PriceRecord]):
+        for attempt in range(INGEST_MAX_RETRIES):
+            try:
+                raw_ids = await run_blocking(write_price_records, batch)
+                break
+            except Exception:
+                logger.error(
+                    "Ingest flush failed",
+                    records=len(batch),
+                    attempt=attempt + 1,
+                    exc_info=True,
+                )
+                if attempt < INGEST_MAX_RETRIES - 1:
+                    await asyncio.sleep(2**attempt)
+        else:
+            await self._spill(batch)
+            return
+
+        producer = get_kafka_producer()
+        for raw_id, record in zip(raw_ids, batch):
+            publish_price_event(
+                producer, build_price_event(record, record.provider, raw_id)
+            )
+        self.written += len(batch)
+
+    async def _spill(self, batch: list[PriceRecord]):
+        if self._spill_file:
+            try:
+                await run_blocking(spill_price_records, self._spill_file, batch)
+                self.spilled += len(batch)
+                logger.error(
+                    "Spilled ingest batch",
+                    records=len(batch),
+                    path=self._spill_file.name,
+                )
+                return
+            except Exception:
+                logger.error("Spilling ingest batch failed", exc_info=True)
+        self.dropped += len(batch)
+        logger.error("Dropping ingest batch", records=len(batch))
+
+
+ingest_pipeline: IngestPipeline = None
+
+
+def get_ingest_pipeline() -> Optional[IngestPipeline]:
+    """
+    Returns the write-behind pipeline, or None when it is disabled.
+    """
+    return ingest_pipeline
+
+
+async def setup_ingest():
+    """
+    Starts the write-behind pipeline. To be called at application startup.
+    """
+    global ingest_pipeline
+    if not INGEST_ENABLED:
+        return
+    ingest_pipeline = IngestPipeline()
+    ingest_pipeline.start()
+
+
+async def close_ingest():
+    """
+    Flushes and stops the write-behind pipeline. To be called at application shutdown.
+    """
+    if ingest_pipeline:
+        await ingest_pipeline.stop()
+        logger.info(
+            "Ingest pipeline flushed",
+            written=ingest_pipeline.written,
+            spilled=ingest_pipeline.spilled,
+            dropped=ingest_pipeline.dropped,
+        )
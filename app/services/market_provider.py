@@ -1,33 +1,402 @@
+import asyncio
+import os
+import random
+import time
 from abc import ABC, abstractmethod
+from typing import Awaitable, Callable, Optional, TypeVar
 
+import numpy as np
 import structlog
 import yfinance as yf
 
+from app.core.circuit_breaker import CircuitBreaker, CircuitOpenError
+from app.core.executor import run_blocking
+from app.core.metrics import PROVIDER_FETCH_SECONDS, PROVIDER_RETRIES
+
 logger = structlog.get_logger(__name__)
 
+T = TypeVar("T")
+
+# Limits applied to every provider, each with its own semaphore and circuit.
+PROVIDER_MAX_CONCURRENCY = int(os.getenv("PROVIDER_MAX_CONCURRENCY", "8"))
+PROVIDER_TIMEOUT_SECONDS = float(os.getenv("PROVIDER_TIMEOUT_SECONDS", "5"))
+PROVIDER_MAX_RETRIES = int(os.getenv("PROVIDER_MAX_RETRIES", "2"))
+PROVIDER_RETRY_BASE_SECONDS = 0.2
+PROVIDER_CIRCUIT_FAILURE_THRESHOLD = int(
+    os.getenv("PROVIDER_CIRCUIT_FAILURE_THRESHOLD", "5")
+)
+PROVIDER_CIRCUIT_RESET_SECONDS = float(
+    os.getenv("PROVIDER_CIRCUIT_RESET_SECONDS", "30")
+)
+# Background bulk fetches (polling ticks) go through their own limits and
+# circuit, with a longer deadline, so they can never open the circuit that
+# interactive requests depend on.
+PROVIDER_BULK_MAX_CONCURRENCY = int(os.getenv("PROVIDER_BULK_MAX_CONCURRENCY", "4"))
+PROVIDER_BULK_TIMEOUT_SECONDS = float(os.getenv("PROVIDER_BULK_TIMEOUT_SECONDS", "30"))
+
+# Single-symbol yfinance requests arriving within this window are merged
+# into one multi-ticker download. 0 disables the merging.
+YFINANCE_BATCH_WINDOW_SECONDS = int(os.getenv("YFINANCE_BATCH_WINDOW_MS", "30")) / 1000
+YFINANCE_BATCH_MAX_SYMBOLS = int(os.getenv("YFINANCE_BATCH_MAX_SYMBOLS", "100"))
+
+# The synthetic "mock" provider, for benchmarks and offline runs.
+MOCK_PROVIDER_ENABLED = os.getenv("MOCK_PROVIDER_ENABLED", "false").lower() == "true"
+MOCK_PROVIDER_SEED = int(os.getenv("MOCK_PROVIDER_SEED", "42"))
+MOCK_PROVIDER_LATENCY_MS = float(os.getenv("MOCK_PROVIDER_LATENCY_MS", "0"))
+
+
+class ProviderUnavailableError(Exception):
+    """The provider timed out or failed on every attempt, or its circuit is open."""
+
+    def __init__(self, provider: str, retry_after: Optional[float] = None):
+        super().__init__(f"Provider '{provider}' is unavailable.")
+        self.provider = provider
+        self.retry_after = retry_after
+
 
 class MarketProvider(ABC):
+    # Seconds to collect single-symbol calls into one get_latest_prices call;
+    # 0 means every call goes to the provider on its own.
+    micro_batch_window: float = 0.0
+
     @abstractmethod
-    def get_latest_price(self, symbol: str) -> dict:
+    async def get_latest_price(self, symbol: str) -> Optional[dict]:
         pass
 
+    async def get_latest_prices(self, symbols: list[str]) -> dict[str, dict]:
+        """
+        Fetches the latest price for several symbols at once, keyed by symbol.
+        Symbols without data are left out. Providers with a bulk API should
+        override this; the default makes one call per symbol, concurrently.
+        """
+        fetched = await asyncio.gather(
+            *(self.get_latest_price(symbol) for symbol in symbols)
+        )
+        return {
+            symbol: price_data
+            for symbol, price_data in zip(symbols, fetched)
+            if price_data
+        }
+
 
 class YFinanceProvider(MarketProvider):
-    def get_latest_price(self, symbol: str) -> dict:
+    """
+    yfinance is a blocking SDK with its own HTTP session, so its calls run
+    on the bounded executor.
+    """
+
+    micro_batch_window = YFINANCE_BATCH_WINDOW_SECONDS
+
+    async def get_latest_price(self, symbol: str) -> Optional[dict]:
+        return await run_blocking(self._fetch_latest_price, symbol)
+
+    async def get_latest_prices(self, symbols: list[str]) -> dict[str, dict]:
+        if not symbols:
+            return {}
+        return await run_blocking(self._fetch_latest_prices, symbols)
+
+    def _fetch_latest_price(self, symbol: str) -> Optional[dict]:
         ticker = yf.Ticker(symbol)
-        hist = ticker.history(period="1d")
+        hist = ticker.history(period="1d", timeout=PROVIDER_TIMEOUT_SECONDS)
         if hist.empty:
             return None
         latest_price = hist["Close"].iloc[-1]
         return {"price": latest_price, "symbol": symbol}
 
+    def _fetch_latest_prices(self, symbols: list[str]) -> dict[str, dict]:
+        # One multi-ticker download instead of a history() call per symbol.
+        hist = yf.download(
+            tickers=list(symbols),
+            period="1d",
+            auto_adjust=True,
+            group_by="column",
+            threads=True,
+            progress=False,
+            timeout=PROVIDER_TIMEOUT_SECONDS,
+        )
+        if hist is None or hist.empty:
+            return {}
+
+        closes = hist["Close"]
+        if closes.ndim == 1:
+            closes = closes.to_frame(name=symbols[0])
+
+        # The last non-NaN close of every ticker, read straight from the
+        # array rather than building a frame or series per ticker.
+        values = closes.to_numpy(dtype=np.float64)
+        has_price = ~np.isnan(values)
+        last_rows = len(values) - 1 - has_price[::-1].argmax(axis=0)
+        last_closes = values[last_rows, np.arange(values.shape[1])]
+
+        # yfinance upper-cases tickers; map them back to what the caller asked for.
+        requested = {symbol.upper(): symbol for symbol in symbols}
+        results = {}
+        for ticker, found, latest_price in zip(
+            closes.columns, has_price.any(axis=0), last_closes.tolist()
+        ):
+            if not found:  # No data for this ticker
+                continue
+            symbol = requested.get(ticker, ticker)
+            results[symbol] = {"price": latest_price, "symbol": symbol}
+        return results
+
+
+class MockProvider(MarketProvider):
+    """
+    Synthetic prices without any upstream. Each symbol follows its own
+    random walk seeded from `seed` and the symbol, so runs with the same
+    seed and call order see the same prices. Every call first waits
+    `latency` seconds, to stand in for a real provider's round trip.
+    """
+
+    def __init__(
+        self,
+        seed: int = MOCK_PROVIDER_SEED,
+        latency: float = MOCK_PROVIDER_LATENCY_MS / 1000,
+        volatility: float = 0.01,
+    ):
+        self._seed = seed
+        self._latency = latency
+        self._volatility = volatility
+        self._walks: dict[str, list] = {}
+
+    def next_price(self, symbol: str) -> float:
+        walk = self._walks.get(symbol)
+        if walk is None:
+            rng = random.Random(f"{self._seed}:{symbol}")
+            walk = self._walks[symbol] = [rng, rng.uniform(10, 500)]
+        rng, price = walk
+        walk[1] = max(0.01, price * (1 + rng.gauss(0, self._volatility)))
+        return round(walk[1], 2)
+
+    async def get_latest_price(self, symbol: str) -> Optional[dict]:
+        if self._latency:
+            await asyncio.sleep(self._latency)
+        return {"price": self.next_price(symbol), "symbol": symbol}
+
+    async def get_latest_prices(self, symbols: list[str]) -> dict[str, dict]:
+        if self._latency:
+            await asyncio.sleep(self._latency)
+        return {
+            symbol: {"price": self.next_price(symbol), "symbol": symbol}
+            for symbol in symbols
+        }
+
+
+class MicroBatchingProvider(MarketProvider):
+    """
+    Merges single-symbol calls that arrive within `window` seconds into one
+    get_latest_prices call, and hands each waiting caller its symbol's
+    result. A batch is sent early once it holds `max_symbols` symbols.
+    """
+
+    def __init__(self, provider: MarketProvider, window: float, max_symbols: int):
+        self.provider = provider
+        self._window = window
+        self._max_symbols = max_symbols
+        self._pending: dict[str, list[asyncio.Future]] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._tasks: set[asyncio.Task] = set()
+
+    async def get_latest_price(self, symbol: str) -> Optional[dict]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.setdefault(symbol, []).append(future)
+        if len(self._pending) >= self._max_symbols:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self._window, self._flush)
+        return await future
+
+    async def get_latest_prices(self, symbols: list[str]) -> dict[str, dict]:
+        return await self.provider.get_latest_prices(symbols)
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, {}
+        if batch:
+            task = asyncio.ensure_future(self._fetch(batch))
+            # Keep a reference so the task is not garbage collected mid-flight.
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _fetch(self, batch: dict[str, list[asyncio.Future]]):
+        try:
+            results = await self.provider.get_latest_prices(list(batch))
+        except Exception as e:
+            for futures in batch.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+
+        for symbol, futures in batch.items():
+            for future in futures:
+                # Callers that gave up have cancelled their future.
+                if not future.done():
+                    future.set_result(results.get(symbol))
+
+
+class ResilientProvider(MarketProvider):
+    """
+    Guards a provider so a slow or failing upstream degrades gracefully:
+    at most `max_concurrency` calls run at once, each attempt has a
+    deadline, failures are retried with jittered exponential backoff, and
+    a circuit breaker fails fast while the upstream keeps failing.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        provider: MarketProvider,
+        max_concurrency: int = PROVIDER_MAX_CONCURRENCY,
+        timeout: float = PROVIDER_TIMEOUT_SECONDS,
+        max_retries: int = PROVIDER_MAX_RETRIES,
+    ):
+        self.name = name
+        self.provider = provider
+        self.breaker = CircuitBreaker(
+            name, PROVIDER_CIRCUIT_FAILURE_THRESHOLD, PROVIDER_CIRCUIT_RESET_SECONDS
+        )
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._timeout = timeout
+        self._max_retries = max_retries
+        self._fetch_ok_seconds = PROVIDER_FETCH_SECONDS.labels(name, "ok")
+        self._fetch_error_seconds = PROVIDER_FETCH_SECONDS.labels(name, "error")
+        self._retries = PROVIDER_RETRIES.labels(name)
+
+    async def get_latest_price(self, symbol: str) -> Optional[dict]:
+        return await self._call(lambda: self.provider.get_latest_price(symbol))
+
+    async def get_latest_prices(self, symbols: list[str]) -> dict[str, dict]:
+        return await self._call(lambda: self.provider.get_latest_prices(symbols))
+
+    async def _call(self, fn: Callable[[], Awaitable[T]]) -> T:
+        started = time.perf_counter()
+        try:
+            result = await self._call_with_retries(fn)
+        except BaseException:
+            self._fetch_error_seconds.observe(time.perf_counter() - started)
+            raise
+        self._fetch_ok_seconds.observe(time.perf_counter() - started)
+        return result
+
+    async def _call_with_retries(self, fn: Callable[[], Awaitable[T]]) -> T:
+        for attempt in range(self._max_retries + 1):
+            try:
+                self.breaker.before_call()
+            except CircuitOpenError as e:
+                raise ProviderUnavailableError(self.name, e.retry_after) from e
+
+            try:
+                result = await self._attempt(fn)
+            except asyncio.CancelledError:
+                self.breaker.record_abandoned()
+                raise
+            except Exception as e:
+                self.breaker.record_failure()
+                logger.warning(
+                    "Provider call failed",
+                    provider=self.name,
+                    attempt=attempt + 1,
+                    error=repr(e),
+                )
+                if attempt == self._max_retries:
+                    raise ProviderUnavailableError(self.name) from e
+                self._retries.inc()
+                # Full jitter, so callers that failed together do not retry together.
+                await asyncio.sleep(
+                    random.uniform(0, PROVIDER_RETRY_BASE_SECONDS * 2**attempt)
+                )
+            else:
+                self.breaker.record_success()
+                return result
+
+    async def _attempt(self, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Runs one call under the semaphore, with one deadline covering the
+        wait for a slot and the call. A call that misses its deadline is
+        abandoned, not cancelled, since executor threads cannot be
+        interrupted; it keeps its semaphore slot until it really ends, so
+        hung calls cannot pile up beyond the limit.
+        """
+        async with asyncio.timeout(self._timeout):
+            await self._semaphore.acquire()
+            task = asyncio.ensure_future(fn())
+            task.add_done_callback(self._release)
+            return await asyncio.shield(task)
+
+    def _release(self, task: asyncio.Task):
+        self._semaphore.release()
+        if not task.cancelled():
+            task.exception()  # Retrieved, so abandoned failures are not reported twice
+
+
+# Provider classes by name. Instances are created once, on first use, and
+# shared by every request and polling job. Requests and polling jobs wrap
+# the same instance in separate ResilientProviders.
+_provider_factories: dict[str, Callable[[], MarketProvider]] = {
+    "yfinance": YFinanceProvider,
+}
+_instances: dict[str, MarketProvider] = {}
+_providers: dict[str, MarketProvider] = {}
+_bulk_providers: dict[str, MarketProvider] = {}
+
+if MOCK_PROVIDER_ENABLED:
+    _provider_factories["mock"] = MockProvider
+
+
+def register_provider(name: str, factory: Callable[[], MarketProvider]):
+    """Makes a provider available to get_provider under `name`."""
+    _provider_factories[name] = factory
+    _instances.pop(name, None)
+    _providers.pop(name, None)
+    _bulk_providers.pop(name, None)
+
+
+def _get_instance(provider_name: str) -> MarketProvider:
+    instance = _instances.get(provider_name)
+    if instance is not None:
+        return instance
+
+    factory = _provider_factories.get(provider_name)
+    if factory is None:
+        logger.error("Provider not supported", provider=provider_name, exc_info=True)
+        raise ValueError(f"Provider '{provider_name}' not supported.")
+    instance = _instances[provider_name] = factory()
+    return instance
+
 
 def get_provider(provider_name: str) -> MarketProvider:
-    if provider_name == "yfinance":
-        return YFinanceProvider()
-    logger.error(
-        "Provider not supported",
-        provider=provider_name,
-        exc_info=True
-    )
-    raise ValueError(f"Provider '{provider_name}' not supported.")
+    provider = _providers.get(provider_name)
+    if provider is not None:
+        return provider
+
+    instance = _get_instance(provider_name)
+    # Merged calls go through the limits as one call.
+    provider = ResilientProvider(provider_name, instance)
+    if instance.micro_batch_window > 0:
+        provider = MicroBatchingProvider(
+            provider, instance.micro_batch_window, YFINANCE_BATCH_MAX_SYMBOLS
+        )
+    _providers[provider_name] = provider
+    return provider
+
+
+def get_bulk_provider(provider_name: str) -> MarketProvider:
+    """
+    The provider for background bulk fetches: the same instance as
+    get_provider's, behind its own semaphore, deadline and circuit breaker.
+    """
+    provider = _bulk_providers.get(provider_name)
+    if provider is None:
+        provider = ResilientProvider(
+            f"{provider_name}:bulk",
+            _get_instance(provider_name),
+            max_concurrency=PROVIDER_BULK_MAX_CONCURRENCY,
+            timeout=PROVIDER_BULK_TIMEOUT_SECONDS,
+        )
+        _bulk_providers[provider_name] = provider
+    return provider
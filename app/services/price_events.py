@@ -0,0 +1,49 @@
+import json
+from datetime import datetime
+from typing import Final, Protocol
+
+from app.core.kafka_config import produce
+
+TOPIC: Final[str] = "price-events"
+EVENT_TIMESTAMP_FORMAT: Final[str] = "%Y-%m-%dT%H:%M:%S.%fZ"
+
+
+class PricePoint(Protocol):
+    """A stored price: an ORM ProcessedPrice, a RETURNING row or a PriceRecord."""
+
+    symbol: str
+    price: float
+    timestamp: datetime
+
+
+def build_price_event(
+    processed_price: PricePoint, source: str, raw_response_id: int
+) -> dict:
+    """Builds the event payload published to the price-events topic."""
+    return {
+        "symbol": processed_price.symbol,
+        "price": float(processed_price.price),
+        # The stored timestamp at full precision, so time-weighted indicators
+        # computed from events match those backfilled from processed_prices.
+        "timestamp": processed_price.timestamp.strftime(EVENT_TIMESTAMP_FORMAT),
+        "source": source,
+        "raw_response_id": str(raw_response_id),
+    }
+
+
+def parse_event_timestamp(value: str) -> datetime:
+    """
+    Reads an event's naive UTC timestamp; events published before timestamps
+    carried microseconds have whole seconds.
+    """
+    return datetime.fromisoformat(value.removesuffix("Z"))
+
+
+def publish_price_event(producer, message: dict):
+    """Queues a price event on the producer, keyed by symbol for ordering."""
+    produce(
+        producer,
+        TOPIC,
+        key=message["symbol"],
+        value=json.dumps(message).encode("utf-8"),
+    )
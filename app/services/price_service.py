@@ -0,0 +1,395 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import Counter
+from typing import Final, Optional
+
+import structlog
+from redis.asyncio import Redis
+
+from app.core.db import AsyncSessionLocal
+from app.core.kafka_config import get_kafka_producer
+from app.core.local_cache import LocalCache
+from app.core.metrics import (
+    CACHE_LOCAL_HITS,
+    CACHE_MISSES,
+    CACHE_REDIS_HITS,
+    DB_COMMIT_SECONDS,
+    DB_INSERT_SECONDS,
+    LOCAL_CACHES,
+    REDIS_GET_SECONDS,
+    REDIS_MGET_SECONDS,
+    REDIS_SET_SECONDS,
+)
+from app.core.single_flight import SingleFlight, acquire_lock, release_lock
+from app.schemas.price import PriceLatest
+from app.services import crud, market_provider
+from app.services.market_provider import MarketProvider
+from app.services.price_events import build_price_event, publish_price_event
+
+logger = structlog.get_logger(__name__)
+
+# Entries younger than the soft TTL are fresh. Older ones are still served
+# (stale-while-revalidate) while one background refresh runs, until the
+# hard TTL expires them from Redis.
+CACHE_SOFT_TTL_SECONDS = float(os.getenv("CACHE_SOFT_TTL_SECONDS", "60"))
+CACHE_HARD_TTL_SECONDS = int(os.getenv("CACHE_HARD_TTL_SECONDS", "300"))
+
+# Proactive refresh of the most requested keys, so they rarely go stale.
+PROACTIVE_REFRESH_TOP_N = int(os.getenv("PROACTIVE_REFRESH_TOP_N", "0"))
+PROACTIVE_REFRESH_INTERVAL_SECONDS = float(
+    os.getenv("PROACTIVE_REFRESH_INTERVAL_SECONDS", "10")
+)
+
+# Cross-replica coalescing: only the lock holder refreshes a key, the other
+# replicas wait for it to land in the cache.
+REDIS_LOCK_ENABLED = os.getenv("PRICE_REFRESH_REDIS_LOCK", "false").lower() == "true"
+REDIS_LOCK_TTL_MS = int(os.getenv("PRICE_REFRESH_LOCK_TTL_MS", "5000"))
+REDIS_LOCK_POLL_SECONDS = 0.05
+
+# In-process L1 in front of Redis. Replicas keep each other's L1 fresh by
+# publishing every refreshed entry on CACHE_CHANNEL.
+LOCAL_CACHE_MAX_ENTRIES = int(os.getenv("LOCAL_CACHE_MAX_ENTRIES", "10000"))
+LOCAL_CACHE_TTL_SECONDS = float(os.getenv("LOCAL_CACHE_TTL_SECONDS", "5"))
+# Part of every cache key and of the channel name. Bump it whenever the
+# entry format changes, so replicas of different versions never read each
+# other's entries during a rolling deploy.
+CACHE_FORMAT_VERSION: Final[str] = "v2"
+CACHE_CHANNEL: Final[str] = f"price-cache-updates:{CACHE_FORMAT_VERSION}"
+INSTANCE_ID: Final[str] = uuid.uuid4().hex
+
+local_price_cache = LocalCache(LOCAL_CACHE_MAX_ENTRIES, LOCAL_CACHE_TTL_SECONDS)
+LOCAL_CACHES.register("price", local_price_cache)
+_single_flight = SingleFlight()
+_request_counts: Counter = Counter()
+_background_tasks: set[asyncio.Task] = set()
+_cache_sync_task: Optional[asyncio.Task] = None
+_proactive_refresh_task: Optional[asyncio.Task] = None
+
+
+def price_cache_key(symbol: str, provider_name: str) -> str:
+    return f"price:{CACHE_FORMAT_VERSION}:{symbol}:{provider_name}"
+
+
+def is_stale(entry: dict) -> bool:
+    """True once a cache entry is older than the soft TTL."""
+    return time.time() - entry["refreshed_at"] >= CACHE_SOFT_TTL_SECONDS
+
+
+def track_request(symbol: str, provider_name: str):
+    """Counts a lookup, to pick the keys worth refreshing proactively."""
+    if PROACTIVE_REFRESH_TOP_N > 0:
+        _request_counts[(symbol, provider_name)] += 1
+
+
+async def get_cached_prices(
+    redis: Redis, cache_keys: list[str]
+) -> list[Optional[dict]]:
+    """
+    Looks keys up in the local cache first and resolves the rest with one
+    Redis MGET, filling the local cache from what Redis returns. Entries are
+    dicts holding the `price` and its `refreshed_at` epoch time.
+    """
+    results = [local_price_cache.get(key) for key in cache_keys]
+    missing = [i for i, cached in enumerate(results) if cached is None]
+    CACHE_LOCAL_HITS.inc(len(cache_keys) - len(missing))
+    if not missing:
+        return results
+
+    with REDIS_MGET_SECONDS.time():
+        remote = await redis.mget([cache_keys[i] for i in missing])
+    for i, cached_price in zip(missing, remote):
+        if cached_price:
+            results[i] = json.loads(cached_price)
+            local_price_cache.set(cache_keys[i], results[i])
+    found = sum(1 for cached_price in remote if cached_price)
+    CACHE_REDIS_HITS.inc(found)
+    CACHE_MISSES.inc(len(missing) - found)
+    return results
+
+
+async def get_cached_price(redis: Redis, cache_key: str) -> Optional[dict]:
+    cached = local_price_cache.get(cache_key)
+    if cached is not None:
+        CACHE_LOCAL_HITS.inc()
+        return cached
+    with REDIS_GET_SECONDS.time():
+        cached_price = await redis.get(cache_key)
+    if not cached_price:
+        CACHE_MISSES.inc()
+        return None
+    CACHE_REDIS_HITS.inc()
+    cached = json.loads(cached_price)
+    local_price_cache.set(cache_key, cached)
+    return cached
+
+
+async def cache_prices(redis: Redis, prices: dict[str, PriceLatest]):
+    """
+    Stores prices in both cache tiers and tells the other replicas, all in
+    one Redis pipeline round trip.
+    """
+    refreshed_at = time.time()
+    async with redis.pipeline(transaction=False) as pipe:
+        for cache_key, price in prices.items():
+            entry = {
+                "price": price.model_dump(mode="json"),
+                "refreshed_at": refreshed_at,
+            }
+            local_price_cache.set(cache_key, entry)
+            pipe.set(cache_key, json.dumps(entry), ex=CACHE_HARD_TTL_SECONDS)
+            pipe.publish(
+                CACHE_CHANNEL,
+                json.dumps({"origin": INSTANCE_ID, "key": cache_key, "value": entry}),
+            )
+        with REDIS_SET_SECONDS.time():
+            await pipe.execute()
+
+
+async def _sync_local_cache(redis: Redis):
+    while True:
+        pubsub = redis.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(CACHE_CHANNEL)
+            async for message in pubsub.listen():
+                update = json.loads(message["data"])
+                if update["origin"] == INSTANCE_ID:
+                    continue
+                if update.get("value") is None:
+                    local_price_cache.invalidate(update["key"])
+                else:
+                    local_price_cache.set(update["key"], update["value"])
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Entries may be stale while disconnected; their TTL bounds that.
+            logger.error("Price cache sync failed, reconnecting", exc_info=True)
+            local_price_cache.clear()
+            await asyncio.sleep(1)
+        finally:
+            await pubsub.reset()
+
+
+async def refresh_latest_prices(
+    symbols: list[str],
+    provider_name: str,
+    provider_service: MarketProvider,
+    redis: Redis,
+) -> dict[str, PriceLatest]:
+    """
+    Fetches the latest prices with one provider call, stores them in one
+    transaction, publishes their price events and caches the results.
+    Symbols the provider has no data for are left out.
+    """
+    if len(symbols) == 1:
+        price_data = await provider_service.get_latest_price(symbols[0])
+        fetched = {symbols[0]: price_data} if price_data else {}
+    else:
+        fetched = await provider_service.get_latest_prices(symbols)
+    if not fetched:
+        return {}
+
+    # One INSERT ... RETURNING round trip plus the commit.
+    async with AsyncSessionLocal() as db:
+        with DB_INSERT_SECONDS.time():
+            rows = await db.run_sync(
+                crud.create_prices, provider=provider_name, prices=fetched
+            )
+        with DB_COMMIT_SECONDS.time():
+            await db.commit()
+
+    producer = get_kafka_producer()
+    results = {}
+    for row in rows:
+        publish_price_event(
+            producer, build_price_event(row, provider_name, row.raw_response_id)
+        )
+        results[row.symbol] = PriceLatest(
+            symbol=row.symbol,
+            price=float(row.price),
+            timestamp=row.timestamp,
+            provider=provider_name,
+        )
+
+    await cache_prices(
+        redis,
+        {price_cache_key(symbol, provider_name): p for symbol, p in results.items()},
+    )
+    return results
+
+
+async def refresh_latest_price(
+    symbol: str,
+    provider_name: str,
+    provider_service: MarketProvider,
+    redis: Redis,
+) -> Optional[PriceLatest]:
+    """Single-symbol refresh_latest_prices. Returns None if the provider has no data."""
+    results = await refresh_latest_prices(
+        [symbol], provider_name, provider_service, redis
+    )
+    return results.get(symbol)
+
+
+async def _refresh_with_redis_lock(
+    symbol: str,
+    provider_name: str,
+    provider_service: MarketProvider,
+    redis: Redis,
+) -> Optional[PriceLatest]:
+    cache_key = price_cache_key(symbol, provider_name)
+    lock_key = f"lock:{cache_key}"
+
+    token = await acquire_lock(redis, lock_key, REDIS_LOCK_TTL_MS)
+    if token:
+        try:
+            return await refresh_latest_price(
+                symbol, provider_name, provider_service, redis
+            )
+        finally:
+            await release_lock(redis, lock_key, token)
+
+    # Another replica is refreshing this key: wait for its fresh result.
+    deadline = time.monotonic() + REDIS_LOCK_TTL_MS / 1000
+    while time.monotonic() < deadline:
+        await asyncio.sleep(REDIS_LOCK_POLL_SECONDS)
+        cached_price = await redis.get(cache_key)
+        if cached_price:
+            entry = json.loads(cached_price)
+            if not is_stale(entry):
+                return PriceLatest.model_validate(entry["price"])
+        if not await redis.exists(lock_key):
+            break
+
+    # The holder failed or found no data; refresh ourselves.
+    logger.warning(
+        "Refresh lock released without a cached result",
+        symbol=symbol,
+        provider=provider_name,
+    )
+    return await refresh_latest_price(symbol, provider_name, provider_service, redis)
+
+
+async def load_latest_price(
+    symbol: str,
+    provider_name: str,
+    provider_service: MarketProvider,
+    redis: Redis,
+) -> Optional[PriceLatest]:
+    """
+    Refreshes a price after a cache miss. Concurrent misses for the same key
+    in this process share one refresh; with PRICE_REFRESH_REDIS_LOCK enabled,
+    concurrent misses across replicas do too.
+    """
+    refresh = _refresh_with_redis_lock if REDIS_LOCK_ENABLED else refresh_latest_price
+    return await _single_flight.do(
+        price_cache_key(symbol, provider_name),
+        lambda: refresh(symbol, provider_name, provider_service, redis),
+    )
+
+
+def _run_in_background(coro, **log_context):
+    async def runner():
+        try:
+            await coro
+        except Exception:
+            logger.error(
+                "Background price refresh failed", exc_info=True, **log_context
+            )
+
+    task = asyncio.create_task(runner())
+    # Keep a reference so the task is not garbage collected mid-flight.
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+def schedule_refresh(symbol: str, provider_name: str, redis: Redis):
+    """Starts a background refresh of a stale key, unless one is in flight."""
+    if _single_flight.in_flight(price_cache_key(symbol, provider_name)):
+        return
+    provider_service = market_provider.get_provider(provider_name)
+    _run_in_background(
+        load_latest_price(symbol, provider_name, provider_service, redis),
+        symbol=symbol,
+        provider=provider_name,
+    )
+
+
+def schedule_batch_refresh(symbols: list[str], provider_name: str, redis: Redis):
+    """Refreshes several stale keys in the background with one provider call."""
+    symbols = [
+        s
+        for s in symbols
+        if not _single_flight.in_flight(price_cache_key(s, provider_name))
+    ]
+    if not symbols:
+        return
+    provider_service = market_provider.get_provider(provider_name)
+    _run_in_background(
+        _single_flight.do(
+            # Later batches with the same stale set join this refresh.
+            f"batch:{provider_name}:{','.join(symbols)}",
+            lambda: refresh_latest_prices(
+                symbols, provider_name, provider_service, redis
+            ),
+        ),
+        provider=provider_name,
+        symbols=len(symbols),
+    )
+
+
+async def _refresh_popular_keys(redis: Redis):
+    while True:
+        await asyncio.sleep(PROACTIVE_REFRESH_INTERVAL_SECONDS)
+        popular = _request_counts.most_common(PROACTIVE_REFRESH_TOP_N)
+        # Halve the counts so popularity follows recent traffic.
+        for key in list(_request_counts):
+            _request_counts[key] //= 2
+            if not _request_counts[key]:
+                del _request_counts[key]
+
+        for (symbol, provider_name), _ in popular:
+            try:
+                entry = await get_cached_price(
+                    redis, price_cache_key(symbol, provider_name)
+                )
+                # Refresh entries that would go stale before the next pass.
+                horizon = time.time() + PROACTIVE_REFRESH_INTERVAL_SECONDS
+                age_at_horizon = horizon - entry["refreshed_at"] if entry else None
+                if age_at_horizon is None or age_at_horizon >= CACHE_SOFT_TTL_SECONDS:
+                    schedule_refresh(symbol, provider_name, redis)
+            except Exception:
+                logger.error(
+                    "Proactive refresh failed",
+                    symbol=symbol,
+                    provider=provider_name,
+                    exc_info=True,
+                )
+
+
+async def start_cache_sync(redis: Redis):
+    """
+    Starts listening for cache updates from other replicas and, if enabled,
+    the proactive refresh of popular keys. To be called at application startup.
+    """
+    global _cache_sync_task, _proactive_refresh_task
+    _cache_sync_task = asyncio.create_task(_sync_local_cache(redis))
+    if PROACTIVE_REFRESH_TOP_N > 0:
+        _proactive_refresh_task = asyncio.create_task(_refresh_popular_keys(redis))
+
+
+async def stop_cache_sync():
+    """
+    Stops the background cache tasks. To be called at application shutdown.
+    """
+    global _cache_sync_task, _proactive_refresh_task
+    tasks = [
+        t for t in (_cache_sync_task, _proactive_refresh_task, *_background_tasks) if t
+    ]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    _cache_sync_task = None
+    _proactive_refresh_task = None
@@ -0,0 +1,216 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Final, Iterable, Optional
+
+import structlog
+from confluent_kafka import Consumer
+
+from app.core.executor import run_blocking
+from app.core.kafka_config import KAFKA_BOOTSTRAP_SERVERS
+from app.services.price_events import TOPIC
+from app.services.price_service import INSTANCE_ID
+
+logger = structlog.get_logger(__name__)
+
+PRICE_STREAM_ENABLED = os.getenv("PRICE_STREAM_ENABLED", "true").lower() == "true"
+# Pending updates held per client before the oldest ones are dropped.
+STREAM_QUEUE_SIZE = int(os.getenv("PRICE_STREAM_QUEUE_SIZE", "100"))
+# Idle streams send a keep-alive this often.
+STREAM_HEARTBEAT_SECONDS = 15
+# SSE streams can only notice a disconnect between waits, so they wait for
+# updates this long at a time.
+STREAM_DISCONNECT_CHECK_SECONDS = 1
+STREAM_CONSUME_BATCH = 500
+STREAM_CONSUME_TIMEOUT_SECONDS = 0.5
+# After a consumer failure, reconnects wait twice as long each time, up to
+# the maximum. A consumer that ran longer than that starts over at the minimum.
+STREAM_RECONNECT_MIN_SECONDS = 1
+STREAM_RECONNECT_MAX_SECONDS = 30
+
+CONFLATE: Final[str] = "conflate"
+DROP_OLDEST: Final[str] = "drop"
+
+
+class Subscription:
+    """
+    One client's bounded queue of price events. With CONFLATE, a pending
+    update for a symbol is replaced by the newer one, so a slow client only
+    ever gets the latest price. With DROP_OLDEST, every update is queued
+    and the oldest ones are dropped when the queue is full.
+    """
+
+    def __init__(
+        self,
+        symbols: frozenset,
+        mode: str = CONFLATE,
+        max_size: int = STREAM_QUEUE_SIZE,
+    ):
+        self.symbols = symbols
+        self.mode = mode
+        self.dropped = 0
+        self._max_size = max_size
+        self._pending: OrderedDict[str, str] = OrderedDict()
+        self._queue: deque = deque()
+        self._ready = asyncio.Event()
+
+    def push(self, symbol: str, payload: str):
+        if self.mode == CONFLATE:
+            if symbol in self._pending:
+                del self._pending[symbol]
+            elif len(self._pending) >= self._max_size:
+                self._pending.popitem(last=False)
+                self.dropped += 1
+            self._pending[symbol] = payload
+        else:
+            if len(self._queue) >= self._max_size:
+                self._queue.popleft()
+                self.dropped += 1
+            self._queue.append(payload)
+        self._ready.set()
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[str]:
+        """Waits for the next event payload, or returns None on timeout."""
+        if not self._pending and not self._queue:
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        if self._pending:
+            return self._pending.popitem(last=False)[1]
+        return self._queue.popleft()
+
+
+class PriceStreamHub:
+    """
+    Fans price events out to subscribers. A single Kafka consumer per
+    process reads price-events on a background thread and hands each batch
+    to the event loop, which routes events by symbol (the message key)
+    through a per-symbol subscriber index, without decoding the payloads.
+    """
+
+    def __init__(self):
+        self._subscribers: dict[str, set[Subscription]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._running = threading.Event()
+        self._stopped = threading.Event()
+
+    def subscribe(self, symbols: Iterable[str], mode: str = CONFLATE) -> Subscription:
+        subscription = Subscription(frozenset(symbols), mode)
+        for symbol in subscription.symbols:
+            self._subscribers.setdefault(symbol, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        for symbol in subscription.symbols:
+            subscribers = self._subscribers.get(symbol)
+            if subscribers is None:
+                continue
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[symbol]
+
+    def _dispatch(self, events: list[tuple[str, str]]):
+        for symbol, payload in events:
+            for subscription in self._subscribers.get(symbol, ()):
+                subscription.push(symbol, payload)
+
+    def _consume(self):
+        """Runs the consumer until stopped, reconnecting with backoff when it fails."""
+        backoff = STREAM_RECONNECT_MIN_SECONDS
+        while self._running.is_set():
+            started = time.monotonic()
+            try:
+                self._consume_until_stopped()
+            except Exception:
+                if time.monotonic() - started > STREAM_RECONNECT_MAX_SECONDS:
+                    backoff = STREAM_RECONNECT_MIN_SECONDS
+                # Events published until the new consumer joins are missed.
+                logger.error(
+                    "Price stream consumer failed, reconnecting",
+                    retry_in=backoff,
+                    exc_info=True,
+                )
+                self._stopped.wait(backoff)
+                backoff = min(backoff * 2, STREAM_RECONNECT_MAX_SECONDS)
+
+    def _consume_until_stopped(self):
+        consumer = Consumer(
+            {
+                "bootstrap.servers": KAFKA_BOOTSTRAP_SERVERS,
+                # Every API process needs every event, so each has its own
+                # group and starts at the newest offset.
+                "group.id": f"price-stream-{INSTANCE_ID}",
+                "auto.offset.reset": "latest",
+                "enable.auto.commit": False,
+            }
+        )
+        try:
+            consumer.subscribe([TOPIC])
+            while self._running.is_set():
+                messages = consumer.consume(
+                    num_messages=STREAM_CONSUME_BATCH,
+                    timeout=STREAM_CONSUME_TIMEOUT_SECONDS,
+                )
+                events = [
+                    (msg.key().decode(), msg.value().decode())
+                    for msg in messages
+                    if not msg.error() and msg.key()
+                ]
+                if events:
+                    self._loop.call_soon_threadsafe(self._dispatch, events)
+        finally:
+            consumer.close()
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._stopped.clear()
+        self._running.set()
+        self._thread = threading.Thread(
+            target=self._consume, name="price-stream-consumer", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._running.clear()
+        self._stopped.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+price_stream_hub: PriceStreamHub = None
+
+
+def get_price_stream_hub() -> Optional[PriceStreamHub]:
+    """
+    Returns the process-wide stream hub, or None when streaming is disabled.
+    """
+    return price_stream_hub
+
+
+async def setup_price_stream():
+    """
+    Starts the shared price-events consumer. To be called at application startup.
+    """
+    global price_stream_hub
+    if not PRICE_STREAM_ENABLED:
+        return
+    price_stream_hub = PriceStreamHub()
+    price_stream_hub.start()
+    print("Price stream consumer started.")
+
+
+async def close_price_stream():
+    """
+    Stops the shared price-events consumer. To be called at application shutdown.
+    """
+    global price_stream_hub
+    if price_stream_hub:
+        await run_blocking(price_stream_hub.stop)
+        price_stream_hub = None
+        print("Price stream consumer stopped.")
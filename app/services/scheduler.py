@@ -0,0 +1,289 @@
+import asyncio
+import os
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import structlog
+
+from app.core.db import SessionLocal
+from app.core.executor import run_blocking
+from app.core.kafka_config import get_kafka_producer
+from app.core.redis import get_redis_pool
+from app.core.single_flight import acquire_lock
+from app.models.price import PollingJobConfigs
+from app.services import crud, market_provider
+from app.services.ingest import get_ingest_pipeline
+from app.services.market_provider import ProviderUnavailableError
+from app.services.price_events import build_price_event, publish_price_event
+
+logger = structlog.get_logger(__name__)
+
+SCHEDULER_ENABLED = os.getenv("POLLING_SCHEDULER_ENABLED", "true").lower() == "true"
+# How often stored configs are re-read, so jobs created by other replicas run too.
+RELOAD_INTERVAL_SECONDS = int(os.getenv("POLLING_RELOAD_INTERVAL_SECONDS", "30"))
+MIN_INTERVAL_SECONDS = 1
+# Every replica runs the scheduler, but each tick is claimed with a Redis
+# lease so only one of them fetches and stores it.
+LEADER_LEASE_ENABLED = os.getenv("POLLING_LEADER_LEASE", "true").lower() == "true"
+# Most symbols sent to a provider in one call; larger ticks are split into
+# concurrent chunks, each with its own deadline.
+POLLING_CHUNK_MAX_SYMBOLS = int(
+    os.getenv(
+        "POLLING_CHUNK_MAX_SYMBOLS", str(market_provider.YFINANCE_BATCH_MAX_SYMBOLS)
+    )
+)
+
+
+@dataclass(frozen=True)
+class PollingJob:
+    id: int
+    symbols: tuple[str, ...]
+    interval: int
+    provider: str
+
+    @classmethod
+    def from_config(cls, config: PollingJobConfigs) -> "PollingJob":
+        symbols = tuple(s.strip() for s in config.symbols.split(",") if s.strip())
+        return cls(
+            id=config.id,
+            symbols=symbols,
+            interval=max(int(config.interval), MIN_INTERVAL_SECONDS),
+            provider=config.provider,
+        )
+
+
+def group_symbols_by_provider(jobs: list[PollingJob]) -> dict[str, list[str]]:
+    """
+    Merges the symbols of several jobs per provider, so a symbol shared by
+    many jobs is only fetched once per tick. First-seen order is kept.
+    """
+    grouped: dict[str, dict[str, None]] = {}
+    for job in jobs:
+        symbols = grouped.setdefault(job.provider, {})
+        for symbol in job.symbols:
+            symbols.setdefault(symbol, None)
+    return {provider: list(symbols) for provider, symbols in grouped.items()}
+
+
+def load_polling_jobs() -> list[PollingJob]:
+    """Reads all polling job configs from the database."""
+    db = SessionLocal()
+    try:
+        return [PollingJob.from_config(c) for c in crud.get_polling_job_configs(db)]
+    finally:
+        db.close()
+
+
+def store_prices(provider_name: str, prices: dict[str, dict]) -> int:
+    """
+    Persists one tick's prices in a single transaction, then queues their
+    price events on the shared producer.
+    """
+    db = SessionLocal()
+    try:
+        rows = crud.create_prices(db, provider=provider_name, prices=prices)
+        db.commit()
+        messages = [
+            build_price_event(row, provider_name, row.raw_response_id) for row in rows
+        ]
+    finally:
+        db.close()
+
+    producer = get_kafka_producer()
+    for message in messages:
+        publish_price_event(producer, message)
+    return len(messages)
+
+
+class PollingScheduler:
+    """
+    Runs stored polling jobs. Jobs sharing an interval are grouped into one
+    tick bucket, and every tick fetches each provider's deduplicated symbol
+    set with a single multi-symbol provider call.
+    """
+
+    def __init__(self, reload_interval: int = RELOAD_INTERVAL_SECONDS):
+        self._jobs: dict[int, PollingJob] = {}
+        self._buckets: dict[int, asyncio.Task] = {}
+        self._reload_interval = reload_interval
+        self._reload_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        await self.reload()
+        self._reload_task = asyncio.create_task(self._reload_loop())
+        logger.info("Polling scheduler started", jobs=len(self._jobs))
+
+    async def stop(self):
+        tasks = list(self._buckets.values())
+        if self._reload_task:
+            tasks.append(self._reload_task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._buckets.clear()
+        self._reload_task = None
+        logger.info("Polling scheduler stopped")
+
+    def add_job(self, job: PollingJob):
+        self._jobs[job.id] = job
+        self._ensure_bucket(job.interval)
+
+    async def reload(self):
+        jobs = await run_blocking(load_polling_jobs)
+        self._jobs = {job.id: job for job in jobs}
+        for interval in {job.interval for job in jobs}:
+            self._ensure_bucket(interval)
+
+    def _ensure_bucket(self, interval: int):
+        task = self._buckets.get(interval)
+        if task is None or task.done():
+            self._buckets[interval] = asyncio.create_task(self._run_bucket(interval))
+
+    async def _reload_loop(self):
+        while True:
+            await asyncio.sleep(self._reload_interval)
+            try:
+                await self.reload()
+            except Exception:
+                logger.error("Failed to reload polling jobs", exc_info=True)
+
+    async def _claim_tick(self, interval: int, tick: int) -> bool:
+        """True if this replica won the lease for tick number `tick` of a bucket."""
+        if not LEADER_LEASE_ENABLED:
+            return True
+        try:
+            token = await acquire_lock(
+                get_redis_pool(), f"polling:tick:{interval}:{tick}", interval * 1000
+            )
+        except Exception:
+            # Skipping is safer than every replica polling at once.
+            logger.error(
+                "Failed to claim polling tick", interval=interval, exc_info=True
+            )
+            return False
+        return token is not None
+
+    async def _run_bucket(self, interval: int):
+        while True:
+            jobs = [job for job in self._jobs.values() if job.interval == interval]
+            if not jobs:
+                self._buckets.pop(interval, None)
+                return
+
+            # Ticks are aligned to wall-clock multiples of the interval, so
+            # the replicas' tick N all compete for the same lease.
+            tick = int(time.time() // interval)
+            if await self._claim_tick(interval, tick):
+                started = time.monotonic()
+                try:
+                    await self.run_tick(jobs)
+                except Exception:
+                    logger.error(
+                        "Polling tick failed", interval=interval, exc_info=True
+                    )
+
+                elapsed = time.monotonic() - started
+                if elapsed > interval:
+                    logger.warning(
+                        "Polling tick overran its interval",
+                        interval=interval,
+                        elapsed=round(elapsed, 3),
+                    )
+            await asyncio.sleep(max(0.0, (tick + 1) * interval - time.time()))
+
+    async def run_tick(self, jobs: list[PollingJob]) -> int:
+        """Fetches and stores one tick for the given jobs, returning the row count."""
+        grouped = group_symbols_by_provider(jobs)
+        counts = await asyncio.gather(
+            *(self._fetch_and_store(name, symbols) for name, symbols in grouped.items())
+        )
+        return sum(counts)
+
+    async def _fetch_chunks(
+        self,
+        provider_name: str,
+        provider_service: market_provider.MarketProvider,
+        symbols: list[str],
+    ) -> dict[str, dict]:
+        """
+        Fetches the symbols in chunks of POLLING_CHUNK_MAX_SYMBOLS, concurrently,
+        so one tick never sends the provider a download too large for its
+        deadline. Chunks whose provider call fails are skipped.
+        """
+        chunks = []
+        for start in range(0, len(symbols), POLLING_CHUNK_MAX_SYMBOLS):
+            end = start + POLLING_CHUNK_MAX_SYMBOLS
+            chunks.append(symbols[start:end])
+        fetched = await asyncio.gather(
+            *(provider_service.get_latest_prices(chunk) for chunk in chunks),
+            return_exceptions=True,
+        )
+        prices = {}
+        for chunk, result in zip(chunks, fetched):
+            if isinstance(result, ProviderUnavailableError):
+                logger.warning(
+                    "Skipping polling chunk, provider unavailable",
+                    provider=provider_name,
+                    symbols=len(chunk),
+                )
+            elif isinstance(result, BaseException):
+                raise result
+            else:
+                prices.update(result)
+        return prices
+
+    async def _fetch_and_store(self, provider_name: str, symbols: list[str]) -> int:
+        try:
+            provider_service = market_provider.get_bulk_provider(provider_name)
+        except ValueError:
+            return 0
+
+        started = time.monotonic()
+        prices = await self._fetch_chunks(provider_name, provider_service, symbols)
+        stored = 0
+        if prices:
+            pipeline = get_ingest_pipeline()
+            if pipeline:
+                # Written behind by the ingest pipeline; waits only when it is full.
+                await pipeline.submit(provider_name, prices)
+                stored = len(prices)
+            else:
+                stored = await run_blocking(store_prices, provider_name, prices)
+        logger.info(
+            "Polling tick complete",
+            provider=provider_name,
+            symbols=len(symbols),
+            stored=stored,
+            elapsed=round(time.monotonic() - started, 3),
+        )
+        return stored
+
+
+polling_scheduler: PollingScheduler = None
+
+
+def get_scheduler() -> Optional[PollingScheduler]:
+    """
+    Dependency function to get the polling scheduler, or None when disabled.
+    """
+    return polling_scheduler
+
+
+async def start_scheduler():
+    """
+    Starts the polling scheduler. To be called at application startup.
+    """
+    global polling_scheduler
+    if not SCHEDULER_ENABLED:
+        return
+    polling_scheduler = PollingScheduler()
+    await polling_scheduler.start()
+
+
+async def stop_scheduler():
+    """
+    Stops the polling scheduler. To be called at application shutdown.
+    """
+    if polling_scheduler:
+        await polling_scheduler.stop()
@@ -0,0 +1,160 @@
+import argparse
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy import text
+
+from app.services.indicators import ChunkedIndicators
+from ma_consumer import INDICATORS, SessionLocal, engine, save_indicators
+
+load_dotenv()
+
+# --- Configuration ---
+BACKFILL_WORKERS = int(os.getenv("BACKFILL_WORKERS", str(os.cpu_count() or 1)))
+BACKFILL_CHUNK_SIZE = int(os.getenv("BACKFILL_CHUNK_SIZE", "200000"))
+# Results are upserted this many symbols at a time.
+UPSERT_BATCH_SIZE = 500
+PROGRESS_REPORT_SECONDS = 5
+
+
+def get_symbols() -> list[str]:
+    with SessionLocal() as db:
+        return list(
+            db.execute(
+                text("SELECT DISTINCT symbol FROM processed_prices ORDER BY symbol")
+            ).scalars()
+        )
+
+
+def backfill_symbol(symbol: str, chunk_size: int) -> tuple[str, int, dict[str, float]]:
+    """
+    Streams one symbol's prices in time order through a server-side cursor
+    and computes the indicators chunk by chunk. Returns the symbol, the
+    number of prices read and the final indicator values.
+    """
+    indicators = ChunkedIndicators(INDICATORS)
+    rows = 0
+    values: dict[str, float] = {}
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor(name=f"backfill_{os.getpid()}")
+        cursor.itersize = chunk_size
+        cursor.execute(
+            """
+            SELECT EXTRACT(EPOCH FROM timestamp)::DOUBLE PRECISION,
+                   price::DOUBLE PRECISION
+            FROM processed_prices
+            WHERE symbol = %(symbol)s
+            ORDER BY timestamp, id
+        """,
+            {"symbol": symbol},
+        )
+        while True:
+            chunk = cursor.fetchmany(chunk_size)
+            if not chunk:
+                break
+            data = np.array(chunk, dtype=np.float64)
+            rows += len(data)
+            for name, series in indicators.add(data[:, 0], data[:, 1]).items():
+                if not math.isnan(series[-1]):
+                    values[name] = float(series[-1])
+                else:
+                    values.pop(name, None)
+        cursor.close()
+    finally:
+        conn.close()
+    return symbol, rows, values
+
+
+def prune_indicators():
+    """Deletes stored indicators that are no longer configured."""
+    with SessionLocal() as db:
+        deleted = db.execute(
+            text("DELETE FROM symbol_indicators WHERE indicator <> ALL(:names)"),
+            {"names": [spec.name for spec in INDICATORS]},
+        ).rowcount
+        db.commit()
+    print(f"Pruned {deleted} indicator rows no longer configured")
+
+
+def run_backfill(
+    symbols: list[str] = None,
+    workers: int = BACKFILL_WORKERS,
+    chunk_size: int = BACKFILL_CHUNK_SIZE,
+    prune: bool = False,
+):
+    """
+    Rebuilds symbol_indicators and symbol_averages from processed_prices.
+    Symbols are spread over a process pool; results are bulk upserted by
+    this process as workers finish them.
+    """
+    symbols = symbols or get_symbols()
+    print(
+        f"Backfilling {[spec.name for spec in INDICATORS]} for {len(symbols)} "
+        f"symbols with {workers} workers"
+    )
+
+    started = time.monotonic()
+    reported = started
+    done = 0
+    total_rows = 0
+    pending: dict[str, dict[str, float]] = {}
+
+    # Spawn, not fork: the parent's DB connections must not be shared.
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        futures = [
+            pool.submit(backfill_symbol, symbol, chunk_size) for symbol in symbols
+        ]
+        for future in as_completed(futures):
+            symbol, rows, values = future.result()
+            done += 1
+            total_rows += rows
+            if values:
+                pending[symbol] = values
+            if len(pending) >= UPSERT_BATCH_SIZE:
+                save_indicators(pending)
+                pending = {}
+
+            now = time.monotonic()
+            if now - reported >= PROGRESS_REPORT_SECONDS or done == len(symbols):
+                elapsed = now - started
+                print(
+                    f"{done}/{len(symbols)} symbols, {total_rows} rows "
+                    f"({total_rows / elapsed:.0f} rows/sec)"
+                )
+                reported = now
+
+    save_indicators(pending)
+    if prune:
+        prune_indicators()
+    print(f"Backfill finished in {time.monotonic() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Rebuild symbol indicators and moving averages from history"
+    )
+    parser.add_argument(
+        "--symbols", help="Comma separated symbols to rebuild (default: all)"
+    )
+    parser.add_argument("--workers", type=int, default=BACKFILL_WORKERS)
+    parser.add_argument("--chunk-size", type=int, default=BACKFILL_CHUNK_SIZE)
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        help="Delete stored indicators that are no longer in MA_INDICATORS",
+    )
+    args = parser.parse_args()
+
+    run_backfill(
+        symbols=args.symbols.split(",") if args.symbols else None,
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+        prune=args.prune,
+    )
@@ -0,0 +1,118 @@
+"""
+In-process load benchmark for GET /prices/latest.
+
+Drives app.main:app through httpx's ASGI transport, with the local
+stand-ins from benchmarks.local_stack for Redis, Postgres and Kafka and
+the deterministic mock provider. Reports throughput and p50/p95/p99
+latency for the cache-hit path (one symbol requested over and over) and
+the cache-miss path (a new symbol per request), and saves them as JSON.
+
+    python -m benchmarks.bench_api --requests 5000 --concurrency 50
+"""
+
+# Must come first: it points the configuration at the local stand-ins.
+from benchmarks.local_stack import local_stack  # isort: skip
+
+import argparse
+import asyncio
+import time
+from typing import Callable
+
+import httpx
+
+from benchmarks.common import print_table, save_results, summarize
+
+PROVIDER = "mock"
+
+
+async def drive(
+    client: httpx.AsyncClient,
+    params_for: Callable[[int], dict],
+    requests: int,
+    concurrency: int,
+) -> dict:
+    """Sends `requests` requests from `concurrency` concurrent clients."""
+    latencies = []
+    errors = 0
+    indexes = iter(range(requests))
+
+    async def client_loop():
+        nonlocal errors
+        for i in indexes:
+            started = time.perf_counter()
+            response = await client.get("/prices/latest", params=params_for(i))
+            latencies.append((time.perf_counter() - started) * 1000)
+            if response.status_code != 200:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - started, errors)
+
+
+async def run(
+    requests: int, concurrency: int, provider_latency_ms: float, with_logging: bool
+) -> dict:
+    async with local_stack(provider_latency_ms / 1000, with_logging) as stack:
+        transport = httpx.ASGITransport(app=stack.app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://bench"
+        ) as client:
+            # Warm up, and put the hit-path symbol in the cache.
+            await client.get(
+                "/prices/latest", params={"symbol": "HIT", "provider_name": PROVIDER}
+            )
+            results = {
+                "cache_hit": await drive(
+                    client,
+                    lambda i: {"symbol": "HIT", "provider_name": PROVIDER},
+                    requests,
+                    concurrency,
+                ),
+                "cache_miss": await drive(
+                    client,
+                    lambda i: {"symbol": f"MISS{i:07d}", "provider_name": PROVIDER},
+                    requests,
+                    concurrency,
+                ),
+            }
+        results["cache_miss"]["rows_written"] = stack.store.written
+        results["cache_miss"]["events_produced"] = stack.producer.produced
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument(
+        "--provider-latency-ms",
+        type=float,
+        default=0.0,
+        help="Simulated provider round trip on the cache-miss path",
+    )
+    parser.add_argument(
+        "--with-logging",
+        action="store_true",
+        help="Keep INFO request logging on, to include its cost",
+    )
+    parser.add_argument("--output", help="JSON results file")
+    args = parser.parse_args()
+
+    results = asyncio.run(
+        run(
+            args.requests,
+            args.concurrency,
+            args.provider_latency_ms,
+            args.with_logging,
+        )
+    )
+    print_table(
+        results, ["throughput_rps", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "errors"]
+    )
+    path = save_results("api", vars(args), results, args.output)
+    print(f"Results saved to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Micro-benchmark for the cache-miss insert path.
+
+Compares the ORM path (create_raw_response + create_processed_price, each a
+flush and a refresh) with crud.create_prices (one INSERT ... RETURNING),
+both followed by a commit. Reports database round trips and latency per
+price point. Needs DATABASE_URL to point at a database with the schema from
+scripts/create_tables.sql; the rows it writes are deleted afterwards.
+
+    python -m benchmarks.bench_price_insert --iterations 500
+"""
+
+import argparse
+import statistics
+import time
+
+from sqlalchemy import event, text
+
+from app.core.db import SessionLocal, engine
+from app.services import crud
+
+BENCH_SYMBOL = "BENCH_INSERT"
+PROVIDER = "benchmark"
+
+
+class RoundTripCounter:
+    """Counts statements sent to the database, plus commits."""
+
+    def __init__(self):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+        event.listen(engine, "commit", self._on_commit)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+    def _on_commit(self, *args):
+        self.count += 1
+
+
+def orm_insert(db, price_data: dict):
+    raw_response = crud.create_raw_response(
+        db=db, symbol=BENCH_SYMBOL, provider=PROVIDER, response_data=price_data
+    )
+    crud.create_processed_price(
+        db=db, raw_response=raw_response, price=price_data["price"]
+    )
+    db.commit()
+
+
+def returning_insert(db, price_data: dict):
+    crud.create_prices(db, provider=PROVIDER, prices={BENCH_SYMBOL: price_data})
+    db.commit()
+
+
+def run(name: str, insert, iterations: int, counter: RoundTripCounter) -> dict:
+    latencies = []
+    with SessionLocal() as db:
+        # Warm up the connection so the first iteration is not an outlier.
+        insert(db, {"price": 100.0, "symbol": BENCH_SYMBOL})
+        counter.count = 0
+        for i in range(iterations):
+            price_data = {"price": 100.0 + i / 100, "symbol": BENCH_SYMBOL}
+            started = time.perf_counter()
+            insert(db, price_data)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    latencies.sort()
+    return {
+        "path": name,
+        "round_trips": counter.count / iterations,
+        "mean_ms": statistics.fmean(latencies),
+        "p50_ms": latencies[len(latencies) // 2],
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1],
+    }
+
+
+def cleanup():
+    with SessionLocal() as db:
+        db.execute(
+            text("DELETE FROM processed_prices WHERE symbol = :s"), {"s": BENCH_SYMBOL}
+        )
+        db.execute(
+            text("DELETE FROM raw_responses WHERE symbol = :s"), {"s": BENCH_SYMBOL}
+        )
+        db.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--iterations", type=int, default=500)
+    args = parser.parse_args()
+
+    counter = RoundTripCounter()
+    try:
+        results = [
+            run("orm flush+refresh", orm_insert, args.iterations, counter),
+            run("cte returning", returning_insert, args.iterations, counter),
+        ]
+    finally:
+        cleanup()
+
+    print(f"{'path':<20}{'round trips':>12}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for r in results:
+        print(
+            f"{r['path']:<20}{r['round_trips']:>12.1f}{r['mean_ms']:>10.2f}"
+            f"{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Latency statistics and JSON result files shared by the benchmarks."""
+
+import json
+import platform
+import statistics
+import subprocess
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+RESULTS_DIR = Path(__file__).parent / "results"
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = round(q / 100 * len(sorted_values))
+    return sorted_values[max(0, min(len(sorted_values), rank) - 1)]
+
+
+def summarize(latencies_ms: list[float], elapsed: float, errors: int = 0) -> dict:
+    latencies_ms = sorted(latencies_ms)
+    return {
+        "requests": len(latencies_ms),
+        "errors": errors,
+        "throughput_rps": len(latencies_ms) / elapsed if elapsed else 0.0,
+        "mean_ms": statistics.fmean(latencies_ms) if latencies_ms else 0.0,
+        "p50_ms": percentile(latencies_ms, 50),
+        "p95_ms": percentile(latencies_ms, 95),
+        "p99_ms": percentile(latencies_ms, 99),
+        "max_ms": latencies_ms[-1] if latencies_ms else 0.0,
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(
+    benchmark: str, config: dict, results: dict, output: Optional[str] = None
+) -> Path:
+    """
+    Writes results with the commit and settings they were measured with.
+    By default they go to benchmarks/results/<benchmark>-<commit>-<time>.json.
+    """
+    commit = git_commit()
+    created_at = datetime.now()
+    if output:
+        path = Path(output)
+    else:
+        path = RESULTS_DIR / (
+            f"{benchmark}-{commit or 'unknown'}-{created_at:%Y%m%dT%H%M%S}.json"
+        )
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(
+        json.dumps(
+            {
+                "benchmark": benchmark,
+                "commit": commit,
+                "created_at": created_at.isoformat(),
+                "python": platform.python_version(),
+                "config": config,
+                "results": results,
+            },
+            indent=2,
+        )
+    )
+    return path
+
+
+def print_table(results: dict, columns: list[str]):
+    print(f"{'path':<16}" + "".join(f"{column:>16}" for column in columns))
+    for name, row in results.items():
+        print(f"{name:<16}" + "".join(f"{row[column]:>16.2f}" for column in columns))
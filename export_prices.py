@@ -0,0 +1,158 @@
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+
+load_dotenv()
+
+# --- Configuration ---
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "100000"))
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+if not DATABASE_URL:
+    raise ValueError("DATABASE_URL environment variable not set")
+
+engine = create_engine(DATABASE_URL)
+
+SCHEMA = pa.schema(
+    [
+        ("id", pa.int64()),
+        ("symbol", pa.string()),
+        ("price", pa.float64()),
+        ("timestamp", pa.timestamp("us")),
+        ("provider", pa.string()),
+        ("raw_response_id", pa.int64()),
+    ]
+)
+
+
+def build_query(
+    symbols: list[str] = None, start: datetime = None, end: datetime = None
+) -> tuple[str, dict]:
+    conditions = []
+    params = {}
+    if symbols:
+        conditions.append("symbol = ANY(%(symbols)s)")
+        params["symbols"] = symbols
+    if start:
+        conditions.append("timestamp >= %(start)s")
+        params["start"] = start
+    if end:
+        conditions.append("timestamp < %(end)s")
+        params["end"] = end
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return (
+        f"""
+        SELECT id, symbol, price::DOUBLE PRECISION, timestamp, provider, raw_response_id
+        FROM processed_prices
+        {where}
+        ORDER BY symbol, timestamp
+    """,
+        params,
+    )
+
+
+def iter_record_batches(
+    symbols: list[str] = None,
+    start: datetime = None,
+    end: datetime = None,
+    chunk_size: int = EXPORT_CHUNK_SIZE,
+):
+    """
+    Yields processed prices as Arrow record batches of up to `chunk_size`
+    rows, read through a server-side cursor so memory stays bounded.
+    """
+    query, params = build_query(symbols, start, end)
+    conn = engine.raw_connection()
+    try:
+        # A named cursor keeps the result set on the server.
+        cursor = conn.cursor(name="export_prices")
+        cursor.itersize = chunk_size
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            columns = list(zip(*rows))
+            yield pa.RecordBatch.from_arrays(
+                [
+                    pa.array(column, type=field.type)
+                    for column, field in zip(columns, SCHEMA)
+                ],
+                schema=SCHEMA,
+            )
+        cursor.close()
+    finally:
+        conn.close()
+
+
+def open_writer(output: str, fmt: str):
+    """
+    Returns a writer for `output` ("-" for stdout). Arrow files can be
+    memory-mapped and read without copying; each Parquet write is a row group.
+    """
+    sink = sys.stdout.buffer if output == "-" else output
+    if fmt == "parquet":
+        return pq.ParquetWriter(sink, SCHEMA, compression="zstd")
+    if output == "-":
+        return pa.ipc.new_stream(sink, SCHEMA)
+    return pa.ipc.new_file(sink, SCHEMA)
+
+
+def export_prices(
+    output: str,
+    fmt: str = "arrow",
+    symbols: list[str] = None,
+    start: datetime = None,
+    end: datetime = None,
+    chunk_size: int = EXPORT_CHUNK_SIZE,
+) -> int:
+    started = time.perf_counter()
+    rows = 0
+    writer = open_writer(output, fmt)
+    try:
+        for batch in iter_record_batches(symbols, start, end, chunk_size):
+            if fmt == "parquet":
+                writer.write_table(pa.Table.from_batches([batch]))
+            else:
+                writer.write_batch(batch)
+            rows += batch.num_rows
+            elapsed = time.perf_counter() - started
+            print(
+                f"Exported {rows} rows ({rows / elapsed:.0f} rows/sec)",
+                file=sys.stderr,
+            )
+    finally:
+        writer.close()
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export processed prices as Arrow IPC or Parquet"
+    )
+    parser.add_argument("output", help="Output file, or '-' for stdout")
+    parser.add_argument("--format", choices=("arrow", "parquet"), default="arrow")
+    parser.add_argument(
+        "--symbols", help="Comma separated symbols to export (default: all)"
+    )
+    parser.add_argument("--start", type=datetime.fromisoformat, help="Inclusive start")
+    parser.add_argument("--end", type=datetime.fromisoformat, help="Exclusive end")
+    parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    export_prices(
+        args.output,
+        fmt=args.format,
+        symbols=args.symbols.split(",") if args.symbols else None,
+        start=args.start,
+        end=args.end,
+        chunk_size=args.chunk_size,
+    )
@@ -1,24 +1,79 @@
+import argparse
+import calendar
 import json
+import multiprocessing
 import os
+import signal
 import socket
 import time
+from datetime import datetime, timedelta
 
 from confluent_kafka import Consumer, Producer
 from dotenv import load_dotenv
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
 from sqlalchemy import create_engine, text
-from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from app.services.indicators import (
+    IndicatorSet,
+    IndicatorSpec,
+    parse_indicators,
+    seed_requirements,
+)
+from app.services.price_events import parse_event_timestamp
+
+load_dotenv()
 
 # --- Configuration ---
-KAFKA_BOOTSTRAP_SERVERS = "localhost:9092"
+KAFKA_BOOTSTRAP_SERVERS = os.getenv("KAFKA_BOOTSTRAP_SERVERS", "localhost:9092")
 PRICE_TOPIC = "price-events"
 DLQ_TOPIC = "price-events-dlq"  # Dead Letter Queue topic
 CONSUMER_GROUP_ID = "ma_calculators"
 MAX_RETRIES = 3
-
-producer_conf = {"bootstrap.servers": KAFKA_BOOTSTRAP_SERVERS}
-producer = Producer(producer_conf)
-
-load_dotenv()
+# Indicators to maintain per symbol, see app/services/indicators.py.
+INDICATORS = parse_indicators()
+# Seeding the indicators reads this many recent days before the full history.
+SEED_LOOKBACK_DAYS = 7
+# Batch mode: up to BATCH_SIZE messages are handled together, waiting at most
+# BATCH_MAX_LATENCY seconds for a batch to fill.
+BATCH_SIZE = int(os.getenv("MA_CONSUMER_BATCH_SIZE", "500"))
+BATCH_MAX_LATENCY = float(os.getenv("MA_CONSUMER_BATCH_MAX_LATENCY", "0.5"))
+THROUGHPUT_REPORT_SECONDS = 10
+LAG_REPORT_SECONDS = 10
+WORKERS = int(os.getenv("MA_CONSUMER_WORKERS", "1"))
+# Each worker serves Prometheus metrics on this port plus its index; 0 disables.
+METRICS_PORT = int(os.getenv("MA_CONSUMER_METRICS_PORT", "9101"))
+
+# --- Metrics ---
+
+EVENTS_PROCESSED = Counter(
+    "consumer_events_total", "Price events applied to the indicators"
+)
+PROCESSING_SECONDS = Histogram(
+    "consumer_processing_seconds",
+    "Time to apply, save and commit one event, or one batch in batch mode",
+    ["mode"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+RETRIES = Counter(
+    "consumer_retries_total", "Failed event applications and saves that were retried"
+)
+DLQ_MESSAGES = Counter(
+    "consumer_dlq_messages_total", "Events sent to the dead letter queue"
+)
+PARTITION_LAG = Gauge(
+    "consumer_partition_lag",
+    "Messages between the position and the end of each assigned partition",
+    ["partition"],
+)
+_lag_partitions: set[int] = set()
+
+# Created lazily so worker processes never inherit a producer from a parent.
+producer: Producer = None
+
+# Cleared by SIGTERM/SIGINT so the consume loops exit and close cleanly,
+# which lets the group rebalance right away instead of on session timeout.
+_running = True
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
@@ -32,12 +87,6 @@ engine = create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
-def calculate_moving_average(prices: list[float]) -> float:
-    if not prices:
-        return 0.0
-    return sum(prices) / len(prices)
-
-
 def wait_for_port(host, port, timeout=30):
     start = time.time()
     while True:
@@ -52,44 +101,204 @@ def wait_for_port(host, port, timeout=30):
             time.sleep(1)
 
 
-def get_last5_price_by_symbol(symbol: str):
-    """Retrieves last 5 processed price for a given symbol."""
-    db: Session = SessionLocal()
-    result = db.execute(
-        text(
-            """
-            SELECT price
+class IndicatorState:
+    """
+    Per-symbol indicators for the partitions this consumer owns. A symbol's
+    indicators are seeded from processed_prices the first time it is seen
+    after an assignment, then updated from event payloads only.
+    """
+
+    def __init__(self, specs: tuple[IndicatorSpec, ...] = INDICATORS):
+        self.specs = specs
+        self.seed_samples, self.seed_seconds = seed_requirements(specs)
+        self._indicators: dict[str, IndicatorSet] = {}
+        self._partitions: dict[str, int] = {}
+        # Offset of the last event applied from each partition.
+        self._offsets: dict[int, int] = {}
+        self._last_values: dict[str, dict[str, float]] = {}
+
+    def drop_partitions(self, partitions: set[int]):
+        """Forgets symbols of partitions that were revoked, lost or reassigned."""
+        for symbol, partition in list(self._partitions.items()):
+            if partition in partitions:
+                del self._partitions[symbol]
+                self._indicators.pop(symbol, None)
+                self._last_values.pop(symbol, None)
+        for partition in partitions:
+            self._offsets.pop(partition, None)
+
+    def update(
+        self,
+        symbol: str,
+        partition: int,
+        offset: int,
+        timestamp: datetime,
+        price: float,
+        raw_response_id: int,
+        volume: float = None,
+    ) -> dict[str, float]:
+        """Adds an event's price and returns the symbol's indicator values."""
+        indicators = self._indicators.get(symbol)
+        if indicators is None:
+            indicators = IndicatorSet(self.specs)
+            since = None
+            if self.seed_seconds:
+                since = timestamp - timedelta(seconds=self.seed_seconds)
+            for seeded_at, seeded_price in get_prices_before(
+                symbol, timestamp, raw_response_id, self.seed_samples, since
+            ):
+                self._last_values[symbol] = indicators.update(
+                    to_epoch(seeded_at), seeded_price
+                )
+            self._indicators[symbol] = indicators
+            self._partitions[symbol] = partition
+
+        # Retries and redeliveries of an event must not count its price twice.
+        # Offsets only grow within a partition, unlike raw response ids, which
+        # replicas and batched writers reserve out of order.
+        if offset > self._offsets.get(partition, -1):
+            self._last_values[symbol] = indicators.update(
+                to_epoch(timestamp), price, volume
+            )
+            self._offsets[partition] = offset
+        return self._last_values[symbol]
+
+
+def to_epoch(timestamp: datetime) -> float:
+    """Seconds since the epoch for a naive timestamp, as PostgreSQL computes it."""
+    return calendar.timegm(timestamp.timetuple()) + timestamp.microsecond / 1e6
+
+
+def get_prices_before(
+    symbol: str,
+    timestamp: datetime,
+    raw_response_id: int,
+    limit: int,
+    since: datetime = None,
+) -> list[tuple[datetime, float]]:
+    """
+    Retrieves the prices stored before an event that the indicators need for
+    warming up, oldest first: the last `limit` prices plus every price from
+    `since` on, if given. "Before" follows the stream's (timestamp, id)
+    order, with the raw response id only breaking ties, since ids are
+    reserved out of order; the plain timestamp bound lets Postgres prune
+    later partitions. Recent days are searched first for the last `limit`
+    prices so only their partitions are read.
+    """
+    query = """
+        SELECT timestamp, price FROM (
+            (SELECT id, timestamp, price
             FROM processed_prices
             WHERE symbol = :symbol
+            AND timestamp <= :timestamp
+            AND (timestamp, raw_response_id) < (:timestamp, :raw_response_id)
+            {time_filter}
             ORDER BY timestamp DESC
-            LIMIT 5
-        """
-        ),
-        {"symbol": symbol},
-    ).fetchall()
-
-    return [float(row[0]) for row in result]
-
-
-def save_symbol_ma(symbol: str, ma: float):
-    db: Session = SessionLocal()
-    db.execute(
-        text(
-            """
-            INSERT INTO symbol_averages(symbol, moving_average)
-            VALUES (:symbol, :moving_average)
-            ON CONFLICT (symbol)
-            DO UPDATE SET moving_average = EXCLUDED.moving_average
-        """
-        ),
-        {"symbol": symbol, "moving_average": ma},
+            LIMIT :limit)
+            UNION
+            (SELECT id, timestamp, price
+            FROM processed_prices
+            WHERE symbol = :symbol
+            AND timestamp <= :timestamp
+            AND (timestamp, raw_response_id) < (:timestamp, :raw_response_id)
+            AND timestamp >= :since)
+        ) seed
+        ORDER BY timestamp, id
+    """
+    params = {
+        "symbol": symbol,
+        "timestamp": timestamp,
+        "raw_response_id": raw_response_id,
+        "limit": limit,
+        "since": since,
+        "recent": datetime.now() - timedelta(days=SEED_LOOKBACK_DAYS),
+    }
+    with SessionLocal() as db:
+        result = db.execute(
+            text(query.format(time_filter="AND timestamp >= :recent")), params
+        ).fetchall()
+        if len(result) < limit:
+            result = db.execute(text(query.format(time_filter="")), params).fetchall()
+
+    return [(row[0], float(row[1])) for row in result]
+
+
+def save_indicators(results: dict[str, dict[str, float]]):
+    """
+    Upserts the indicator values of many symbols, one multi-row statement per
+    table in a single transaction. The first configured indicator is also
+    written to symbol_averages as the symbol's moving average.
+    """
+    primary = INDICATORS[0].name
+    indicator_values = []
+    average_values = []
+    params = {}
+    for i, (symbol, values) in enumerate(results.items()):
+        params[f"symbol_{i}"] = symbol
+        for j, (name, value) in enumerate(values.items()):
+            indicator_values.append(
+                f"(:symbol_{i}, :indicator_{i}_{j}, :value_{i}_{j})"
+            )
+            params[f"indicator_{i}_{j}"] = name
+            params[f"value_{i}_{j}"] = value
+        if primary in values:
+            average_values.append(f"(:symbol_{i}, :moving_average_{i})")
+            params[f"moving_average_{i}"] = values[primary]
+
+    with SessionLocal() as db:
+        if indicator_values:
+            db.execute(
+                text(
+                    f"""
+                    INSERT INTO symbol_indicators(symbol, indicator, value)
+                    VALUES {", ".join(indicator_values)}
+                    ON CONFLICT (symbol, indicator)
+                    DO UPDATE SET value = EXCLUDED.value, updated_at = NOW()
+                """
+                ),
+                params,
+            )
+        if average_values:
+            db.execute(
+                text(
+                    f"""
+                    INSERT INTO symbol_averages(symbol, moving_average)
+                    VALUES {", ".join(average_values)}
+                    ON CONFLICT (symbol)
+                    DO UPDATE SET moving_average = EXCLUDED.moving_average
+                """
+                ),
+                params,
+            )
+        db.commit()
+
+
+def get_dlq_producer() -> Producer:
+    global producer
+    if producer is None:
+        producer = Producer({"bootstrap.servers": KAFKA_BOOTSTRAP_SERVERS})
+    return producer
+
+
+def send_to_dlq(msg):
+    print(
+        f"""Max retries ({MAX_RETRIES}) exceeded.
+        Sending message to DLQ: {DLQ_TOPIC}"""
     )
-    db.commit()
-
+    DLQ_MESSAGES.inc()
+    producer = get_dlq_producer()
+    producer.produce(
+        topic=DLQ_TOPIC,
+        value=msg.value(),
+        key=msg.key(),
+        headers=msg.headers(),  # Preserve original headers
+    )
+    producer.poll(0)
 
-def run_consumer():
 
-    wait_for_port("localhost", 9092, 60)
+def create_consumer(state: IndicatorState) -> Consumer:
+    host, _, port = KAFKA_BOOTSTRAP_SERVERS.split(",")[0].partition(":")
+    wait_for_port(host, int(port or 9092), 60)
 
     consumer_conf = {
         "bootstrap.servers": KAFKA_BOOTSTRAP_SERVERS,
@@ -99,31 +308,169 @@ def run_consumer():
     }
 
     consumer = Consumer(consumer_conf)
-    consumer.subscribe([PRICE_TOPIC])
+
+    def on_assign(consumer, partitions):
+        state.drop_partitions({p.partition for p in partitions})
+
+    def on_revoke(consumer, partitions):
+        state.drop_partitions({p.partition for p in partitions})
+
+    consumer.subscribe(
+        [PRICE_TOPIC], on_assign=on_assign, on_revoke=on_revoke, on_lost=on_revoke
+    )
+    return consumer
+
+
+def report_lag(consumer: Consumer):
+    """Prints and exports this worker's lag for each assigned partition."""
+    positions = consumer.position(consumer.assignment())
+    lags = {}
+    for tp in positions:
+        low, high = consumer.get_watermark_offsets(tp, timeout=5)
+        # A negative position means nothing has been consumed or committed yet.
+        lags[tp.partition] = high - (tp.offset if tp.offset >= 0 else low)
+        PARTITION_LAG.labels(tp.partition).set(lags[tp.partition])
+    # Partitions that moved to another worker are no longer reported here.
+    for partition in _lag_partitions - lags.keys():
+        PARTITION_LAG.remove(partition)
+    _lag_partitions.clear()
+    _lag_partitions.update(lags)
+    if not lags:
+        return
+    total = sum(lags.values())
+    print(f"[worker {os.getpid()}] lag per partition {lags}, total {total}")
+
+
+def apply_event(state: IndicatorState, msg) -> tuple[str, dict[str, float]]:
+    """Updates the state from one price event, returning its symbol and indicators."""
+    event = json.loads(msg.value().decode("utf-8"))
+    symbol = event["symbol"]
+    volume = event.get("volume")
+    # processed_prices stores NUMERIC(20,2), so round to match
+    values = state.update(
+        symbol,
+        msg.partition(),
+        msg.offset(),
+        parse_event_timestamp(event["timestamp"]),
+        round(float(event["price"]), 2),
+        int(event["raw_response_id"]),
+        float(volume) if volume is not None else None,
+    )
+    return symbol, values
+
+
+def apply_events(
+    state: IndicatorState, messages: list
+) -> tuple[dict[str, dict[str, float]], list]:
+    """
+    Applies events in order, retrying each and sending it to the DLQ when it
+    keeps failing. Returns the last indicator values of each symbol and the
+    messages that were applied.
+    """
+    averages: dict[str, dict[str, float]] = {}
+    applied = []
+    for msg in messages:
+        if msg.error():
+            continue
+        for i in range(MAX_RETRIES):
+            try:
+                symbol, values = apply_event(state, msg)
+                averages[symbol] = values
+                applied.append(msg)
+                break
+            except Exception as e:
+                print(e)
+                print("Retry count " + str(i + 1))
+                if i == MAX_RETRIES - 1:
+                    send_to_dlq(msg)
+                else:
+                    RETRIES.inc()
+    return averages, applied
+
+
+def save_batch(averages: dict[str, dict[str, float]], applied: list):
+    """Saves a batch's indicators, or sends its events to the DLQ if that fails."""
+    for i in range(MAX_RETRIES):
+        try:
+            save_indicators(averages)
+            return
+        except Exception as e:
+            print(e)
+            print("Retry count " + str(i + 1))
+            if i == MAX_RETRIES - 1:
+                for msg in applied:
+                    send_to_dlq(msg)
+            else:
+                RETRIES.inc()
+
+
+def process_batch(state: IndicatorState, messages: list) -> int:
+    """
+    Applies a batch of events in order and writes only the last indicator
+    values of each symbol with one upsert. Returns the number of events applied.
+    """
+    averages, applied = apply_events(state, messages)
+    save_batch(averages, applied)
+    return len(applied)
+
+
+def run_batch_consumer(
+    batch_size: int = BATCH_SIZE, max_latency: float = BATCH_MAX_LATENCY
+):
+    state = IndicatorState()
+    consumer = create_consumer(state)
+
+    print(f"Batch consumer is running (batch size {batch_size})...")
+    processed = 0
+    report_started = time.monotonic()
+    try:
+        while _running:
+            messages = consumer.consume(num_messages=batch_size, timeout=max_latency)
+            if messages:
+                with PROCESSING_SECONDS.labels("batch").time():
+                    applied = process_batch(state, messages)
+                    # One offset commit per batch, after its upsert.
+                    consumer.commit(asynchronous=False)
+                processed += applied
+                EVENTS_PROCESSED.inc(applied)
+
+            elapsed = time.monotonic() - report_started
+            if elapsed >= THROUGHPUT_REPORT_SECONDS:
+                print(f"Processed {processed} events ({processed / elapsed:.0f}/s)")
+                report_lag(consumer)
+                processed = 0
+                report_started = time.monotonic()
+    finally:
+        consumer.close()
+
+
+def run_consumer():
+    state = IndicatorState()
+    consumer = create_consumer(state)
 
     print("Consumer is running...")
+    lag_reported = time.monotonic()
     try:
-        while True:
+        while _running:
+            if time.monotonic() - lag_reported >= LAG_REPORT_SECONDS:
+                report_lag(consumer)
+                lag_reported = time.monotonic()
+
             msg = consumer.poll(timeout=1.0)
             if (msg is None) or msg.error():
                 continue
 
+            started = time.perf_counter()
             for i in range(MAX_RETRIES):
                 try:
-                    event = json.loads(msg.value().decode("utf-8"))
-                    symbol = event["symbol"]
+                    symbol, values = apply_event(state, msg)
                     print(f"Consumed event for {symbol}")
 
-                    # get last 5 prices
-                    price_list = get_last5_price_by_symbol(symbol)
-
-                    # calculate ma
-                    ma = calculate_moving_average(price_list)
-
-                    # save ma to symbol_average table
-                    save_symbol_ma(symbol, ma)
+                    # save the indicators and the moving average
+                    save_indicators({symbol: values})
 
                     consumer.commit(asynchronous=False)
+                    EVENTS_PROCESSED.inc()
                     break
 
                 except Exception as e:
@@ -131,20 +478,98 @@ def run_consumer():
                     print("Retry count " + str(i + 1))
 
                     if i == MAX_RETRIES - 1:
-                        print(
-                            f"""Max retries ({MAX_RETRIES}) exceeded.
-                            Sending message to DLQ: {DLQ_TOPIC}"""
-                        )
-                        producer.produce(
-                            topic=DLQ_TOPIC,
-                            value=msg.value(),
-                            key=msg.key(),
-                            headers=msg.headers(),  # Preserve original headers
-                        )
+                        send_to_dlq(msg)
                         consumer.commit(asynchronous=False)
+                    else:
+                        RETRIES.inc()
+            PROCESSING_SECONDS.labels("event").observe(time.perf_counter() - started)
     finally:
         consumer.close()
 
 
+def _stop(signum, frame):
+    global _running
+    _running = False
+
+
+def run_worker(
+    batch: bool, batch_size: int, max_latency: float, metrics_port: int = METRICS_PORT
+):
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    if metrics_port:
+        start_http_server(metrics_port)
+        print(f"Serving metrics on port {metrics_port}")
+    try:
+        if batch:
+            run_batch_consumer(batch_size, max_latency)
+        else:
+            run_consumer()
+    finally:
+        if producer:
+            producer.flush(10)
+
+
+def run_supervisor(workers: int, batch: bool, batch_size: int, max_latency: float):
+    """
+    Runs `workers` consumer processes in the same group. Kafka spreads the
+    topic's partitions across them, and since events are keyed by symbol each
+    symbol stays on one worker, in order. Dead workers are restarted.
+    """
+    # Spawn, not fork: librdkafka threads and DB connections do not survive fork.
+    ctx = multiprocessing.get_context("spawn")
+    processes = {}
+
+    def start(index: int):
+        process = ctx.Process(
+            target=run_worker,
+            args=(
+                batch,
+                batch_size,
+                max_latency,
+                METRICS_PORT + index if METRICS_PORT else 0,
+            ),
+            name=f"ma-worker-{index}",
+        )
+        process.start()
+        processes[index] = process
+        print(f"Started {process.name} (pid {process.pid})")
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    for index in range(workers):
+        start(index)
+
+    try:
+        while _running:
+            time.sleep(1)
+            for index, process in list(processes.items()):
+                if not process.is_alive() and _running:
+                    print(f"{process.name} exited ({process.exitcode}), restarting")
+                    start(index)
+    finally:
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.join(timeout=30)
+
+
 if __name__ == "__main__":
-    run_consumer()
+    parser = argparse.ArgumentParser(description="Moving average / indicator consumer")
+    parser.add_argument(
+        "--batch", action="store_true", help="Consume and upsert in batches"
+    )
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--max-latency", type=float, default=BATCH_MAX_LATENCY)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=WORKERS,
+        help="Number of consumer processes in the group",
+    )
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        run_supervisor(args.workers, args.batch, args.batch_size, args.max_latency)
+    else:
+        run_worker(args.batch, args.batch_size, args.max_latency)
@@ -0,0 +1,251 @@
+import argparse
+import os
+import re
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+
+load_dotenv()
+
+# --- Configuration ---
+PARTITIONED_TABLES = ("raw_responses", "processed_prices")
+RETENTION_DAYS = int(os.getenv("PARTITION_RETENTION_DAYS", "30"))
+PRECREATE_DAYS = int(os.getenv("PARTITION_PRECREATE_DAYS", "7"))
+ARCHIVE_SCHEMA = "archive"
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+if not DATABASE_URL:
+    raise ValueError("DATABASE_URL environment variable not set")
+
+engine = create_engine(DATABASE_URL)
+
+
+def partition_name(table: str, day: date) -> str:
+    return f"{table}_p{day:%Y%m%d}"
+
+
+def list_partitions(conn, table: str) -> dict[date, str]:
+    """Returns the daily partitions of a table, keyed by the day they hold."""
+    rows = conn.execute(
+        text(
+            """
+            SELECT child.relname
+            FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = :table
+        """
+        ),
+        {"table": table},
+    ).scalars()
+
+    pattern = re.compile(rf"^{table}_p(\d{{8}})$")
+    partitions = {}
+    for name in rows:
+        match = pattern.match(name)
+        if match:
+            partitions[datetime.strptime(match.group(1), "%Y%m%d").date()] = name
+    return partitions
+
+
+def default_partition(conn, table: str) -> Optional[str]:
+    """Returns the name of a table's default partition, if it has one."""
+    return conn.execute(
+        text(
+            """
+            SELECT partdefid::regclass::text
+            FROM pg_partitioned_table
+            WHERE partrelid = CAST(:table AS regclass) AND partdefid <> 0
+        """
+        ),
+        {"table": table},
+    ).scalar()
+
+
+def create_partition(conn, table: str, day: date, default: Optional[str]) -> str:
+    """
+    Creates the partition of one day. If rows of that day already landed in
+    the default partition, e.g. after missed runs, PARTITION OF would fail,
+    so the partition is built as a plain table, the rows are moved into it
+    and it is attached.
+    """
+    name = partition_name(table, day)
+    bounds = f"FROM ('{day}') TO ('{day + timedelta(days=1)}')"
+    params = {"start": day, "end": day + timedelta(days=1)}
+    in_range = "timestamp >= :start AND timestamp < :end"
+
+    stranded = False
+    if default is not None:
+        stranded = conn.execute(
+            text(f"SELECT EXISTS (SELECT 1 FROM {default} WHERE {in_range})"), params
+        ).scalar()
+    if not stranded:
+        conn.execute(
+            text(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} "
+                f"FOR VALUES {bounds}"
+            )
+        )
+        return name
+
+    conn.execute(
+        text(
+            f"CREATE TABLE {name} "
+            f"(LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+        )
+    )
+    moved = conn.execute(
+        text(
+            f"""
+            WITH moved AS (DELETE FROM {default} WHERE {in_range} RETURNING *)
+            INSERT INTO {name} SELECT * FROM moved
+        """
+        ),
+        params,
+    ).rowcount
+    conn.execute(
+        text(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES {bounds}")
+    )
+    print(f"{name}: moved {moved} rows out of {default}")
+    return name
+
+
+def create_partitions(conn, table: str, start: date, days: int) -> list[str]:
+    """Creates the daily partitions for `days` days from `start` that are missing."""
+    existing = list_partitions(conn, table)
+    default = default_partition(conn, table)
+    created = []
+    for offset in range(days + 1):
+        day = start + timedelta(days=offset)
+        if day not in existing:
+            created.append(create_partition(conn, table, day, default))
+    return created
+
+
+def expire_partitions(conn, table: str, cutoff: date, archive: bool) -> list[str]:
+    """
+    Removes partitions holding days before `cutoff`. With `archive`, they are
+    detached and moved to the archive schema instead of being dropped.
+    """
+    expired = []
+    for day, name in sorted(list_partitions(conn, table).items()):
+        if day >= cutoff:
+            continue
+        if archive:
+            conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}"))
+            conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+            conn.execute(text(f"ALTER TABLE {name} SET SCHEMA {ARCHIVE_SCHEMA}"))
+        else:
+            conn.execute(text(f"DROP TABLE {name}"))
+        expired.append(name)
+    return expired
+
+
+def expire_default_rows(conn, table: str, cutoff: date, archive: bool) -> int:
+    """
+    Removes rows before `cutoff` from the default partition, which dropping
+    daily partitions never reaches. With `archive`, they are moved to
+    {table}_default in the archive schema instead of being deleted.
+    """
+    default = default_partition(conn, table)
+    if default is None:
+        return 0
+    if not archive:
+        return conn.execute(
+            text(f"DELETE FROM {default} WHERE timestamp < :cutoff"), {"cutoff": cutoff}
+        ).rowcount
+
+    archived = f"{ARCHIVE_SCHEMA}.{table}_default"
+    conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}"))
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS {archived} (LIKE {table})"))
+    return conn.execute(
+        text(
+            f"""
+            WITH moved AS (DELETE FROM {default} WHERE timestamp < :cutoff RETURNING *)
+            INSERT INTO {archived} SELECT * FROM moved
+        """
+        ),
+        {"cutoff": cutoff},
+    ).rowcount
+
+
+def expire_payloads(conn, cutoff: date) -> int:
+    """
+    Deletes raw payload bodies last seen before `cutoff` that no raw response
+    references any more, including archived partitions. Writers reusing a
+    body refresh its last_seen_at under the row lock, so a body cannot be
+    deleted while a new reference to it is being written.
+    """
+    archived = conn.execute(
+        text(
+            """
+            SELECT tablename FROM pg_tables
+            WHERE schemaname = :schema
+            AND (
+                tablename LIKE 'raw_responses_p%'
+                OR tablename = 'raw_responses_default'
+            )
+        """
+        ),
+        {"schema": ARCHIVE_SCHEMA},
+    ).scalars()
+    references = ["raw_responses"] + [f"{ARCHIVE_SCHEMA}.{name}" for name in archived]
+    unreferenced = " AND ".join(
+        f"NOT EXISTS (SELECT 1 FROM {table} r WHERE r.payload_hash = p.hash)"
+        for table in references
+    )
+    return conn.execute(
+        text(
+            f"DELETE FROM raw_payloads p WHERE p.last_seen_at < :cutoff AND {unreferenced}"
+        ),
+        {"cutoff": cutoff},
+    ).rowcount
+
+
+def run_maintenance(
+    today: date = None,
+    retention_days: int = RETENTION_DAYS,
+    precreate_days: int = PRECREATE_DAYS,
+    archive: bool = False,
+):
+    today = today or date.today()
+    cutoff = today - timedelta(days=retention_days)
+
+    for table in PARTITIONED_TABLES:
+        # One transaction per table, so a failure leaves the other untouched.
+        with engine.begin() as conn:
+            created = create_partitions(conn, table, today, precreate_days)
+            expired = expire_partitions(conn, table, cutoff, archive)
+            expired_rows = expire_default_rows(conn, table, cutoff, archive)
+        print(
+            f"{table}: created {created or 'none'}, "
+            f"{'archived' if archive else 'dropped'} {expired or 'none'} "
+            f"and {expired_rows} expired rows of the default partition"
+        )
+
+    with engine.begin() as conn:
+        deleted = expire_payloads(conn, cutoff)
+    print(f"raw_payloads: deleted {deleted} unreferenced payloads")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Create upcoming and expire old daily price partitions"
+    )
+    parser.add_argument("--retention-days", type=int, default=RETENTION_DAYS)
+    parser.add_argument("--precreate-days", type=int, default=PRECREATE_DAYS)
+    parser.add_argument(
+        "--archive",
+        action="store_true",
+        help=f"Move expired partitions to the '{ARCHIVE_SCHEMA}' schema, not drop them",
+    )
+    args = parser.parse_args()
+
+    run_maintenance(
+        retention_days=args.retention_days,
+        precreate_days=args.precreate_days,
+        archive=args.archive,
+    )
@@ -1,23 +1,67 @@
+-- raw_responses and processed_prices are range partitioned by day on
+-- timestamp. partition_maintenance.py creates upcoming partitions and drops
+-- or archives expired ones; the partitions below cover the first week.
 CREATE TABLE IF NOT EXISTS raw_responses (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     symbol VARCHAR NOT NULL,
     provider VARCHAR NOT NULL,
-    data TEXT NOT NULL,
-    timestamp TIMESTAMP WITHOUT TIME ZONE DEFAULT NOW()
-);
+    data TEXT,
+    payload_hash BYTEA,
+    timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id, timestamp),
+    CHECK (data IS NOT NULL OR payload_hash IS NOT NULL)
+) PARTITION BY RANGE (timestamp);
 
 CREATE TABLE IF NOT EXISTS processed_prices (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     symbol VARCHAR NOT NULL,
     price NUMERIC(20,2),
-    timestamp TIMESTAMP WITHOUT TIME ZONE DEFAULT NOW(),
+    timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT NOW(),
     provider VARCHAR NOT NULL,
-    raw_response_id INTEGER
-);
+    raw_response_id INTEGER,
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+-- Rows outside every daily partition land here instead of failing.
+CREATE TABLE IF NOT EXISTS raw_responses_default PARTITION OF raw_responses DEFAULT;
+CREATE TABLE IF NOT EXISTS processed_prices_default PARTITION OF processed_prices DEFAULT;
+
+DO $$
+DECLARE
+    day DATE;
+    parent TEXT;
+BEGIN
+    FOR day IN SELECT generate_series(CURRENT_DATE, CURRENT_DATE + 7, INTERVAL '1 day')::DATE LOOP
+        FOREACH parent IN ARRAY ARRAY['raw_responses', 'processed_prices'] LOOP
+            EXECUTE format(
+                'CREATE TABLE IF NOT EXISTS %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                parent || '_p' || to_char(day, 'YYYYMMDD'), parent, day, day + 1
+            );
+        END LOOP;
+    END LOOP;
+END $$;
+
+CREATE INDEX IF NOT EXISTS idx_raw_responses_symbol
+    ON raw_responses (symbol);
 
 CREATE INDEX IF NOT EXISTS idx_processed_prices_symbol_timestamp
     ON processed_prices (symbol, timestamp DESC);
 
+-- With RAW_PAYLOAD_DEDUP=true, raw_responses stores only the 32-byte SHA-256
+-- of response bodies of at least RAW_PAYLOAD_DEDUP_MIN_BYTES; every distinct
+-- body is kept once here, zlib-compressed. Reuse refreshes last_seen_at, and
+-- partition_maintenance.py deletes bodies not seen since the retention
+-- cutoff that are no longer referenced.
+CREATE TABLE IF NOT EXISTS raw_payloads (
+    hash BYTEA PRIMARY KEY,
+    data BYTEA NOT NULL,
+    created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT NOW(),
+    last_seen_at TIMESTAMP WITHOUT TIME ZONE DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_raw_responses_payload_hash
+    ON raw_responses (payload_hash) WHERE payload_hash IS NOT NULL;
+
 CREATE TABLE IF NOT EXISTS symbol_averages (
     id SERIAL PRIMARY KEY,
     symbol VARCHAR UNIQUE NOT NULL,
@@ -25,10 +69,20 @@ CREATE TABLE IF NOT EXISTS symbol_averages (
     updated_at TIMESTAMP WITHOUT TIME ZONE DEFAULT NOW()
 );
 
+-- One row per symbol and configured indicator (MA_INDICATORS), e.g. sma_5,
+-- ema_12, twa_300s or vwap_3600s. symbol_averages keeps the first one.
+CREATE TABLE IF NOT EXISTS symbol_indicators (
+    symbol VARCHAR NOT NULL,
+    indicator VARCHAR NOT NULL,
+    value NUMERIC(20,6),
+    updated_at TIMESTAMP WITHOUT TIME ZONE DEFAULT NOW(),
+    PRIMARY KEY (symbol, indicator)
+);
+
 CREATE TABLE IF NOT EXISTS polling_job_configs (
     id SERIAL PRIMARY KEY,
     symbols TEXT NOT NULL,
     interval INTEGER NOT NULL,
     provider VARCHAR NOT NULL,
     timestamp TIMESTAMP WITHOUT TIME ZONE DEFAULT NOW()
-);
\ No newline at end of file
+);
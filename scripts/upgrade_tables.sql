@@ -0,0 +1,110 @@
+-- Brings a database created by an earlier version of create_tables.sql up to
+-- date; create_tables.sql itself only runs on a fresh database volume. Run it
+-- with the API and consumers stopped:
+--
+--   psql "$DATABASE_URL" -v ON_ERROR_STOP=1 -f scripts/upgrade_tables.sql
+--
+-- It runs in one transaction and can be run again safely.
+BEGIN;
+
+-- Unpartitioned raw_responses and processed_prices are renamed to
+-- *_unpartitioned, with their id sequence, primary key and indexes, so the
+-- partitioned tables can be created under the original names.
+DO $$
+DECLARE
+    parent TEXT;
+    index_name TEXT;
+BEGIN
+    FOREACH parent IN ARRAY ARRAY['raw_responses', 'processed_prices'] LOOP
+        IF EXISTS (
+            SELECT FROM pg_class
+            WHERE oid = to_regclass(parent) AND relkind = 'r'
+        ) THEN
+            EXECUTE format('ALTER TABLE %I RENAME TO %I', parent, parent || '_unpartitioned');
+            EXECUTE format(
+                'ALTER SEQUENCE IF EXISTS %I RENAME TO %I',
+                parent || '_id_seq', parent || '_unpartitioned_id_seq'
+            );
+            FOR index_name IN
+                SELECT indexrelid::regclass::TEXT FROM pg_index
+                WHERE indrelid = to_regclass(parent || '_unpartitioned')
+            LOOP
+                EXECUTE format(
+                    'ALTER INDEX %I RENAME TO %I',
+                    index_name, replace(index_name, parent, parent || '_unpartitioned')
+                );
+            END LOOP;
+        END IF;
+    END LOOP;
+END $$;
+
+-- raw_responses created before payload deduplication has no payload_hash,
+-- and its data column is NOT NULL. Every insert writes payload_hash, even
+-- with RAW_PAYLOAD_DEDUP off, so both change before create_tables.sql
+-- indexes the column. The check is named as create_tables.sql's would be.
+ALTER TABLE IF EXISTS raw_responses ADD COLUMN IF NOT EXISTS payload_hash BYTEA;
+ALTER TABLE IF EXISTS raw_responses ALTER COLUMN data DROP NOT NULL;
+DO $$
+BEGIN
+    IF to_regclass('raw_responses') IS NOT NULL AND NOT EXISTS (
+        SELECT FROM pg_constraint
+        WHERE conrelid = 'raw_responses'::regclass AND conname = 'raw_responses_check'
+    ) THEN
+        ALTER TABLE raw_responses
+            ADD CONSTRAINT raw_responses_check CHECK (data IS NOT NULL OR payload_hash IS NOT NULL);
+    END IF;
+END $$;
+ALTER TABLE IF EXISTS raw_payloads
+    ADD COLUMN IF NOT EXISTS last_seen_at TIMESTAMP WITHOUT TIME ZONE DEFAULT NOW();
+
+\ir create_tables.sql
+
+-- Copies the rows of the renamed tables, with their ids, into daily
+-- partitions, and moves the id sequences past them. The *_unpartitioned
+-- tables are kept; drop them once the copy has been checked.
+DO $$
+DECLARE
+    parent TEXT;
+    day DATE;
+    first_day DATE;
+BEGIN
+    FOREACH parent IN ARRAY ARRAY['raw_responses', 'processed_prices'] LOOP
+        IF to_regclass(parent || '_unpartitioned') IS NULL THEN
+            CONTINUE;
+        END IF;
+        EXECUTE format('SELECT min(timestamp)::DATE FROM %I', parent || '_unpartitioned')
+            INTO first_day;
+        FOR day IN SELECT generate_series(first_day, CURRENT_DATE, INTERVAL '1 day')::DATE LOOP
+            EXECUTE format(
+                'CREATE TABLE IF NOT EXISTS %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                parent || '_p' || to_char(day, 'YYYYMMDD'), parent, day, day + 1
+            );
+        END LOOP;
+    END LOOP;
+
+    IF to_regclass('raw_responses_unpartitioned') IS NOT NULL THEN
+        INSERT INTO raw_responses (id, symbol, provider, data, timestamp)
+        SELECT id, symbol, provider, data, COALESCE(timestamp, NOW())
+        FROM raw_responses_unpartitioned
+        ON CONFLICT DO NOTHING;
+        PERFORM setval(
+            'raw_responses_id_seq',
+            (SELECT COALESCE(max(id), 0) + 1 FROM raw_responses),
+            false
+        );
+    END IF;
+
+    IF to_regclass('processed_prices_unpartitioned') IS NOT NULL THEN
+        INSERT INTO processed_prices (id, symbol, price, timestamp, provider, raw_response_id)
+        SELECT id, symbol, price, COALESCE(timestamp, NOW()), provider, raw_response_id
+        FROM processed_prices_unpartitioned
+        ON CONFLICT DO NOTHING;
+        PERFORM setval(
+            'processed_prices_id_seq',
+            (SELECT COALESCE(max(id), 0) + 1 FROM processed_prices),
+            false
+        );
+    END IF;
+END $$;
+
+COMMIT;
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from app.services.history import BucketAggregator
+
+
+def expected_buckets(timestamps, prices, interval: int) -> list[list[float]]:
+    """OHLC/mean/count rows computed one price at a time."""
+    buckets = {}
+    for timestamp, price in zip(timestamps, prices):
+        buckets.setdefault(timestamp // interval * interval, []).append(price)
+    return [
+        [start, p[0], max(p), min(p), p[-1], sum(p) / len(p), len(p)]
+        for start, p in sorted(buckets.items())
+    ]
+
+
+def aggregate(chunks, interval: int) -> np.ndarray:
+    aggregator = BucketAggregator(interval)
+    rows = [aggregator.add(timestamps, prices) for timestamps, prices in chunks]
+    rows.append(aggregator.finish())
+    return np.vstack(rows)
+
+
+@pytest.fixture
+def history():
+    rng = np.random.default_rng(7)
+    timestamps = np.cumsum(rng.uniform(1, 40, 1000)) + 1_700_000_000
+    prices = np.round(100 + np.cumsum(rng.normal(0, 0.5, 1000)), 2)
+    return timestamps, prices
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 100, 1000])
+def test_chunks_give_the_same_buckets_as_one_pass(history, chunk_size):
+    timestamps, prices = history
+    bounds = range(chunk_size, len(prices), chunk_size)
+    chunks = zip(np.split(timestamps, bounds), np.split(prices, bounds))
+    np.testing.assert_allclose(
+        aggregate(chunks, 300), expected_buckets(timestamps, prices, 300)
+    )
+
+
+def test_empty_history_has_no_buckets():
+    aggregator = BucketAggregator(60)
+    assert aggregator.add(np.empty(0), np.empty(0)).shape == (0, 7)
+    assert aggregator.finish().shape == (0, 7)
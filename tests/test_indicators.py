@@ -0,0 +1,90 @@
+import math
+
+import numpy as np
+import pytest
+
+from app.services.indicators import (
+    ChunkedIndicators,
+    IndicatorSet,
+    IndicatorSpec,
+    VolumeWeightedAveragePrice,
+    compute_indicators,
+    parse_indicators,
+    seed_requirements,
+)
+
+SPECS = parse_indicators("sma:5,ema:12,twa:30,vwap:60")
+
+
+@pytest.fixture
+def history():
+    rng = np.random.default_rng(3)
+    timestamps = np.cumsum(rng.uniform(0.5, 3, 2000))
+    prices = 100 + np.cumsum(rng.normal(0, 1, 2000))
+    volumes = rng.uniform(0, 10, 2000)
+    volumes[::7] = np.nan
+    return timestamps, prices, volumes
+
+
+def incremental(timestamps, prices, volumes) -> dict[str, list[float]]:
+    indicators = IndicatorSet(SPECS)
+    results = {spec.name: [] for spec in SPECS}
+    for timestamp, price, volume in zip(timestamps, prices, volumes):
+        values = indicators.update(timestamp, price, float(volume))
+        for name, series in results.items():
+            series.append(values.get(name, math.nan))
+    return results
+
+
+def test_parse_indicators():
+    assert SPECS == (
+        IndicatorSpec("sma", 5),
+        IndicatorSpec("ema", 12),
+        IndicatorSpec("twa", 30),
+        IndicatorSpec("vwap", 60),
+    )
+    assert [spec.name for spec in SPECS] == ["sma_5", "ema_12", "twa_30s", "vwap_60s"]
+    assert parse_indicators("sma:5, sma:5") == (IndicatorSpec("sma", 5),)
+    for config in ("", "sma", "sma:0", "wma:5"):
+        with pytest.raises(ValueError):
+            parse_indicators(config)
+
+
+def test_seed_requirements():
+    assert seed_requirements(SPECS) == (60, 60)
+
+
+def test_simple_moving_average():
+    indicators = IndicatorSet(parse_indicators("sma:3"))
+    values = [indicators.update(t, p)["sma_3"] for t, p in enumerate([1, 2, 3, 4])]
+    assert values == pytest.approx([1, 1.5, 2, 3])
+
+
+def test_vwap_skips_missing_volumes():
+    vwap = VolumeWeightedAveragePrice(60)
+    assert vwap.update(0, 10.0, None) is None
+    assert vwap.update(1, 10.0, 2.0) == pytest.approx(10)
+    assert vwap.update(2, 40.0, math.nan) == pytest.approx(10)
+    assert vwap.update(3, 40.0, 0.0) == pytest.approx(10)
+    assert vwap.update(4, 20.0, 2.0) == pytest.approx(15)
+
+
+def test_vectorized_matches_incremental(history):
+    expected = incremental(*history)
+    for name, values in compute_indicators(SPECS, *history).items():
+        np.testing.assert_allclose(values, expected[name], equal_nan=True)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 13, 500])
+def test_chunks_match_one_pass(history, chunk_size):
+    expected = compute_indicators(SPECS, *history)
+    chunked = ChunkedIndicators(SPECS)
+    bounds = range(chunk_size, len(history[0]), chunk_size)
+    results = {name: [] for name in expected}
+    for chunk in zip(*(np.split(array, bounds) for array in history)):
+        for name, values in chunked.add(*chunk).items():
+            results[name].append(values)
+    for name, values in expected.items():
+        np.testing.assert_allclose(
+            np.concatenate(results[name]), values, equal_nan=True
+        )
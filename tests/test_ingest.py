@@ -0,0 +1,135 @@
+import asyncio
+import itertools
+
+import pytest
+
+from app.services import ingest
+from app.services.crud import PriceRecord
+from app.services.ingest import IngestPipeline
+
+
+class RecordingProducer:
+    def __init__(self):
+        self.produced = []
+
+    def produce(self, topic, key=None, value=None, **kwargs):
+        self.produced.append(key)
+
+    def poll(self, timeout=None) -> int:
+        return 0
+
+
+class FlakyStore:
+    """Stands in for write_price_records, failing the first `failures` calls."""
+
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.batches: list[list[str]] = []
+        self._ids = itertools.count(1)
+
+    def write(self, records: list[PriceRecord]) -> list[int]:
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("database unavailable")
+        self.batches.append([record.symbol for record in records])
+        return [next(self._ids) for _ in records]
+
+
+@pytest.fixture
+def producer(monkeypatch, tmp_path):
+    producer = RecordingProducer()
+    monkeypatch.setattr(ingest, "get_kafka_producer", lambda: producer)
+    monkeypatch.setattr(ingest, "INGEST_SPILL_DIR", str(tmp_path))
+    monkeypatch.setattr(ingest, "INGEST_INSTANCE_ID", "test")
+    monkeypatch.setattr(ingest, "INGEST_RESTART_SECONDS", 0)
+    # Retries back off for seconds; only their order matters here.
+    sleep = asyncio.sleep
+    monkeypatch.setattr(ingest.asyncio, "sleep", lambda delay: sleep(0))
+    return producer
+
+
+def use_store(monkeypatch, store: FlakyStore):
+    monkeypatch.setattr(ingest, "write_price_records", store.write)
+
+
+def prices(*symbols: str) -> dict[str, dict]:
+    return {symbol: {"price": 1.005, "symbol": symbol} for symbol in symbols}
+
+
+@pytest.mark.asyncio
+async def test_writes_in_batches_and_publishes_after_commit(monkeypatch, producer):
+    store = FlakyStore()
+    use_store(monkeypatch, store)
+    pipeline = IngestPipeline(batch_size=2, flush_interval=60)
+    pipeline.start()
+
+    await pipeline.submit("mock", prices("A", "B", "C"))
+    await pipeline.stop()
+    assert store.batches == [["A", "B"], ["C"]]
+    assert producer.produced == ["A", "B", "C"]
+    assert pipeline.written == 3
+
+
+@pytest.mark.asyncio
+async def test_retries_then_spills_and_next_start_writes(monkeypatch, producer):
+    use_store(monkeypatch, FlakyStore(failures=ingest.INGEST_MAX_RETRIES))
+    pipeline = IngestPipeline(batch_size=10, flush_interval=0.01)
+    pipeline.start()
+    await pipeline.submit("mock", prices("A", "B"))
+    await pipeline.stop()
+    assert (pipeline.spilled, pipeline.written) == (2, 0)
+    assert producer.produced == []
+
+    store = FlakyStore()
+    use_store(monkeypatch, store)
+    pipeline = IngestPipeline(batch_size=10, flush_interval=0.01)
+    pipeline.start()
+    await pipeline.stop()
+    assert store.batches == [["A", "B"]]
+    assert producer.produced == ["A", "B"]
+
+
+@pytest.mark.asyncio
+async def test_leaves_spill_files_of_running_processes(monkeypatch, producer, tmp_path):
+    spill = ingest.open_spill_file(str(tmp_path), "test")
+    ingest.spill_price_records(spill, [PriceRecord("A", "mock", 1.0, "{}")])
+    assert ingest.take_spilled_records(str(tmp_path), "test") == []
+    assert ingest.take_spilled_records(str(tmp_path), "other") == []
+
+    spill.close()
+    records = ingest.take_spilled_records(str(tmp_path), "test")
+    assert [record.symbol for record in records] == ["A"]
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.asyncio
+async def test_restarts_a_failed_flusher(monkeypatch, producer):
+    store = FlakyStore()
+    use_store(monkeypatch, store)
+    pipeline = IngestPipeline(batch_size=1, flush_interval=60)
+    failures = iter([RuntimeError("flusher bug")])
+    flush = pipeline._flush
+
+    async def flaky_flush(batch):
+        error = next(failures, None)
+        if error:
+            raise error
+        await flush(batch)
+
+    monkeypatch.setattr(pipeline, "_flush", flaky_flush)
+    pipeline.start()
+    await pipeline.submit("mock", prices("A", "B"))
+    await asyncio.wait_for(pipeline.stop(), 1)
+    # The batch in flight when the flusher failed is lost, later ones are not.
+    assert store.batches == [["B"]]
+
+
+@pytest.mark.asyncio
+async def test_submit_fails_once_stopped(producer):
+    pipeline = IngestPipeline()
+    with pytest.raises(RuntimeError):
+        await pipeline.submit("mock", prices("A"))
+    pipeline.start()
+    await pipeline.stop()
+    with pytest.raises(RuntimeError):
+        await pipeline.submit("mock", prices("A"))
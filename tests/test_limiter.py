@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+from fakeredis import aioredis
+
+from app.core import limiter as limiter_module
+from app.core.limiter import Limiter, RateLimit, RateLimitExceeded
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    redis = aioredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(limiter_module, "get_redis_pool", lambda: redis)
+    return redis
+
+
+async def tat_intervals(redis, key: str, rate_limit: RateLimit) -> float:
+    """How many intervals the key's TAT lies ahead of Redis' clock."""
+    seconds, microseconds = await redis.time()
+    tat = float(await redis.get(key) or 0)
+    return (tat - seconds - microseconds / 1e6) / rate_limit.interval
+
+
+def test_parse_rate_limits():
+    assert RateLimit.parse("5/minute") == RateLimit(5, 60)
+    assert RateLimit.parse("100 per second") == RateLimit(100, 1)
+    assert RateLimit.parse("10/5minutes") == RateLimit(10, 300)
+    with pytest.raises(ValueError):
+        RateLimit.parse("0/minute")
+    with pytest.raises(ValueError):
+        RateLimit.parse("5 a minute")
+
+
+@pytest.mark.asyncio
+async def test_rejects_requests_over_the_limit(redis):
+    limiter = Limiter()
+    rate_limit = RateLimit.parse("5/minute")
+    for _ in range(5):
+        await limiter.check("test", "client", rate_limit)
+
+    with pytest.raises(RateLimitExceeded) as excinfo:
+        await limiter.check("test", "client", rate_limit)
+    assert excinfo.value.retry_after == pytest.approx(12, abs=0.5)
+
+    # Other clients have their own budget.
+    await limiter.check("test", "other", rate_limit)
+
+
+@pytest.mark.asyncio
+async def test_small_limits_never_lease(redis):
+    limiter = Limiter()
+    rate_limit = RateLimit.parse("10/minute")
+    await limiter.check("test", "client", rate_limit)
+    assert await tat_intervals(redis, "ratelimit:test:client", rate_limit) < 1.01
+
+
+@pytest.mark.asyncio
+async def test_leases_tokens_well_under_the_limit(redis):
+    limiter = Limiter()
+    rate_limit = RateLimit.parse("1000/minute")
+    key = "ratelimit:test:client"
+
+    await limiter.check("test", "client", rate_limit)
+    leased = await tat_intervals(redis, key, rate_limit)
+    assert leased == pytest.approx(rate_limit.lease, abs=0.1)
+
+    # The rest of the lease is spent without Redis.
+    for _ in range(rate_limit.lease - 1):
+        await limiter.check("test", "client", rate_limit)
+    assert await tat_intervals(redis, key, rate_limit) <= leased
+
+
+@pytest.mark.asyncio
+async def test_returns_unspent_lease_tokens(redis):
+    limiter = Limiter()
+    rate_limit = RateLimit.parse("1000/minute")
+    key = "ratelimit:test:client"
+    await limiter.check("test", "client", rate_limit)
+    await limiter.check("test", "client", rate_limit)
+
+    budget, _, _ = limiter._leases[0]
+    budget.expires_at = 0
+    await limiter.check("test", "other", rate_limit)
+    await asyncio.gather(*limiter._refunds)
+
+    # Two tokens were used; the other leased ones are free again.
+    assert await tat_intervals(redis, key, rate_limit) == pytest.approx(2, abs=0.1)
+
+
+@pytest.mark.asyncio
+async def test_fails_open_without_redis(monkeypatch):
+    def unavailable():
+        raise ConnectionError("Redis is down")
+
+    monkeypatch.setattr(limiter_module, "get_redis_pool", unavailable)
+    limiter = Limiter()
+    for _ in range(10):
+        await limiter.check("test", "client", RateLimit.parse("1/minute"))
@@ -0,0 +1,51 @@
+import pytest
+import structlog
+
+from app.core import logging_config
+from app.core.logging_config import EventSampler, parse_event_settings
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = {"now": 100.0}
+    monkeypatch.setattr(logging_config.time, "monotonic", lambda: clock["now"])
+    return clock
+
+
+def sample(sampler: EventSampler, event: str) -> dict:
+    return sampler(None, "info", {"event": event})
+
+
+def test_parse_event_settings():
+    assert parse_event_settings("CACHE HIT: x=0.5; other = 10;;bad") == {
+        "CACHE HIT: x": 0.5,
+        "other": 10.0,
+    }
+
+
+def test_sampling_keeps_the_given_share(monkeypatch):
+    sampler = EventSampler({"sampled": 0.25}, {})
+    draws = iter([0.1, 0.3, 0.2, 0.9])
+    monkeypatch.setattr(logging_config.random, "random", lambda: next(draws))
+
+    kept = []
+    for _ in range(4):
+        try:
+            kept.append(sample(sampler, "sampled"))
+        except structlog.DropEvent:
+            pass
+    assert kept == [{"event": "sampled", "sample_rate": 0.25}] * 2
+    assert sample(sampler, "other") == {"event": "other"}
+
+
+def test_rate_cap_reports_suppressed_events(clock):
+    sampler = EventSampler({}, {"capped": 2})
+    assert sample(sampler, "capped") == {"event": "capped"}
+    assert sample(sampler, "capped") == {"event": "capped"}
+    for _ in range(3):
+        with pytest.raises(structlog.DropEvent):
+            sample(sampler, "capped")
+
+    clock["now"] += 1
+    assert sample(sampler, "capped") == {"event": "capped", "suppressed": 3}
+    assert sample(sampler, "capped") == {"event": "capped"}
@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import ma_consumer
+from app.services.indicators import parse_indicators
+from ma_consumer import IndicatorState
+
+STARTED_AT = datetime(2025, 1, 1, 12)
+
+
+@pytest.fixture
+def seed_calls(monkeypatch):
+    """Records seeding queries and answers them with two stored prices."""
+    calls = []
+
+    def get_prices_before(symbol, timestamp, raw_response_id, limit, since=None):
+        calls.append((symbol, timestamp, raw_response_id, limit, since))
+        return [
+            (timestamp - timedelta(seconds=2), 10.0),
+            (timestamp - timedelta(seconds=1), 20.0),
+        ]
+
+    monkeypatch.setattr(ma_consumer, "get_prices_before", get_prices_before)
+    return calls
+
+
+def at(seconds: float) -> datetime:
+    return STARTED_AT + timedelta(seconds=seconds)
+
+
+def test_seeds_each_symbol_once_before_its_first_event(seed_calls):
+    state = IndicatorState(parse_indicators("sma:3,twa:60"))
+
+    values = state.update("AAPL", 0, 0, at(0), 30.0, 101)
+    assert values["sma_3"] == pytest.approx(20)
+    assert seed_calls == [("AAPL", at(0), 101, 2, at(-60))]
+
+    values = state.update("AAPL", 0, 1, at(1), 60.0, 102)
+    assert values["sma_3"] == pytest.approx(110 / 3)
+    assert len(seed_calls) == 1
+
+
+def test_redelivered_offsets_are_not_counted_twice(seed_calls):
+    state = IndicatorState(parse_indicators("sma:3"))
+    state.update("AAPL", 0, 5, at(0), 30.0, 101)
+
+    # A retry of the same event, then an older redelivery.
+    assert state.update("AAPL", 0, 5, at(0), 30.0, 101)["sma_3"] == pytest.approx(20)
+    assert state.update("AAPL", 0, 4, at(0), 90.0, 100)["sma_3"] == pytest.approx(20)
+    # Offsets are tracked per partition.
+    assert state.update("MSFT", 1, 0, at(0), 30.0, 103)["sma_3"] == pytest.approx(20)
+
+
+def test_reassigned_partitions_are_seeded_again(seed_calls):
+    state = IndicatorState(parse_indicators("sma:3"))
+    state.update("AAPL", 0, 5, at(0), 30.0, 101)
+
+    state.drop_partitions({0})
+    state.update("AAPL", 0, 5, at(0), 30.0, 101)
+    assert len(seed_calls) == 2
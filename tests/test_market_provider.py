@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from app.services import market_provider
+from app.services.market_provider import (
+    MicroBatchingProvider,
+    MockProvider,
+    ProviderUnavailableError,
+)
+
+
+class RecordingProvider(MockProvider):
+    """The mock provider, recording the symbols of every bulk call."""
+
+    def __init__(self, fail: bool = False):
+        super().__init__(seed=1)
+        self.calls: list[list[str]] = []
+        self.fail = fail
+
+    async def get_latest_prices(self, symbols: list[str]) -> dict[str, dict]:
+        self.calls.append(sorted(symbols))
+        if self.fail:
+            raise ConnectionError("upstream failed")
+        return await super().get_latest_prices(symbols)
+
+
+@pytest.mark.asyncio
+async def test_merges_calls_within_the_window():
+    upstream = RecordingProvider()
+    provider = MicroBatchingProvider(upstream, window=0.01, max_symbols=100)
+
+    results = await asyncio.gather(
+        *(provider.get_latest_price(symbol) for symbol in ["A", "B", "A", "C"])
+    )
+    assert upstream.calls == [["A", "B", "C"]]
+    assert [result["symbol"] for result in results] == ["A", "B", "A", "C"]
+    # Callers asking for the same symbol share its result.
+    assert results[0] is results[2]
+
+
+@pytest.mark.asyncio
+async def test_sends_full_batches_early():
+    upstream = RecordingProvider()
+    provider = MicroBatchingProvider(upstream, window=60, max_symbols=2)
+
+    results = await asyncio.wait_for(
+        asyncio.gather(*(provider.get_latest_price(s) for s in ["A", "B"])), 1
+    )
+    assert upstream.calls == [["A", "B"]]
+    assert all(results)
+
+
+@pytest.mark.asyncio
+async def test_failures_reach_every_caller():
+    provider = MicroBatchingProvider(
+        RecordingProvider(fail=True), window=0.01, max_symbols=100
+    )
+    results = await asyncio.gather(
+        provider.get_latest_price("A"),
+        provider.get_latest_price("B"),
+        return_exceptions=True,
+    )
+    assert all(isinstance(result, ConnectionError) for result in results)
+
+
+@pytest.mark.asyncio
+async def test_bulk_failures_leave_the_interactive_circuit_closed(monkeypatch):
+    monkeypatch.setattr(market_provider, "PROVIDER_RETRY_BASE_SECONDS", 0)
+    upstream = RecordingProvider(fail=True)
+    market_provider.register_provider("recording", lambda: upstream)
+
+    bulk = market_provider.get_bulk_provider("recording")
+    interactive = market_provider.get_provider("recording")
+    assert bulk.provider is interactive.provider is upstream
+
+    for _ in range(market_provider.PROVIDER_CIRCUIT_FAILURE_THRESHOLD):
+        with pytest.raises(ProviderUnavailableError):
+            await bulk.get_latest_prices(["A"])
+    assert bulk.breaker.state == bulk.breaker.OPEN
+    assert interactive.breaker.state == interactive.breaker.CLOSED
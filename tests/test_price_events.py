@@ -0,0 +1,20 @@
+from datetime import datetime
+from decimal import Decimal
+
+from app.services.crud import PriceRecord
+from app.services.price_events import build_price_event, parse_event_timestamp
+
+
+def test_event_timestamp_keeps_microseconds():
+    stored_at = datetime(2025, 3, 4, 5, 6, 7, 891011)
+    record = PriceRecord("AAPL", "mock", Decimal("123.45"), "{}", stored_at)
+
+    event = build_price_event(record, "mock", 7)
+    assert event["timestamp"] == "2025-03-04T05:06:07.891011Z"
+    assert parse_event_timestamp(event["timestamp"]) == stored_at
+
+
+def test_parses_whole_second_timestamps():
+    assert parse_event_timestamp("2025-03-04T05:06:07Z") == datetime(
+        2025, 3, 4, 5, 6, 7
+    )
@@ -0,0 +1,95 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from fakeredis import aioredis
+
+from app.api import prices
+from app.schemas.price import PriceLatest
+from app.services import market_provider, price_service
+from app.services.price_service import (
+    CACHE_HARD_TTL_SECONDS,
+    CACHE_SOFT_TTL_SECONDS,
+    price_cache_key,
+)
+
+KEY = price_cache_key("AAPL", "mock")
+PRICE = PriceLatest(
+    symbol="AAPL", price=123.45, timestamp=datetime(2025, 1, 1), provider="mock"
+)
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    price_service.local_price_cache.clear()
+    monkeypatch.setattr(prices.limiter, "enabled", False)
+    market_provider.register_provider("mock", market_provider.MockProvider)
+    yield aioredis.FakeRedis(decode_responses=True)
+    price_service.local_price_cache.clear()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = {"now": 1_000_000.0}
+    monkeypatch.setattr(price_service.time, "time", lambda: clock["now"])
+    return clock
+
+
+@pytest.fixture
+def refreshes(monkeypatch):
+    """Replaces the provider refresh with one that waits until released."""
+    calls = []
+    release = asyncio.Event()
+
+    async def refresh_latest_price(symbol, provider_name, provider_service, redis):
+        calls.append(symbol)
+        await release.wait()
+        return PRICE
+
+    monkeypatch.setattr(price_service, "REDIS_LOCK_ENABLED", False)
+    monkeypatch.setattr(price_service, "refresh_latest_price", refresh_latest_price)
+    return calls, release
+
+
+async def request_price(redis) -> dict:
+    return await prices.get_latest_price(
+        request=None, symbol="AAPL", provider_name="mock", redis=redis
+    )
+
+
+@pytest.mark.asyncio
+async def test_cached_entries_go_stale_after_the_soft_ttl(redis, clock):
+    await price_service.cache_prices(redis, {KEY: PRICE})
+    entry = await price_service.get_cached_price(redis, KEY)
+    assert entry["price"]["price"] == 123.45
+    assert not price_service.is_stale(entry)
+    assert await redis.ttl(KEY) == CACHE_HARD_TTL_SECONDS
+
+    clock["now"] += CACHE_SOFT_TTL_SECONDS
+    assert price_service.is_stale(entry)
+
+
+@pytest.mark.asyncio
+async def test_fresh_entries_are_served_without_a_refresh(redis, clock, refreshes):
+    calls, _ = refreshes
+    await price_service.cache_prices(redis, {KEY: PRICE})
+
+    assert (await request_price(redis))["price"] == 123.45
+    await asyncio.sleep(0)
+    assert calls == []
+
+
+@pytest.mark.asyncio
+async def test_stale_entries_are_served_while_one_refresh_runs(redis, clock, refreshes):
+    calls, release = refreshes
+    await price_service.cache_prices(redis, {KEY: PRICE})
+    clock["now"] += CACHE_SOFT_TTL_SECONDS + 1
+
+    for _ in range(5):
+        assert (await request_price(redis))["price"] == 123.45
+        await asyncio.sleep(0)
+    assert calls == ["AAPL"]
+
+    release.set()
+    await asyncio.gather(*price_service._background_tasks)
+    assert not price_service._single_flight.in_flight(KEY)
@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+
+from app.api import prices
+from app.services.price_stream import (
+    CONFLATE,
+    DROP_OLDEST,
+    PriceStreamHub,
+    Subscription,
+)
+
+
+async def drain(subscription: Subscription) -> list[str]:
+    payloads = []
+    while (payload := await subscription.get(timeout=0)) is not None:
+        payloads.append(payload)
+    return payloads
+
+
+@pytest.mark.asyncio
+async def test_conflate_keeps_the_latest_update_per_symbol():
+    subscription = Subscription(frozenset({"A", "B", "C"}), CONFLATE, max_size=2)
+    for symbol, payload in [("A", "a1"), ("B", "b1"), ("A", "a2"), ("C", "c1")]:
+        subscription.push(symbol, payload)
+
+    # B was pending longest when C arrived at the bound.
+    assert await drain(subscription) == ["a2", "c1"]
+    assert subscription.dropped == 1
+
+
+@pytest.mark.asyncio
+async def test_drop_oldest_queues_every_update():
+    subscription = Subscription(frozenset({"A"}), DROP_OLDEST, max_size=2)
+    for payload in ["a1", "a2", "a3"]:
+        subscription.push("A", payload)
+
+    assert await drain(subscription) == ["a2", "a3"]
+    assert subscription.dropped == 1
+
+
+@pytest.mark.asyncio
+async def test_get_waits_for_the_next_update():
+    subscription = Subscription(frozenset({"A"}))
+    assert await subscription.get(timeout=0.01) is None
+
+    waiter = asyncio.create_task(subscription.get(timeout=1))
+    await asyncio.sleep(0)
+    subscription.push("A", "a1")
+    assert await waiter == "a1"
+
+
+@pytest.mark.asyncio
+async def test_hub_routes_events_by_symbol():
+    hub = PriceStreamHub()
+    first = hub.subscribe(["A", "B"])
+    second = hub.subscribe(["B"])
+
+    hub._dispatch([("A", "a1"), ("B", "b1"), ("C", "c1")])
+    assert await drain(first) == ["a1", "b1"]
+    assert await drain(second) == ["b1"]
+
+    hub.unsubscribe(first)
+    hub._dispatch([("A", "a2"), ("B", "b2")])
+    assert await drain(first) == []
+    assert await drain(second) == ["b2"]
+
+
+async def collect(iterator) -> list:
+    return [chunk async for chunk in iterator]
+
+
+class DisconnectingRequest:
+    """Reports a disconnect after `checks` connected checks."""
+
+    def __init__(self, checks: int):
+        self.checks = checks
+
+    async def is_disconnected(self) -> bool:
+        self.checks -= 1
+        return self.checks < 0
+
+
+@pytest.mark.asyncio
+async def test_sse_notices_a_disconnect_without_writing(monkeypatch):
+    hub = PriceStreamHub()
+    monkeypatch.setattr(prices, "get_price_stream_hub", lambda: hub)
+    monkeypatch.setattr(prices, "STREAM_DISCONNECT_CHECK_SECONDS", 0.01)
+    monkeypatch.setattr(prices.limiter, "enabled", False)
+
+    response = await prices.stream_prices_sse(
+        request=DisconnectingRequest(checks=3), symbols=["A"], mode=CONFLATE
+    )
+    # Ends long before the first heartbeat would be written.
+    chunks = await asyncio.wait_for(collect(response.body_iterator), 1)
+    assert chunks == []
+    assert hub._subscribers == {}
@@ -0,0 +1,58 @@
+import pytest
+
+from app.services import scheduler
+from app.services.market_provider import MockProvider, ProviderUnavailableError
+from app.services.scheduler import (
+    PollingJob,
+    PollingScheduler,
+    group_symbols_by_provider,
+)
+
+
+class ChunkRecordingProvider(MockProvider):
+    """The mock provider, failing calls that include `fail_symbol`."""
+
+    def __init__(self, fail_symbol: str = ""):
+        super().__init__(seed=1)
+        self.calls: list[list[str]] = []
+        self.fail_symbol = fail_symbol
+
+    async def get_latest_prices(self, symbols: list[str]) -> dict[str, dict]:
+        self.calls.append(symbols)
+        if self.fail_symbol in symbols:
+            raise ProviderUnavailableError("mock")
+        return await super().get_latest_prices(symbols)
+
+
+def test_group_symbols_by_provider():
+    jobs = [
+        PollingJob(1, ("A", "B"), 10, "mock"),
+        PollingJob(2, ("B", "C"), 10, "mock"),
+        PollingJob(3, ("A",), 10, "other"),
+    ]
+    assert group_symbols_by_provider(jobs) == {
+        "mock": ["A", "B", "C"],
+        "other": ["A"],
+    }
+
+
+@pytest.mark.asyncio
+async def test_fetches_in_chunks(monkeypatch):
+    monkeypatch.setattr(scheduler, "POLLING_CHUNK_MAX_SYMBOLS", 2)
+    provider = ChunkRecordingProvider()
+    symbols = ["A", "B", "C", "D", "E"]
+
+    prices = await PollingScheduler()._fetch_chunks("mock", provider, symbols)
+    assert sorted(provider.calls) == [["A", "B"], ["C", "D"], ["E"]]
+    assert sorted(prices) == symbols
+
+
+@pytest.mark.asyncio
+async def test_skips_unavailable_chunks(monkeypatch):
+    monkeypatch.setattr(scheduler, "POLLING_CHUNK_MAX_SYMBOLS", 2)
+    provider = ChunkRecordingProvider(fail_symbol="C")
+
+    prices = await PollingScheduler()._fetch_chunks(
+        "mock", provider, ["A", "B", "C", "D", "E"]
+    )
+    assert sorted(prices) == ["A", "B", "E"]
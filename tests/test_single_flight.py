@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+from fakeredis import aioredis
+
+from app.core.single_flight import SingleFlight, acquire_lock, release_lock
+from app.services import price_service
+
+
+class GatedCall:
+    """A call that counts its runs and waits until released."""
+
+    def __init__(self, result=None, error: Exception = None):
+        self.calls = 0
+        self.result = result
+        self.error = error
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        if self.error:
+            raise self.error
+        return self.result
+
+
+async def settle():
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_share_one_run():
+    flight = SingleFlight()
+    call = GatedCall(result=42)
+    callers = [asyncio.create_task(flight.do("key", call)) for _ in range(5)]
+    await settle()
+    assert flight.in_flight("key")
+
+    call.release.set()
+    assert await asyncio.gather(*callers) == [42] * 5
+    assert call.calls == 1
+    assert not flight.in_flight("key")
+
+    # Once finished, the next call runs again.
+    assert await flight.do("key", call) == 42
+    assert call.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_every_caller_gets_the_exception():
+    flight = SingleFlight()
+    call = GatedCall(error=ConnectionError("upstream failed"))
+    callers = [asyncio.create_task(flight.do("key", call)) for _ in range(3)]
+    await settle()
+    call.release.set()
+
+    results = await asyncio.gather(*callers, return_exceptions=True)
+    assert all(isinstance(result, ConnectionError) for result in results)
+    assert call.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_a_cancelled_caller_leaves_the_call_running():
+    flight = SingleFlight()
+    call = GatedCall(result="done")
+    cancelled = asyncio.create_task(flight.do("key", call))
+    waiting = asyncio.create_task(flight.do("key", call))
+    await settle()
+
+    cancelled.cancel()
+    await settle()
+    call.release.set()
+    assert await waiting == "done"
+    assert cancelled.cancelled()
+
+
+@pytest.mark.asyncio
+async def test_keys_do_not_share_calls():
+    flight = SingleFlight()
+    call = GatedCall(result=1)
+    callers = [asyncio.create_task(flight.do(key, call)) for key in ("first", "second")]
+    await settle()
+    call.release.set()
+    await asyncio.gather(*callers)
+    assert call.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_only_the_owner_releases_a_lock():
+    redis = aioredis.FakeRedis(decode_responses=True)
+    token = await acquire_lock(redis, "lock", 5000)
+    assert token is not None
+    assert await acquire_lock(redis, "lock", 5000) is None
+
+    await release_lock(redis, "lock", "someone-else")
+    assert await redis.get("lock") == token
+    await release_lock(redis, "lock", token)
+    assert await acquire_lock(redis, "lock", 5000) is not None
+
+
+@pytest.mark.asyncio
+async def test_concurrent_cache_misses_share_one_refresh(monkeypatch):
+    refresh = GatedCall(result="price")
+
+    async def refresh_latest_price(symbol, provider_name, provider_service, redis):
+        return await refresh()
+
+    monkeypatch.setattr(price_service, "REDIS_LOCK_ENABLED", False)
+    monkeypatch.setattr(price_service, "refresh_latest_price", refresh_latest_price)
+    misses = [
+        asyncio.create_task(price_service.load_latest_price("A", "mock", None, None))
+        for _ in range(10)
+    ]
+    await settle()
+    refresh.release.set()
+    assert await asyncio.gather(*misses) == ["price"] * 10
+    assert refresh.calls == 1